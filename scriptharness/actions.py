@@ -16,6 +16,7 @@ import logging
 from scriptharness.exceptions import ScriptHarnessError, \
     ScriptHarnessException, ScriptHarnessFatal
 from scriptharness.status import SUCCESS, ERROR, FATAL
+from scriptharness.trace import span
 import sys
 import time
 
@@ -79,8 +80,12 @@ class Action(object):
 
       history (Dict[str, Any]): History of the action (return_value, status,
         start_time, end_time).
+
+      requires (Tuple[str, ...] or None): the names of the actions that
+        must finish before this action starts, or None if undeclared.
     """
-    def __init__(self, name, action_groups=None, function=None, enabled=True):
+    def __init__(self, name, action_groups=None, function=None, enabled=True,
+                 requires=None):
         r"""Create the Action object.
 
         Args:
@@ -100,6 +105,15 @@ class Action(object):
           enabled (Optional[bool]): Whether the action is enabled by default.
             This may be toggled by commandline options or configuration later.
 
+          requires (Optional[List[str]]): the names of actions that must
+            finish before this action starts, if they're enabled.  These
+            must be defined before this action in the Script's action list.
+            This only affects ordering; it doesn't enable the required
+            actions.  If None, the default, the action requires the
+            previous enabled action, so it runs in order even with
+            --action-workers; pass an empty list to let it run alongside
+            the others.
+
         Raises:
           scriptharness.exceptions.ScriptHarnessException: when the function
             is not found or not callable.
@@ -109,6 +123,7 @@ class Action(object):
         self.strings = deepcopy(STRINGS['action'])
         self.logger_name = "scriptharness.actions.%s" % self.name
         self.action_groups = action_groups or []
+        self.requires = None if requires is None else tuple(requires)
         self.history = {}
         if function is None:
             self.function = get_function_by_name(self.name.replace('-', '_'))
@@ -153,7 +168,9 @@ class Action(object):
             "action_msg_prefix": self.strings['action_msg_prefix'],
         }
         try:
-            self.run_function(context)
+            with span(getattr(self.function, '__name__', self.name),
+                      category="function", action=self.name):
+                self.run_function(context)
         except ScriptHarnessError as exc_info:
             self.history['status'] = ERROR
             logger.error(self.strings['error_message'], repl_dict)
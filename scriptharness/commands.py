@@ -4,30 +4,74 @@
 
 Attributes:
   LOGGER_NAME (str): default logging.Logger name.
+  RUNNER_MULTIPROCESSING (str): Command runner that reads the command's
+    output in a multiprocessing.Process.  This is the default.
+  RUNNER_PIPE (str): Command runner that reads the command's output directly
+    from a pipe in this process.
+  RUNNER_POOL (str): Command runner that runs the command from a reusable
+    worker in a scriptharness.pool.WorkerPool.
+  RUNNERS (Tuple[str, ...]): valid Command runners.
+  RUN_MANY_LABEL (str): the default prefix format for run_many() log lines.
+  RUN_MANY_MAX_RECORDS (int): the default number of log records run_many()
+    holds for a command before logging them early.
+  PRE_COMMAND (str): the listener phase before a command runs.
+  POST_COMMAND (str): the listener phase after a command runs, successful
+    or not.
+  LISTENER_PHASES (Tuple[str, ...]): valid phases for add_listener().
+  LISTENERS (Dict[str, List[Callable[[Command]]]]): the listeners for each
+    phase.  These are called for every Command, so use add_listener() and
+    remove_listener() rather than modifying this directly.
   STRINGS (Dict[str, Dict[str, str]]): Strings for logging.
+  DEFAULT_MEMORY_FRACTION (float): the fraction of the host's available
+    memory a Scheduler admits commands against, by default.
 """
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
+import collections
 from contextlib import contextmanager
 from copy import deepcopy
 import logging
-import multiprocessing
+import mmap
 import os
 import six
-import pprint
 from scriptharness.errorlists import ErrorList
 from scriptharness.exceptions import ScriptHarnessError, \
     ScriptHarnessException, ScriptHarnessFatal, ScriptHarnessTimeout
-from scriptharness.log import OutputParser
+from scriptharness.lazy import LazyModule
+from scriptharness.log import DEFAULT_BATCH_DELAY, DEFAULT_BATCH_LINES, \
+    OutputBatcher, OutputParser
+import scriptharness.pool
 import scriptharness.process
 import scriptharness.status
+from scriptharness.trace import span
 from scriptharness.unicode import to_unicode
+from six.moves.queue import Empty, Queue
 import subprocess
+import sys
 import tempfile
+import threading
+import time
+
+# pylint: disable=invalid-name
+multiprocessing = LazyModule("multiprocessing")
+pprint = LazyModule("pprint")
+psutil = LazyModule("psutil")
+# pylint: enable=invalid-name
 
 
 # Constants {{{1
 LOGGER_NAME = "scriptharness.commands"
+RUNNER_MULTIPROCESSING = "multiprocessing"
+RUNNER_PIPE = "pipe"
+RUNNER_POOL = "pool"
+RUNNERS = (RUNNER_MULTIPROCESSING, RUNNER_PIPE, RUNNER_POOL)
+RUN_MANY_LABEL = "[%(num)d/%(total)d] "
+RUN_MANY_MAX_RECORDS = 10000
+PRE_COMMAND = "pre_command"
+POST_COMMAND = "post_command"
+LISTENER_PHASES = (PRE_COMMAND, POST_COMMAND)
+LISTENERS = dict([(phase, []) for phase in LISTENER_PHASES])
+DEFAULT_MEMORY_FRACTION = .9
 STRINGS = {
     "check_output": {
         "pre_msg":
@@ -66,6 +110,15 @@ STRINGS = {
         "kill_hung_process": "Killing process that's still here",
         "temp_files": "Temporary files: stdout %(stdout)s; stderr %(stderr)s",
     },
+    "run_many": {
+        "start": "Running %(total)d commands with %(max_workers)d workers.",
+        "scheduler":
+            "Admitting commands against %(cores)s cores and %(memory)d MiB "
+            "of memory.",
+        "skip": "Skipping %(num)d commands after a failure.",
+        "failed": "%(num)d of %(total)d commands failed.",
+        "fatal": "Fatal: %(num)d of %(total)d commands failed.",
+    },
 }
 
 
@@ -98,6 +151,35 @@ def check_output(command, logger_name="scriptharness.commands.check_output",
     return output
 
 
+def universal_newlines(text):
+    """Translate '\\r\\n' and '\\r' line endings to '\\n', the way
+    reading a file in text mode does.
+
+    Args:
+      text (str): the text to translate
+
+    Returns:
+      text (str): the translated text
+    """
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def get_command_name(command):
+    """Get a short name for a command, e.g. for trace spans.
+
+    Args:
+      command (List[str] or str): the command.
+
+    Returns:
+      str: the basename of the executable.
+    """
+    if not isinstance(command, (list, tuple)):
+        command = command.split()
+    if not command:
+        return ""
+    return os.path.basename(command[0])
+
+
 def detect_errors(command):
     """Very basic detect_errors_cb for Command.
 
@@ -130,6 +212,54 @@ def detect_parsed_errors(command):
     return status
 
 
+def add_listener(listener, phase):
+    """Add a function to call for every Command at a specific phase.
+
+    PRE_COMMAND listeners are called before the command is started;
+    POST_COMMAND listeners are called after it finishes, successfully or
+    not, with the command's history filled in.  They're called in the
+    thread running the command.
+
+    Args:
+      listener (Callable[[Command]]): the function to call.
+
+      phase (str): when to call it; one of LISTENER_PHASES.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessException: on an invalid phase.
+    """
+    if phase not in LISTENER_PHASES:
+        raise ScriptHarnessException(
+            "Invalid phase for add_listener!", listener, phase
+        )
+    LISTENERS[phase].append(listener)
+
+
+def remove_listener(listener, phase):
+    """Remove a listener added by add_listener().
+
+    Args:
+      listener (Callable[[Command]]): the function to remove.
+
+      phase (str): the phase it was added to.
+    """
+    if listener in LISTENERS.get(phase, []):
+        LISTENERS[phase].remove(listener)
+
+
+def call_listeners(command, phase):
+    """Call the listeners for a phase, each in a trace span.
+
+    Args:
+      command (Command): the command to pass to the listeners.
+      phase (str): one of LISTENER_PHASES.
+    """
+    for listener in list(LISTENERS[phase]):
+        with span(getattr(listener, '__name__', phase), category="listener",
+                  phase=phase):
+            listener(command)
+
+
 # Command {{{1
 class Command(object):
     """Basic command: run and log output.  Stdout and stderr are interleaved
@@ -145,8 +275,14 @@ class Command(object):
       detect_error_cb (Callable[[Any], scriptharness.status]): this function
         determines whether the command was successful.
 
-      history (Dict[str, Any]): This dictionary holds the timestamps and status of
-        the command.
+      history (Dict[str, Any]): This dictionary holds the timestamps
+        (start_time, end_time), return_value and status of the command,
+        and the pid of the process that runs it (the multiprocessing
+        runner, or the command itself) once it's started.  `runner_pid` is
+        also set when that process is the multiprocessing runner, a fork of
+        the harness that starts the command as its child.  `spawn_time` is
+        how many seconds it took to start that process, or, for
+        RUNNER_POOL, to hand the command to a worker and have it start.
 
       kwargs (Dict[Any, Any]): These kwargs will be passed to subprocess.Popen, except
         for the optional 'output_timeout' and 'timeout', which are processed by
@@ -155,11 +291,64 @@ class Command(object):
         command can run, total.
 
       strings (Dict[str, str]): Strings to log.
+
+      runner (str): how to run the command; one of RUNNERS.
+        RUNNER_MULTIPROCESSING runs the command from a
+        multiprocessing.Process; RUNNER_PIPE runs the command directly and
+        reads its output in a thread, which avoids the extra fork and the
+        per-line pickling; RUNNER_POOL runs the command from a reusable
+        pool worker, which avoids starting a process per command.  Pooled
+        commands' kwargs must be picklable, so no preexec_fn.
+
+      pool (scriptharness.pool.WorkerPool): the pool for RUNNER_POOL.
+        Defaults to the shared pool from scriptharness.pool.get_pool().
+
+      spawn_backend (str): how to start the command; one of
+        scriptharness.process.SPAWN_BACKENDS.  SPAWN_POSIX uses
+        os.posix_spawn() where the kwargs allow it, which is cheaper than
+        fork() from a large harness, and falls back to subprocess.Popen
+        otherwise.  Defaults to SPAWN_POPEN.
+
+      batch_lines (int): while the command runs, its log records are sent
+        to the handlers in batches of up to this many records.  Set to 0 to
+        log each record immediately.
+
+      batch_delay (float): the most seconds a batched record is held.
+
+      cores (float): the estimated number of cores the command uses, for
+        Scheduler admission.
+
+      memory (int): the estimated peak memory the command uses, in bytes,
+        for Scheduler admission.
+
+      priority (int): commands with a higher priority are admitted first
+        by a Scheduler.
     """
-    def __init__(self, command, logger=None, detect_error_cb=None, **kwargs):
+    batch_lines = DEFAULT_BATCH_LINES
+    batch_delay = DEFAULT_BATCH_DELAY
+
+    def __init__(self, command, logger=None, detect_error_cb=None,
+                 runner=RUNNER_MULTIPROCESSING, cores=1, memory=0,
+                 priority=0, pool=None,
+                 spawn_backend=scriptharness.process.SPAWN_POPEN, **kwargs):
+        if runner not in RUNNERS:
+            raise ScriptHarnessException(
+                "Unknown runner %s!" % runner, RUNNERS
+            )
+        if spawn_backend not in scriptharness.process.SPAWN_BACKENDS:
+            raise ScriptHarnessException(
+                "Unknown spawn backend %s!" % spawn_backend,
+                scriptharness.process.SPAWN_BACKENDS
+            )
         self.command = command
         self.logger = logger or logging.getLogger(LOGGER_NAME)
         self.detect_error_cb = detect_error_cb or detect_errors
+        self.runner = runner
+        self.pool = pool
+        self.spawn_backend = spawn_backend
+        self.cores = cores
+        self.memory = memory
+        self.priority = priority
         self.history = {}
         self.kwargs = kwargs or {}
         self.strings = deepcopy(STRINGS['command'])
@@ -236,6 +425,85 @@ class Command(object):
         """
         self.logger.info(" %s", to_unicode(line.rstrip()))
 
+    def add_lines(self, lines):
+        """Log a batch of output lines.  The runners deliver output in
+        batches; override this for amortized processing.
+
+        By default this calls add_line() for each line, so subclasses that
+        only override add_line() still see every line.
+
+        Args:
+          lines (List[str]): lines of output
+        """
+        add_line = self.add_line
+        for line in lines:
+            add_line(line)
+
+    @contextmanager
+    def command_phases(self):
+        """Record the start and end times of the command, and call the
+        PRE_COMMAND and POST_COMMAND listeners around it.
+
+        If the command times out or errors before its status is known, the
+        status is set to TIMEOUT or ERROR so POST_COMMAND listeners see it.
+        """
+        with span(get_command_name(self.command), category="command",
+                  command=self.command):
+            self.history['start_time'] = time.time()
+            call_listeners(self, PRE_COMMAND)
+            try:
+                yield
+            except ScriptHarnessTimeout:
+                self.history.setdefault('status',
+                                        scriptharness.status.TIMEOUT)
+                raise
+            except ScriptHarnessError:
+                self.history.setdefault('status', scriptharness.status.ERROR)
+                raise
+            finally:
+                self.history['end_time'] = time.time()
+                call_listeners(self, POST_COMMAND)
+
+    @contextmanager
+    def batched_logs(self):
+        """Batch the command's log records for the duration, then flush
+        them.
+
+        The loggers are swapped for OutputBatcher stand-ins, so output
+        lines and any other messages logged through them (e.g. timeouts)
+        stay in order.  Levels are set before records reach the batcher,
+        so ParsedCommand context lines keep their levels.
+        """
+        if not self.batch_lines:
+            yield
+            return
+        batcher = OutputBatcher(max_lines=self.batch_lines,
+                                max_delay=self.batch_delay)
+        try:
+            with wrapped_loggers(self, batcher.wrap):
+                yield
+        finally:
+            batcher.close()
+
+    @contextmanager
+    def spawn_timer(self):
+        """Record how long the block takes to start the process in
+        history['spawn_time'].
+        """
+        start_time = time.time()
+        yield
+        self.history['spawn_time'] = time.time() - start_time
+
+    def spawn_kwargs(self):
+        """Get the kwargs for the scriptharness.process spawn functions.
+
+        Returns:
+          Dict[str, Any]: self.kwargs, plus the spawn_backend.
+        """
+        kwargs = dict(self.kwargs)
+        kwargs['spawn_backend'] = self.spawn_backend
+        return kwargs
+
     def finish_process(self):
         """Here for subclassing.
         """
@@ -244,39 +512,115 @@ class Command(object):
                 self.strings["error"] % {'command': self.command,}
             )
 
-    def run(self):
-        """Run the command.
+    def run_multiprocessing(self, output_timeout=None, max_timeout=None):
+        """Run the command from a multiprocessing.Process, and watch its
+        output queue.
 
-        Raises:
-          scriptharness.exceptions.ScriptHarnessError on error
+        Args:
+          output_timeout (Optional[int]): passed to watch_command_events()
+          max_timeout (Optional[int]): passed to watch_command_events()
+
+        Returns:
+          int: the exit code of the command.
         """
-        if 'env' in self.kwargs:
-            self.kwargs['env'] = self.fix_env(self.kwargs['env'])
-        self.log_start()
-        output_timeout = self.kwargs.get('output_timeout', None)
-        if 'output_timeout' in self.kwargs:
-            del self.kwargs['output_timeout']
-        max_timeout = self.kwargs.get('timeout', None)
-        if 'timeout' in self.kwargs:
-            del self.kwargs['timeout']
-        if isinstance(self.command, (list, tuple)):
-            self.kwargs.setdefault('shell', False)
-        else:
-            self.kwargs.setdefault('shell', True)
         queue = multiprocessing.Queue()  # pylint: disable=no-member
         runner = multiprocessing.Process(  # pylint: disable=not-callable
-            target=scriptharness.process.command_subprocess,
+            target=scriptharness.process.command_subprocess_batched,
             args=(queue, self.command),
-            kwargs=self.kwargs,
+            kwargs=self.spawn_kwargs(),
         )
-        runner.start()
-        self.history['return_value'] = scriptharness.process.watch_command(
+        with self.spawn_timer():
+            runner.start()
+        self.history['pid'] = self.history['runner_pid'] = runner.pid
+        return scriptharness.process.watch_command_events(
             self.logger, queue, runner, self.add_line,
-            output_timeout=output_timeout, max_timeout=max_timeout
+            output_timeout=output_timeout, max_timeout=max_timeout,
+            add_lines_cb=self.add_lines
+        )
+
+    def run_pipe(self, output_timeout=None, max_timeout=None):
+        """Run the command directly, and read its output from a pipe.
+
+        Args:
+          output_timeout (Optional[int]): passed to watch_pipe()
+          max_timeout (Optional[int]): passed to watch_pipe()
+
+        Returns:
+          int: the exit code of the command.
+        """
+        with self.spawn_timer():
+            handle = scriptharness.process.pipe_subprocess(
+                self.command, **self.spawn_kwargs()
+            )
+        self.history['pid'] = handle.pid
+        return scriptharness.process.watch_pipe(
+            self.logger, handle, self.add_line,
+            output_timeout=output_timeout, max_timeout=max_timeout,
+            add_lines_cb=self.add_lines
         )
-        self.history['status'] = self.detect_error_cb(self)
-        self.finish_process()
-        return self.history['status']
+
+    def run_pool(self, output_timeout=None, max_timeout=None):
+        """Run the command from a pool worker, and watch its output.
+
+        Args:
+          output_timeout (Optional[int]): passed to PoolWorker.watch()
+          max_timeout (Optional[int]): passed to PoolWorker.watch()
+
+        Returns:
+          int: the exit code of the command.
+        """
+        pool = self.pool or scriptharness.pool.get_pool()
+        kwargs = self.spawn_kwargs()
+        # The worker keeps the cwd and environment it started with, so
+        # send ours, as a forked runner would inherit them.
+        kwargs.setdefault('cwd', os.getcwd())
+        if kwargs.get('env') is None:
+            kwargs['env'] = dict(os.environ)
+        with pool.worker() as worker:
+            with self.spawn_timer():
+                self.history['pid'] = worker.start_command(self.command,
+                                                           kwargs)
+            return worker.watch(
+                self.logger, self.add_line, output_timeout=output_timeout,
+                max_timeout=max_timeout, add_lines_cb=self.add_lines
+            )
+
+    def run(self):
+        """Run the command.
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessError on error
+        """
+        with self.command_phases():
+            if 'env' in self.kwargs:
+                self.kwargs['env'] = self.fix_env(self.kwargs['env'])
+            self.log_start()
+            output_timeout = self.kwargs.get('output_timeout', None)
+            if 'output_timeout' in self.kwargs:
+                del self.kwargs['output_timeout']
+            max_timeout = self.kwargs.get('timeout', None)
+            if 'timeout' in self.kwargs:
+                del self.kwargs['timeout']
+            if isinstance(self.command, (list, tuple)):
+                self.kwargs.setdefault('shell', False)
+            else:
+                self.kwargs.setdefault('shell', True)
+            with self.batched_logs():
+                if self.runner == RUNNER_PIPE:
+                    self.history['return_value'] = self.run_pipe(
+                        output_timeout=output_timeout, max_timeout=max_timeout
+                    )
+                elif self.runner == RUNNER_POOL:
+                    self.history['return_value'] = self.run_pool(
+                        output_timeout=output_timeout, max_timeout=max_timeout
+                    )
+                else:
+                    self.history['return_value'] = self.run_multiprocessing(
+                        output_timeout=output_timeout, max_timeout=max_timeout
+                    )
+            self.history['status'] = self.detect_error_cb(self)
+            self.finish_process()
+            return self.history['status']
 
 
 # ParsedCommand {{{1
@@ -308,6 +652,21 @@ class ParsedCommand(Command):
         """
         self.parser.add_line(line)
 
+    def add_lines(self, lines):
+        """Send a batch of lines to the parser.
+
+        If a subclass overrides add_line(), each line goes through it
+        instead, so the override still sees every line.
+
+        Args:
+          lines (List[str]): lines of output
+        """
+        if six.get_unbound_function(type(self).add_line) is \
+                six.get_unbound_function(ParsedCommand.add_line):
+            self.parser.add_lines(lines)
+        else:
+            Command.add_lines(self, lines)
+
 
 # Output {{{1
 class Output(Command):
@@ -349,56 +708,153 @@ class Output(Command):
     def run(self):
         """Output.run()
         """
-        if 'env' in self.kwargs:
-            self.kwargs['env'] = self.fix_env(self.kwargs['env'])
-        self.log_start()
-        output_timeout = self.kwargs.get('output_timeout', None)
-        if 'output_timeout' in self.kwargs:
-            del self.kwargs['output_timeout']
-        max_timeout = self.kwargs.get('timeout', None)
-        if 'timeout' in self.kwargs:
-            del self.kwargs['timeout']
-        if isinstance(self.command, (list, tuple)):
-            self.kwargs.setdefault('shell', False)
-        else:
-            self.kwargs.setdefault('shell', True)
-        self.kwargs['stdout'] = self.stdout.file
-        self.kwargs['stderr'] = self.stderr.file
-        try:
-            process = subprocess.Popen(self.command, **self.kwargs)
-        except OSError as exc_info:
-            raise ScriptHarnessError(
-                "Can't run command!", self.command, exc_info
-            )
-        self.history['return_value'] = scriptharness.process.watch_output(
-            self.logger, process, self.stdout, self.stderr,
-            output_timeout=output_timeout, max_timeout=max_timeout
-        )
-        self.history['status'] = self.detect_error_cb(self)
-        self.finish_process()
-        return self.history['status']
+        with self.command_phases():
+            if 'env' in self.kwargs:
+                self.kwargs['env'] = self.fix_env(self.kwargs['env'])
+            self.log_start()
+            output_timeout = self.kwargs.get('output_timeout', None)
+            if 'output_timeout' in self.kwargs:
+                del self.kwargs['output_timeout']
+            max_timeout = self.kwargs.get('timeout', None)
+            if 'timeout' in self.kwargs:
+                del self.kwargs['timeout']
+            if isinstance(self.command, (list, tuple)):
+                self.kwargs.setdefault('shell', False)
+            else:
+                self.kwargs.setdefault('shell', True)
+            self.kwargs['stdout'] = self.stdout.file
+            self.kwargs['stderr'] = self.stderr.file
+            try:
+                with self.spawn_timer():
+                    process = scriptharness.process.spawn_subprocess(
+                        self.command, **self.spawn_kwargs()
+                    )
+            except OSError as exc_info:
+                raise ScriptHarnessError(
+                    "Can't run command!", self.command, exc_info
+                )
+            self.history['pid'] = process.pid
+            self.history['return_value'] = \
+                scriptharness.process.watch_output_events(
+                    self.logger, process, self.stdout, self.stderr,
+                    output_timeout=output_timeout, max_timeout=max_timeout
+                )
+            self.history['status'] = self.detect_error_cb(self)
+            self.finish_process()
+            return self.history['status']
+
+    def get_handle(self, handle_name="stdout"):
+        """Get the temp file for stdout or stderr.
+
+        Args:
+          handle_name (Optional["stdout" or "stderr"]): the handle to get.
+            Defaults to "stdout"
+
+        Returns:
+          NamedTemporaryFile: self.stdout or self.stderr
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessException: on a bad
+            handle_name.
+        """
+        if handle_name not in ("stdout", "stderr"):
+            raise ScriptHarnessException("Bad handle for get_output: %s" %
+                                         handle_name)
+        return getattr(self, handle_name)
 
     def get_output(self, handle_name="stdout", text=True):
-        """Get output from file.  This reads the output into memory, so
-        this is not appropriate for large amounts of output.
+        """Get output from file.  The file is read through iter_chunks(),
+        but the returned output is still held in memory, so this is not
+        appropriate for large amounts of output; use iter_lines(),
+        iter_chunks(), or mmap_output() for those.
 
         Args:
           handle_name (Optional["stdout" or "stderr"]): the handle to read
             from.  Defaults to "stdout"
 
           text (Optional[bool]): whether the output is text.  If so, run
-            output through to_unicode() and rstrip().  Defaults to True.
+            output through to_unicode(), translate '\\r\\n' and '\\r'
+            line endings to '\\n', and rstrip().  Otherwise return the raw
+            bytes.  Defaults to True.
         """
-        if handle_name not in ("stdout", "stderr"):
-            raise ScriptHarnessException("Bad handle for get_output: %s" %
-                                         handle_name)
-        handle = getattr(self, handle_name)
-        with open(handle.name) as filehandle:
-            contents = filehandle.read()
+        contents = b''.join(self.iter_chunks(handle_name))
         if text:
-            contents = to_unicode(contents).rstrip()
+            contents = universal_newlines(to_unicode(contents)).rstrip()
         return contents
 
+    def iter_chunks(self, handle_name="stdout",
+                    chunk_size=scriptharness.process.CHUNK_SIZE):
+        """Iterate over the output as byte chunks, without reading it all
+        into memory.
+
+        Args:
+          handle_name (Optional["stdout" or "stderr"]): the handle to read
+            from.  Defaults to "stdout"
+
+          chunk_size (Optional[int]): the most bytes to read at a time.
+
+        Yields:
+          bytes: the next chunk of output.
+        """
+        handle = self.get_handle(handle_name)
+        with open(handle.name, 'rb') as filehandle:
+            while True:
+                chunk = filehandle.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def iter_lines(self, handle_name="stdout", text=True):
+        """Iterate over the output a line at a time, without reading it all
+        into memory.
+
+        Args:
+          handle_name (Optional["stdout" or "stderr"]): the handle to read
+            from.  Defaults to "stdout"
+
+          text (Optional[bool]): whether the output is text.  If so, strip
+            the line ending and run each line through to_unicode().
+            Otherwise yield the raw bytes, line ending included.  Defaults
+            to True.
+
+        Yields:
+          str or bytes: the next line of output.
+        """
+        handle = self.get_handle(handle_name)
+        with open(handle.name, 'rb') as filehandle:
+            for line in filehandle:
+                if text:
+                    line = to_unicode(line.rstrip(b'\r\n'))
+                yield line
+
+    @contextmanager
+    def mmap_output(self, handle_name="stdout"):
+        """Map the output file into memory read-only, for zero-copy
+        slicing and searching of large output.
+
+        The map is closed on exit, so don't keep references to it, or to
+        memoryviews of it, past the with block.
+
+        Args:
+          handle_name (Optional["stdout" or "stderr"]): the handle to map.
+            Defaults to "stdout"
+
+        Yields:
+          mmap.mmap: the mapped output.  Empty files can't be mapped, so
+            this is an empty bytes string if there's no output.
+        """
+        handle = self.get_handle(handle_name)
+        with open(handle.name, 'rb') as filehandle:
+            if not os.fstat(filehandle.fileno()).st_size:
+                yield b''
+                return
+            mapped = mmap.mmap(filehandle.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
     def cleanup(self):
         """Best effort cleanup of stdout and stderr temp files.
         """
@@ -435,22 +891,35 @@ def run(command, cmd_class=Command, halt_on_failure=False, *args, **kwargs):
     Raises:
       scriptharness.exceptions.ScriptHarnessFatal: on fatal error
     """
+    cmd = cmd_class(command, *args, **kwargs)
+    message = run_command(cmd)
+    if halt_on_failure and message:
+        raise ScriptHarnessFatal("Fatal %s" % message)
+    return cmd
+
+
+def run_command(cmd):
+    """Run a Command instance, recording errors and timeouts in its history
+    rather than raising them.
+
+    Args:
+      cmd (Command): the command to run.
+
+    Returns:
+      str: a description of the failure, or "" on success.
+    """
     message = ""
     try:
-        cmd = cmd_class(command, *args, **kwargs)
         cmd.run()
-        return cmd
+        return message
     except ScriptHarnessError as exc_info:
         message = "error: %s" % exc_info
         status = scriptharness.status.ERROR
     except ScriptHarnessTimeout as exc_info:
         message = "timeout: %s" % exc_info
         status = scriptharness.status.TIMEOUT
-    if halt_on_failure and message:
-        raise ScriptHarnessFatal("Fatal %s" % message)
-    else:
-        cmd.history.setdefault('status', status)
-        return cmd
+    cmd.history.setdefault('status', status)
+    return message
 
 
 # parse {{{1
@@ -474,6 +943,524 @@ def parse(command, **kwargs):
     return run(command, cmd_class=ParsedCommand, **kwargs)
 
 
+# wrapped_loggers {{{1
+@contextmanager
+def wrapped_loggers(cmd, wrap):
+    """Temporarily replace the command's loggers with wrap(logger).
+
+    The parser and context buffer of a ParsedCommand have their own
+    loggers; those are wrapped as well.
+
+    Args:
+      cmd (Command): the command to wrap the loggers of.
+
+      wrap (Callable[[logging.Logger], Any]): returns the logger stand-in.
+    """
+    objs = [cmd]
+    parser = getattr(cmd, 'parser', None)
+    if parser is not None:
+        objs.append(parser)
+        if getattr(parser, 'context_buffer', None) is not None:
+            objs.append(parser.context_buffer)
+    loggers = [obj.logger for obj in objs]
+    for obj, logger in zip(objs, loggers):
+        obj.logger = wrap(logger)
+    try:
+        yield
+    finally:
+        for obj, logger in zip(objs, loggers):
+            obj.logger = logger
+
+
+# GroupedLogger {{{1
+class GroupedLogger(object):
+    """Stand-in logger that holds a command's log records, so commands
+    running concurrently can each log as a single group rather than
+    interleaving their output.
+
+    Records below the wrapped logger's level are dropped straight away.
+    Everything else is delegated to the wrapped logger.
+
+    Attributes:
+      logger (logging.Logger): the logger the records will be replayed to.
+
+      records (list): the shared list of (logger, level, msg, args, kwargs)
+        records.  Several GroupedLoggers can share one list to keep a
+        command's records, including its parser's, in order.
+
+      max_records (int): call flush_cb once the list holds this many
+        records.  0 means no limit.
+
+      flush_cb (Callable[[], None]): replays and empties the records, so a
+        long or verbose command doesn't hold all its output in memory.
+    """
+    def __init__(self, logger, records, max_records=0, flush_cb=None):
+        self.logger = logger
+        self.records = records
+        self.max_records = max_records
+        self.flush_cb = flush_cb
+
+    def __getattr__(self, name):
+        if name == 'logger':
+            raise AttributeError(name)
+        return getattr(self.logger, name)
+
+    def isEnabledFor(self, level):  # pylint: disable=invalid-name
+        """logging.Logger.isEnabledFor() wrapper"""
+        is_enabled_for = getattr(self.logger, 'isEnabledFor', None)
+        if is_enabled_for is None:
+            return True
+        return is_enabled_for(level)
+
+    def log(self, level, msg, *args, **kwargs):
+        """Hold a record to replay later.
+
+        Takes the same keyword arguments as logging.Logger.log().  exc_info
+        is resolved now, while the exception is being handled.
+        """
+        if not self.isEnabledFor(level):
+            return
+        exc_info = kwargs.get('exc_info')
+        if exc_info and not isinstance(exc_info, (tuple, BaseException)):
+            kwargs['exc_info'] = sys.exc_info()
+        self.records.append((self.logger, level, msg, args, kwargs))
+        if self.flush_cb is not None and self.max_records and \
+                len(self.records) >= self.max_records:
+            self.flush_cb()
+
+    def debug(self, *args, **kwargs):
+        """debug() wrapper"""
+        self.log(logging.DEBUG, *args, **kwargs)
+
+    def info(self, *args, **kwargs):
+        """info() wrapper"""
+        self.log(logging.INFO, *args, **kwargs)
+
+    def warning(self, *args, **kwargs):
+        """warning() wrapper"""
+        self.log(logging.WARNING, *args, **kwargs)
+
+    def error(self, *args, **kwargs):
+        """error() wrapper"""
+        self.log(logging.ERROR, *args, **kwargs)
+
+    def exception(self, *args, **kwargs):
+        """exception() wrapper"""
+        kwargs.setdefault('exc_info', True)
+        self.log(logging.ERROR, *args, **kwargs)
+
+    def critical(self, *args, **kwargs):
+        """critical() wrapper"""
+        self.log(logging.CRITICAL, *args, **kwargs)
+
+
+@contextmanager
+def grouped_logs(cmd, records, max_records=0, flush_cb=None):
+    """Point the command's loggers at GroupedLoggers for the duration.
+
+    Args:
+      cmd (Command): the command to group the logs of.
+
+      records (list): the list to hold the records in.
+
+      max_records (Optional[int]): passed to GroupedLogger.
+
+      flush_cb (Optional[Callable[[], None]]): passed to GroupedLogger.
+
+    Yields:
+      records (list)
+    """
+    def wrap(logger):
+        """Get the GroupedLogger"""
+        return GroupedLogger(logger, records, max_records=max_records,
+                             flush_cb=flush_cb)
+
+    with wrapped_loggers(cmd, wrap):
+        yield records
+
+
+def replay_records(records, prefix):
+    """Log the records held by GroupedLoggers, with a prefix.
+
+    Args:
+      records (list): the (logger, level, msg, args, kwargs) records.
+
+      prefix (str): the string to prepend to each message.
+    """
+    prefix = prefix.replace('%', '%%')
+    for logger, level, msg, args, kwargs in records:
+        logger.log(level, prefix + msg, *args, **kwargs)
+
+
+# Scheduler {{{1
+SchedulerTicket = collections.namedtuple(
+    'SchedulerTicket',
+    ['seq', 'priority', 'group', 'cores', 'memory', 'queued_time']
+)
+"""A request to run something under a Scheduler.
+"""
+
+
+class Scheduler(object):
+    """Admit commands to run against the host's cores and memory, so
+    concurrent commands don't overload or OOM the host.
+
+    Each command declares its estimated `cores` and `memory`.  A command is
+    admitted once it fits alongside the running commands' reservations.  A
+    command that's bigger than the capacity is admitted once nothing else
+    is running.  If `check_memory` is True, the host's available memory,
+    from psutil, must also fit the command, since other processes use
+    memory too.
+
+    Waiting commands are admitted highest `priority` first.  Commands of
+    equal priority are fair-queued between groups.  By default, a group is
+    the thread that called run_many().  The group that has been charged the
+    least so far goes next, and a command is charged its cores, at least 1.
+    So one big run_many() can't starve another.  Within a group, commands
+    are admitted in the order they arrived.  Only the next command in this
+    order can be admitted, so small commands can't starve a large one.
+
+    Attributes:
+      cores (float): the cores to admit commands against.  Defaults to
+        psutil.cpu_count().
+
+      memory (int): the memory to admit commands against, in bytes.
+        Defaults to DEFAULT_MEMORY_FRACTION of the host's available memory
+        when the Scheduler is created.
+
+      check_memory (bool): whether to check the host's available memory
+        before admitting a command.
+
+      poll_interval (float): how often waiting commands recheck the host's
+        available memory.
+
+      condition (threading.Condition): protects the scheduler state.
+
+      num_tickets (int): the number of tickets handed out so far.
+
+      waiting (List[SchedulerTicket]): the waiting tickets.
+
+      reserved_cores (float): the cores reserved by running commands.
+
+      reserved_memory (int): the memory reserved by running commands.
+
+      group_running (Dict[str, int]): the number of running commands in each
+        group.
+
+      group_usage (Dict[str, float]): what each group has been charged.
+
+      stats (Dict[str, Any]): the number of commands `admitted`, and their
+        `total_wait` and `max_wait` in the queue, in seconds.
+    """
+    def __init__(self, cores=None, memory=None, check_memory=True,
+                 poll_interval=.5):
+        if cores is None:
+            cores = psutil.cpu_count() or 1
+        if memory is None:
+            memory = int(psutil.virtual_memory().available *
+                         DEFAULT_MEMORY_FRACTION)
+        self.cores = cores
+        self.memory = memory
+        self.check_memory = check_memory
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.num_tickets = 0
+        self.waiting = []
+        self.reserved_cores = 0
+        self.reserved_memory = 0
+        self.group_running = {}
+        self.group_usage = {}
+        self.stats = {'admitted': 0, 'total_wait': 0., 'max_wait': 0.}
+
+    @property
+    def running(self):
+        """int: the number of running commands."""
+        return sum(self.group_running.values())
+
+    def next_ticket(self):
+        """Get the ticket that's next in line.  Call with the condition
+        held.
+
+        Returns:
+          SchedulerTicket: the highest priority ticket of the least charged
+            group, first come first served.
+        """
+        return min(self.waiting, key=lambda ticket: (
+            -ticket.priority, self.group_usage[ticket.group], ticket.seq
+        ))
+
+    def fits(self, ticket):
+        """Can the ticket run now?  Call with the condition held.
+
+        Args:
+          ticket (SchedulerTicket): the ticket to check.
+
+        Returns:
+          bool: True if the ticket can be admitted.
+        """
+        if not self.running:
+            return True
+        if self.reserved_cores + ticket.cores > self.cores or \
+                self.reserved_memory + ticket.memory > self.memory:
+            return False
+        if self.check_memory and ticket.memory and \
+                psutil.virtual_memory().available < ticket.memory:
+            return False
+        return True
+
+    def acquire(self, cores=1, memory=0, priority=0, group=None):
+        """Wait until a command with these needs can run, and reserve its
+        cores and memory.
+
+        Args:
+          cores (Optional[float]): the estimated cores.  Defaults to 1.
+
+          memory (Optional[int]): the estimated memory, in bytes.
+
+          priority (Optional[int]): higher priorities are admitted first.
+
+          group (Optional[str]): the group to fair-queue in.  Defaults to
+            the current thread's name.
+
+        Returns:
+          SchedulerTicket: pass to release() when the command is done.
+        """
+        if group is None:
+            group = threading.current_thread().name
+        with self.condition:
+            self.num_tickets += 1
+            if not self.group_running.get(group) and \
+                    group not in [x.group for x in self.waiting]:
+                # A newly active group starts level with the active groups,
+                # rather than catching up on what it missed while idle.
+                active = [self.group_usage[x.group] for x in self.waiting] + [
+                    self.group_usage[name]
+                    for name, num in self.group_running.items() if num
+                ]
+                usage = self.group_usage.get(group, 0)
+                if active:
+                    usage = max(usage, min(active))
+                self.group_usage[group] = usage
+            ticket = SchedulerTicket(
+                seq=self.num_tickets, priority=priority, group=group,
+                cores=cores, memory=memory, queued_time=time.time()
+            )
+            self.waiting.append(ticket)
+            while self.next_ticket() is not ticket or not self.fits(ticket):
+                self.condition.wait(self.poll_interval)
+            self.waiting.remove(ticket)
+            self.reserved_cores += cores
+            self.reserved_memory += memory
+            self.group_running[group] = self.group_running.get(group, 0) + 1
+            self.group_usage[group] += max(cores, 1)
+            wait = time.time() - ticket.queued_time
+            self.stats['admitted'] += 1
+            self.stats['total_wait'] += wait
+            self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+            # The next ticket in line may fit too.
+            self.condition.notify_all()
+        return ticket
+
+    def release(self, ticket):
+        """Release a ticket's reservation.
+
+        Args:
+          ticket (SchedulerTicket): the ticket from acquire().
+        """
+        with self.condition:
+            self.reserved_cores -= ticket.cores
+            self.reserved_memory -= ticket.memory
+            self.group_running[ticket.group] -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, command, group=None):
+        """Wait until the command can run, and hold its reservation for
+        the duration.  The time spent waiting is saved in
+        command.history['queue_wait'].
+
+        Args:
+          command (Command): the command, with its cores, memory and
+            priority.
+
+          group (Optional[str]): the group to fair-queue in.  Defaults to
+            the current thread's name.
+
+        Yields:
+          SchedulerTicket: the ticket.
+        """
+        start_time = time.time()
+        ticket = self.acquire(
+            cores=getattr(command, 'cores', 1),
+            memory=getattr(command, 'memory', 0),
+            priority=getattr(command, 'priority', 0), group=group
+        )
+        command.history['queue_wait'] = time.time() - start_time
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+
+# run_many {{{1
+def run_many(commands, cmd_class=Command, max_workers=None, fail_fast=False,
+             halt_on_failure=False, label=RUN_MANY_LABEL, scheduler=None,
+             max_records=RUN_MANY_MAX_RECORDS, **kwargs):
+    """Run a number of independent commands concurrently.
+
+    Each command's log records are held until it finishes, then logged
+    together, each line prefixed with `label`.  A command that logs more
+    than `max_records` records has them logged in groups of that size
+    as it goes, so its output isn't all held in memory.
+
+    Args:
+      commands (List[Command or List[str] or str]): the commands to run.
+        Command lines are turned into `cmd_class` instances with `kwargs`;
+        Command instances are run as-is.
+
+      cmd_class (Optional[Command subclass]): the class to instantiate.
+        Defaults to scriptharness.commands.Command.
+
+      max_workers (Optional[int]): the most commands to run at once.
+        Defaults to multiprocessing.cpu_count().
+
+      fail_fast (Optional[bool]): if True, don't start any more commands
+        after one fails.  Commands that are already running finish.
+        Commands that never start have an empty history.  Default: False
+
+      halt_on_failure (Optional[bool]): raise ScriptHarnessFatal, once the
+        running commands finish, if any command failed.  Default: False
+
+      label (Optional[str]): the prefix format for each log line, with
+        `num` and `total` available.  Defaults to RUN_MANY_LABEL.
+
+      scheduler (Optional[Scheduler]): if set, each command waits for the
+        scheduler to admit it, and its time waiting is saved in
+        cmd.history['queue_wait'].  Commands are started highest priority
+        first.  A scheduler can be shared between concurrent run_many()
+        calls; each call is a separate group for fair queuing.
+
+      max_records (Optional[int]): the most log records to hold for each
+        command; 0 means no limit.  Defaults to RUN_MANY_MAX_RECORDS.
+
+      **kwargs: kwargs for cmd_class.
+
+    Returns:
+      List[Command]: the commands, in the order given.  The status of each
+        is in cmd.history['status'].
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessFatal: when halt_on_failure is
+        True and a command failed.
+    """
+    logger = kwargs.get('logger') or logging.getLogger(LOGGER_NAME)
+    cmds = []
+    for command in commands:
+        if not isinstance(command, Command):
+            command = cmd_class(command, **kwargs)
+        cmds.append(command)
+    total = len(cmds)
+    if not total:
+        return cmds
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    max_workers = max(1, min(max_workers, total))
+    logger.info(STRINGS['run_many']['start'],
+                {'total': total, 'max_workers': max_workers})
+    order = list(range(total))
+    group = threading.current_thread().name
+    if scheduler is not None:
+        logger.info(STRINGS['run_many']['scheduler'], {
+            'cores': scheduler.cores, 'memory': scheduler.memory // 1048576,
+        })
+        order.sort(key=lambda num: -cmds[num].priority)
+    todo = Queue()
+    for num in order:
+        todo.put((num, cmds[num]))
+    lock = threading.Lock()
+    state = {'failed': 0, 'stop': False, 'exc_info': None}
+
+    def worker():
+        """Run commands from todo until it's empty or we're stopping."""
+        while not state['stop']:
+            try:
+                num, cmd = todo.get_nowait()
+            except Empty:
+                return
+            records = []
+            message = ""
+
+            def flush(records=records, num=num):
+                """Log the held records early, as a group."""
+                with lock:
+                    replay_records(records, label % {'num': num + 1,
+                                                     'total': total})
+                del records[:]
+
+            try:
+                with grouped_logs(cmd, records, max_records=max_records,
+                                  flush_cb=flush):
+                    if scheduler is None:
+                        message = run_command(cmd)
+                    else:
+                        with scheduler.reserve(cmd, group=group):
+                            if state['stop']:
+                                # Stopped while waiting; leave it unrun.
+                                cmd.history.pop('queue_wait', None)
+                                todo.put((num, cmd))
+                                return
+                            message = run_command(cmd)
+            except Exception:  # pylint: disable=broad-except
+                message = "exception"
+                with lock:
+                    if state['exc_info'] is None:
+                        state['exc_info'] = sys.exc_info()
+                    state['stop'] = True
+            with lock:
+                replay_records(records, label % {'num': num + 1,
+                                                 'total': total})
+                if message:
+                    state['failed'] += 1
+                    if fail_fast:
+                        state['stop'] = True
+
+    threads = [threading.Thread(target=worker) for _ in range(max_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if state['exc_info'] is not None:
+        six.reraise(*state['exc_info'])
+    if not todo.empty():
+        logger.warning(STRINGS['run_many']['skip'], {'num': todo.qsize()})
+    if state['failed']:
+        repl_dict = {'num': state['failed'], 'total': total}
+        if halt_on_failure:
+            raise ScriptHarnessFatal(STRINGS['run_many']['fatal'] % repl_dict)
+        logger.error(STRINGS['run_many']['failed'], repl_dict)
+    return cmds
+
+
+def parse_many(commands, **kwargs):
+    """Shortcut for running a number of ParsedCommands concurrently.
+
+    Args:
+      commands (List[ParsedCommand or List[str] or str]): the commands to
+        run.
+
+      **kwargs: kwargs for run_many/ParsedCommand.
+
+    Returns:
+      List[ParsedCommand]: the commands, in the order given.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessFatal: when halt_on_failure is
+        True and a command failed.
+    """
+    return run_many(commands, cmd_class=ParsedCommand, **kwargs)
+
+
 # get_output {{{1
 @contextmanager
 def get_output(command, halt_on_failure=False, **kwargs):
@@ -524,24 +1511,45 @@ def get_output(command, halt_on_failure=False, **kwargs):
         cmd.cleanup()
 
 # get_text_output {{{1
-def get_text_output(command, level=logging.INFO, **kwargs):
+def get_text_output(command, level=logging.INFO, tail=None, **kwargs):
     """Run command and return the raw stdout from that command.
     Because we log the output, we're assuming the output is text.
 
+    The output is read and logged a line at a time, so only the returned
+    output is held in memory.  Use `tail` to bound that for very large
+    output.
+
     Args:
       command (List[str] or str): command for subprocess.Popen
 
       level (int): logging level
 
+      tail (Optional[int]): if set, only return the last `tail` lines of
+        output.  All lines are still logged.  Defaults to None.
+
       **kwargs: kwargs to send to scriptharness.commands.Output
 
     Returns:
       output (str): the stdout from the command.
     """
-    cmd = Output(command, **kwargs)
+    lines = collections.deque(maxlen=tail)
+    blank = []
     with get_output(command, **kwargs) as cmd:
-        output = cmd.get_output()
         cmd.logger.log(level, "Got output:")
-        for line in output.splitlines():
-            cmd.logger.log(level, " {}".format(line.rstrip()))
-    return output
+        for raw_line in cmd.iter_lines(text=False):
+            text = universal_newlines(to_unicode(raw_line))
+            if text.endswith('\n'):
+                text = text[:-1]
+            for line in text.split('\n'):
+                lines.append(line)
+                # Log the same way splitlines() on the whole rstripped
+                # output did: hold back blank lines until we know they
+                # aren't trailing.
+                for part in (line + '\n').splitlines():
+                    if not part.strip():
+                        blank.append(part)
+                        continue
+                    for pending in blank + [part]:
+                        cmd.logger.log(level, " {}".format(pending.rstrip()))
+                    del blank[:]
+    return '\n'.join(lines).rstrip()
@@ -11,32 +11,53 @@ Attributes:
   STRINGS (Dict[str, Dict[str, str]]): strings for ConfigVariable
   DEFAULT_CONFIG_DEFINITION (Dict[str, Dict[str, Any]]): Config definition to create the default
     ConfigTemplate for all scriptharness scripts.
+  DEFAULT_CONFIG_WORKERS (int): the maximum number of config files to fetch
+    and parse at once
+  DOWNLOAD_CHUNK_SIZE (int): the default chunk size for download_url()
+  PARTIAL_SUFFIX (str): the suffix for partial downloads, which
+    download_url() resumes
+  VALIDATOR_SUFFIX (str): the suffix, after PARTIAL_SUFFIX, of the file
+    that holds a partial download's ETag or Last-Modified header
 """
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
 import argparse
+import hashlib
 import json
 import logging
 import os
 import re
-import requests
-from requests.exceptions import RequestException, Timeout
 from scriptharness.actions import Action
 from scriptharness.exceptions import ScriptHarnessException, \
     ScriptHarnessTimeout
+from scriptharness.lazy import LazyModule
 from scriptharness.structures import iterate_pairs
 from scriptharness.unicode import to_unicode
 import six
+from six.moves.queue import Empty, Queue
 import six.moves.urllib as urllib
 import sys
+import tempfile
+import threading
 import time
 
+# pylint: disable=invalid-name
+requests = LazyModule("requests")
+requests_exceptions = LazyModule("requests.exceptions")
+# pylint: enable=invalid-name
 
 LOGGER_NAME = "scriptharness.config"
 OPTION_REGEX = re.compile(r'^-{1,2}[a-zA-Z0-9]\S*$')
 VALID_ARGPARSE_ACTIONS = (None, 'store', 'store_const', 'store_true',
                           'store_false', 'append', 'append_const', 'count',
                           'help', 'version', 'parsers')
+DEFAULT_CONFIG_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+PARTIAL_SUFFIX = ".part"
+VALIDATOR_SUFFIX = ".validator"
+# Shared requests.Sessions, per scheme://host:port; see get_session()
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
 STRINGS = {
     "config_variable": {
         "missing_required": "%(name)s is required but not set!",
@@ -57,6 +78,15 @@ DEFAULT_CONFIG_DEFINITION = {
         "default": "%(scriptharness_base_dir)s{}artifacts".format(os.sep),
         "help": "The directory to copy artifacts to."
     },
+    "scriptharness_action_workers": {
+        "options": ['--action-workers'],
+        "type": int,
+        "default": 1,
+        "help": "The number of actions to run at once.  Actions wait "
+                "for the actions they require to finish; actions that "
+                "don't declare requires wait for the previous enabled "
+                "action, so only declared-independent actions overlap.",
+    },
     "config_files": {
         "options": ['--config-file', '--cfg', '-c'],
         "action": 'append',
@@ -71,6 +101,16 @@ DEFAULT_CONFIG_DEFINITION = {
         "parent_parser": "config",
         "help": "Specify optional config files/urls",
     },
+    "scriptharness_volatile_config_cache_dir": {
+        "options": ['--config-cache-dir'],
+        "parent_parser": "config",
+        "help": "Cache downloaded config urls in this directory, and only "
+                "download them again if they've changed.",
+    },
+    "scriptharness_volatile_trace_file": {
+        "options": ['--trace-file'],
+        "help": "Write a Chrome trace of the run to this file.",
+    },
     "scriptharness_volatile_dump_config": {
         "options": ['--dump-config'],
         "action": 'store_true',
@@ -80,13 +120,21 @@ DEFAULT_CONFIG_DEFINITION = {
 }
 
 # parse_config_file() {{{1
-def parse_config_file(path):
+def parse_config_file(path, cache_dir=None, session=None):
     """Read a config file and return a dictionary.
     For now, only support json.
 
+    Urls are downloaded to a temporary file, or to `cache_dir` if it's set.
+
     Args:
       path (str): path or url to config file.
 
+      cache_dir (Optional[str]): the directory to cache urls in; see
+        download_cached_url().
+
+      session (Optional[requests.Session]): the session to download urls
+        with.
+
     Returns:
       config (Dict[str, Any]): the parsed json dict.
 
@@ -95,7 +143,37 @@ def parse_config_file(path):
         unreadable or not valid json.
     """
     if is_url(path):
-        path = download_url(path)
+        url = path
+        if cache_dir:
+            return read_config_file(
+                download_cached_url(url, cache_dir, session=session)
+            )
+        filehandle, path = tempfile.mkstemp(
+            suffix="-%s" % get_filename_from_url(url)
+        )
+        os.close(filehandle)
+        try:
+            return read_config_file(
+                download_url(url, path=path, session=session)
+            )
+        finally:
+            os.remove(path)
+    return read_config_file(path)
+
+
+def read_config_file(path):
+    """Read a local json config file.
+
+    Args:
+      path (str): path to the config file.
+
+    Returns:
+      config (Dict[str, Any]): the parsed json dict.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessException: if the path is
+        unreadable or not valid json.
+    """
     # py3 may throw FileNotFoundError or IOError; both inherit OSError.
     # py2 throws IOError, which doesn't inherit OSError.
     if six.PY3:
@@ -116,6 +194,60 @@ def parse_config_file(path):
     return config
 
 
+def parse_config_files(paths, cache_dir=None,
+                       max_workers=DEFAULT_CONFIG_WORKERS):
+    """Fetch and parse config files and urls concurrently.
+
+    Urls on the same host share a pooled session; see get_session().
+
+    Args:
+      paths (List[str]): the paths and urls to parse.
+
+      cache_dir (Optional[str]): the directory to cache urls in.
+
+      max_workers (Optional[int]): the maximum number of paths to fetch at
+        once.  Defaults to DEFAULT_CONFIG_WORKERS.
+
+    Returns:
+      List[Tuple[Dict[str, Any], Tuple]]: a (config, exc_info) pair for each
+        path, in the same order as `paths`.  If parsing failed, config is
+        None and exc_info is the sys.exc_info() of the exception, so the
+        caller can decide whether to re-raise it.
+    """
+    results = [None] * len(paths)
+    queue = Queue()
+    for item in enumerate(paths):
+        queue.put(item)
+
+    def worker():
+        """Parse paths from the queue until it's empty."""
+        while True:
+            try:
+                index, path = queue.get(block=False)
+            except Empty:
+                return
+            try:
+                results[index] = (
+                    parse_config_file(path, cache_dir=cache_dir), None
+                )
+            except Exception:  # pylint: disable=broad-except
+                results[index] = (None, sys.exc_info())
+
+    num_workers = min(len(paths), max_workers or DEFAULT_CONFIG_WORKERS)
+    if num_workers <= 1:
+        worker()
+        return results
+    threads = []
+    for _ in range(num_workers):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
 def get_filename_from_url(url):
     """Determine the filename of a file from its url.
 
@@ -149,9 +281,194 @@ def is_url(resource):
     return False
 
 
-def download_url(url, path=None, timeout=None):
+def request_error(url, exc_info, start_time, timeout):
+    """Convert a requests exception to a scriptharness exception.
+
+    Args:
+      url (str): the url being downloaded
+
+      exc_info (RequestException): the exception
+
+      start_time (float): when the download started
+
+      timeout (float): the download timeout
+
+    Returns:
+      ScriptHarnessTimeout: if the request timed out.
+      ScriptHarnessException: otherwise.
+    """
+    if isinstance(exc_info, requests_exceptions.Timeout) or \
+            time.time() >= start_time + timeout:
+        return ScriptHarnessTimeout(
+            "Timeout downloading from url %s" % url, exc_info
+        )
+    return ScriptHarnessException(
+        "Error downloading from url %s" % url, exc_info
+    )
+
+
+def get_session(url):
+    """Get the shared requests.Session for a url's scheme, host and port.
+
+    Reusing the session keeps its connections alive across downloads.  The
+    adapter retries failed connections, and its pool is big enough for
+    parse_config_files() to download from one host in every worker.
+
+    Args:
+      url (str): the url to download.
+
+    Returns:
+      requests.Session: the session.
+    """
+    parsed = urllib.parse.urlparse(url)
+    prefix = "%s://%s" % (parsed.scheme, parsed.netloc)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(prefix)
+        if session is None:
+            session = requests.Session()
+            session.mount(prefix, requests.adapters.HTTPAdapter(
+                max_retries=5, pool_maxsize=DEFAULT_CONFIG_WORKERS
+            ))
+            _SESSIONS[prefix] = session
+    return session
+
+
+def get_hasher(checksum):
+    """Parse a checksum string.
+
+    Args:
+      checksum (str): ALGORITHM:HEXDIGEST, e.g. "sha256:e3b0c4...".  The
+        algorithm can be anything hashlib.new() supports.
+
+    Returns:
+      Tuple[hashlib hash object, str]: the new hash object and the expected
+        hexdigest.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessException: if the checksum
+        string is malformed, or the algorithm isn't supported.
+    """
+    try:
+        algorithm, expected = checksum.split(':', 1)
+        return hashlib.new(algorithm), expected.lower()
+    except ValueError as exc_info:
+        raise ScriptHarnessException(
+            "Invalid checksum %s!" % checksum, exc_info
+        )
+
+
+def replace_file(from_path, to_path):
+    """Atomically rename from_path to to_path, replacing to_path.
+
+    Args:
+      from_path (str): the path to rename.
+      to_path (str): the path to replace.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(from_path, to_path)  # pylint: disable=no-member
+    else:
+        # py2: rename doesn't replace on windows
+        if os.name == 'nt' and os.path.exists(to_path):
+            os.remove(to_path)
+        os.rename(from_path, to_path)
+
+
+def write_response(response, filehandle, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                   hasher=None):
+    """Write a streaming response's contents to filehandle.
+
+    Args:
+      response (requests.Response): the response
+
+      filehandle (file): the file to write to, opened in binary mode.
+
+      chunk_size (Optional[int]): the size of each read.
+
+      hasher (Optional[hashlib hash object]): updated with each chunk.
+    """
+    for chunk in response.iter_content(  # pragma: no branch
+            chunk_size=chunk_size):
+        if chunk:  # pragma: no branch
+            filehandle.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+
+
+def hash_file(path, hasher, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Update hasher with the contents of a file.
+
+    Args:
+      path (str): the file to read.
+
+      hasher (hashlib hash object): the hash to update.
+
+      chunk_size (Optional[int]): the size of each read.
+    """
+    with open(path, 'rb') as filehandle:
+        for chunk in iter(lambda: filehandle.read(chunk_size), b''):
+            hasher.update(chunk)
+
+
+def get_validator(response):
+    """Get the header that identifies this version of the response's
+    contents, to send as If-Range when resuming.
+
+    Args:
+      response (requests.Response): the response.
+
+    Returns:
+      str: the strong ETag if there is one, else Last-Modified, else None.
+    """
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def write_validator(path, validator):
+    """Save a partial download's validator, or remove a stale one.
+
+    Args:
+      path (str): the validator file path.
+      validator (str): the validator, or None.
+    """
+    if validator is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, 'w') as filehandle:
+        filehandle.write(validator)
+
+
+def read_validator(path):
+    """Read a partial download's validator.
+
+    Args:
+      path (str): the validator file path.
+
+    Returns:
+      str: the validator, or None if there isn't one.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path) as filehandle:
+        return filehandle.read().strip() or None
+
+
+def download_url(url, path=None, timeout=None, session=None,
+                 chunk_size=DOWNLOAD_CHUNK_SIZE, checksum=None):
     """Download a url to a path.
 
+    The contents are streamed to PATH.part, which is renamed to `path` once
+    the download is complete (and verified, if `checksum` is set), so `path`
+    never holds a partial download.  If a previous download left a
+    PATH.part behind, it's resumed with an HTTP Range request.  The
+    response's ETag or Last-Modified header is saved in
+    PATH.part.validator and sent as If-Range, so if the file has changed
+    since, the server sends all of it and the download starts over.  It
+    also starts over if the server doesn't support ranges, or if there's
+    neither a validator nor a `checksum` to catch a changed file.
+
     Args:
       url (str): the url to download
 
@@ -159,44 +476,214 @@ def download_url(url, path=None, timeout=None):
 
       timeout (Optional[float]): how long to wait before timing out.
 
+      session (Optional[requests.Session]): the session to use.  Defaults to
+        the shared session for the url's host; see get_session().
+
+      chunk_size (Optional[int]): the size of each read.  Defaults to
+        DOWNLOAD_CHUNK_SIZE.
+
+      checksum (Optional[str]): ALGORITHM:HEXDIGEST to verify the contents
+        against, e.g. "sha256:e3b0c4...".
+
     Returns:
       path (str): the path to the downloaded file.
 
     Raises:
       scriptharness.exceptions.ScriptHarnessException: if there are download
-        issues, or if we can't write to path.
+        issues, if the checksum doesn't match, or if we can't write to path.
     """
     if path is None:
         path = get_filename_from_url(url)
     if timeout is None:
         timeout = 10
+    hasher = expected = None
+    if checksum is not None:
+        hasher, expected = get_hasher(checksum)
+    part_path = path + PARTIAL_SUFFIX
+    validator_path = part_path + VALIDATOR_SUFFIX
+    start_time = time.time()
     try:
-        with open(path, 'wb') as filehandle:
-            try:
-                start_time = time.time()
-                session = requests.Session()
-                session.mount(url, requests.adapters.HTTPAdapter(max_retries=5))
+        offset = 0
+        validator = read_validator(validator_path)
+        if os.path.isfile(part_path) and \
+                (validator is not None or hasher is not None):
+            offset = os.path.getsize(part_path)
+        try:
+            if session is None:
+                session = get_session(url)
+            headers = {}
+            if offset:
+                headers['Range'] = "bytes=%d-" % offset
+                if validator is not None:
+                    headers['If-Range'] = validator
+            response = session.get(url, timeout=timeout, stream=True,
+                                   headers=headers)
+            if offset and response.status_code == 416:
+                # The partial download can't be resumed; start over.
+                response.close()
+                offset = 0
                 response = session.get(url, timeout=timeout, stream=True)
-                with open(path, 'wb') as filehandle:
-                    for chunk in response.iter_content(  # pragma: no branch
-                            chunk_size=1024):
-                        if chunk:  # pragma: no branch
-                            filehandle.write(chunk)
-                            filehandle.flush()
-                return path
-            except RequestException as exc_info:
-                if isinstance(exc_info, Timeout) or \
-                        time.time() >= start_time + timeout:
-                    raise ScriptHarnessTimeout(
-                        "Timeout downloading from url %s" % url, exc_info
-                    )
-                raise ScriptHarnessException(
-                    "Error downloading from url %s" % url, exc_info
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+                write_validator(validator_path, get_validator(response))
+            if offset and hasher is not None:
+                hash_file(part_path, hasher, chunk_size=chunk_size)
+            with open(part_path, 'ab' if offset else 'wb') as filehandle:
+                write_response(response, filehandle, chunk_size=chunk_size,
+                               hasher=hasher)
+        except requests_exceptions.RequestException as exc_info:
+            raise request_error(url, exc_info, start_time, timeout)
+        if hasher is not None and hasher.hexdigest() != expected:
+            os.remove(part_path)
+            write_validator(validator_path, None)
+            raise ScriptHarnessException(
+                "Checksum mismatch downloading %s: expected %s, got %s!" % (
+                    url, expected, hasher.hexdigest()
                 )
-    except IOError as exc_info:
+            )
+        write_validator(validator_path, None)
+        try:
+            replace_file(part_path, path)
+        except (IOError, OSError):
+            os.remove(part_path)
+            raise
+    except (IOError, OSError) as exc_info:
         raise ScriptHarnessException(
             "Error writing downloaded contents to path %s" % path, exc_info
         )
+    return path
+
+
+def get_cache_path(url, cache_dir):
+    """Get the path to cache a url in.
+
+    The name is unique per url, but keeps the url's filename for
+    readability.
+
+    Args:
+      url (str): the url
+
+      cache_dir (str): the cache directory
+
+    Returns:
+      str: the cache path.  The revalidation headers are saved to
+        PATH.headers.json.
+    """
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(
+        cache_dir, "%s-%s" % (digest, get_filename_from_url(url))
+    )
+
+
+def write_cache_file(url, response, cache_dir, path, headers_path):
+    """Write a download_cached_url() response to the cache, with its ETag
+    and Last-Modified headers.
+
+    The response is written to a temp file and renamed, so a concurrent
+    reader never sees a partial file.  The temp file is removed if that
+    fails.
+
+    Args:
+      url (str): the url, for the headers file and errors.
+
+      response (requests.Response): the streaming response.
+
+      cache_dir (str): the cache directory; created if needed.
+
+      path (str): the cache path.
+
+      headers_path (str): the path to save the headers to.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessException: if we can't write to
+        the cache.
+    """
+    tmp_path = None
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        filehandle, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(filehandle, 'wb') as filehandle:
+            write_response(response, filehandle)
+        replace_file(tmp_path, path)
+        tmp_path = None
+        with open(headers_path, 'w') as filehandle:
+            json.dump({
+                'url': url,
+                'etag': response.headers.get('etag'),
+                'last-modified': response.headers.get('last-modified'),
+            }, filehandle)
+    except (IOError, OSError) as exc_info:
+        raise ScriptHarnessException(
+            "Error writing %s to cache %s" % (url, cache_dir), exc_info
+        )
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def download_cached_url(url, cache_dir, timeout=None, session=None):
+    """Download a url into a persistent cache directory.
+
+    If the url is already cached, revalidate it with its ETag and
+    Last-Modified headers, and only download it again if the server says
+    it's changed.
+
+    Args:
+      url (str): the url to download
+
+      cache_dir (str): the cache directory; created if needed.
+
+      timeout (Optional[float]): how long to wait before timing out.
+
+      session (Optional[requests.Session]): the session to use.  Defaults to
+        the shared session for the url's host.
+
+    Returns:
+      path (str): the path to the cached file.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessException: if there are download
+        issues, or if we can't write to the cache.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    path = get_cache_path(url, cache_dir)
+    headers_path = "%s.headers.json" % path
+    if timeout is None:
+        timeout = 10
+    request_headers = {}
+    if os.path.exists(path) and os.path.exists(headers_path):
+        try:
+            with open(headers_path) as filehandle:
+                cached_headers = json.load(filehandle)
+        except (IOError, OSError, ValueError):
+            cached_headers = {}
+        if cached_headers.get('etag'):
+            request_headers['If-None-Match'] = cached_headers['etag']
+        if cached_headers.get('last-modified'):
+            request_headers['If-Modified-Since'] = \
+                cached_headers['last-modified']
+    start_time = time.time()
+    try:
+        if session is None:
+            session = get_session(url)
+        response = session.get(url, timeout=timeout, stream=True,
+                               headers=request_headers)
+        # Close the response however we leave, so its pooled connection
+        # goes back to the shared session.
+        try:
+            if request_headers and response.status_code == 304:
+                logger.info("%s is unchanged; using cached %s", url, path)
+                return path
+            response.raise_for_status()
+            write_cache_file(url, response, cache_dir, path, headers_path)
+        finally:
+            response.close()
+    except requests_exceptions.RequestException as exc_info:
+        raise request_error(url, exc_info, start_time, timeout)
+    logger.info("Cached %s as %s", url, path)
+    return path
 
 
 # config template functions {{{1
@@ -394,6 +881,10 @@ def build_config(template, parsed_args, initial_config=None):
       * parsed_args.opt_config_files, in order, if they exist
       * non-default parser args (cmdln_args)
 
+    The config files are fetched and parsed concurrently, and urls are
+    cached in --config-cache-dir if it's set, but they're applied in the
+    order above.
+
     So the commandline args can override everything else, as long as there are
     options to do so. (Commandline args will need to be a subset of the parser
     args).  The final configuration file can override everything but the
@@ -412,6 +903,9 @@ def build_config(template, parsed_args, initial_config=None):
     resources = {}
     initial_config = initial_config or {}
     logger = logging.getLogger(LOGGER_NAME)
+    cache_dir = parsed_args.__dict__.get(
+        'scriptharness_volatile_config_cache_dir'
+    )
     for key, value in parsed_args.__dict__.items():
         if key.startswith('scriptharness_') and '_volatile_' in key:
             continue
@@ -423,14 +917,19 @@ def build_config(template, parsed_args, initial_config=None):
         else:
             cmdln_config[key] = value
     config.update(initial_config)
-    for resource in resources.get('config_files', []):
-        config.update(parse_config_file(resource))
-    for resource in resources.get('opt_config_files', []):
-        try:
-            config.update(parse_config_file(resource))
-        except ScriptHarnessException:
+    required = resources.get('config_files', [])
+    optional = resources.get('opt_config_files', [])
+    # Fetch all the config files at once, then apply them in order.
+    results = parse_config_files(required + optional, cache_dir=cache_dir)
+    for position, (contents, exc_info) in enumerate(results):
+        if exc_info is not None:
+            if position < len(required) or \
+                    not issubclass(exc_info[0], ScriptHarnessException):
+                six.reraise(*exc_info)
             logger.info("Can't read optional config file %s; skipping.",
-                        resource)
+                        optional[position - len(required)])
+            continue
+        config.update(contents)
     if cmdln_config:
         config.update(cmdln_config)
     update_dirs(config)
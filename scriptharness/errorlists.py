@@ -6,6 +6,16 @@ Each line of output is matched against each substring or regular expression
 in the error list.  On a match, we determine the 'level' of that line.
 Levels are ints, and match the levels in the python logging module.  Negative
 levels are ignored.
+
+The predefined error lists (SSH_ERROR_LIST, HG_ERROR_LIST, GIT_ERROR_LIST,
+PYTHON_ERROR_LIST, VIRTUALENV_ERROR_LIST, MAKE_ERROR_LIST, TAR_ERROR_LIST,
+ADB_ERROR_LIST, JARSIGNER_ERROR_LIST, ZIP_ERROR_LIST, ZIPALIGN_ERROR_LIST)
+are built the first time they're used, so importing this module doesn't
+compile and validate all of them.
+
+Attributes:
+  ERROR_LIST_FACTORIES (Dict[str, function]): the functions that build the
+    predefined error lists, by name.
 """
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
@@ -14,6 +24,7 @@ import re
 from scriptharness.exceptions import ScriptHarnessException, \
     ScriptHarnessFatal
 import six
+import sys
 
 
 # ErrorList helper methods {{{1
@@ -110,6 +121,31 @@ def check_context_lines(context_lines, orig_context_lines, name, messages):
     return max(context_lines, orig_context_lines)
 
 
+def is_combinable(regex):
+    """Can this compiled regex safely be folded into a combined alternation?
+
+    Regexes with non-default or inline global flags, or backreferences,
+    keep their own search() calls, since they'd change meaning inside an
+    alternation.
+
+    Args:
+      regex (re.compile): the regex to check.
+
+    Returns:
+      bool: True if the regex can be combined.
+    """
+    pattern = regex.pattern
+    if not isinstance(pattern, six.text_type):
+        return False
+    if regex.flags != re.compile(pattern[:0]).flags:
+        return False
+    if re.search(r'\(\?[aiLmsux]+\)', pattern):
+        return False
+    if regex.groups and re.search(r'\\\d|\(\?P=', pattern):
+        return False
+    return True
+
+
 # ErrorList {{{1
 class ErrorList(list):
     """Error lists, to describe how to parse output.  In object form for
@@ -141,11 +177,10 @@ class ErrorList(list):
     The second regex sets the level to logging.ERROR for this line, and 5
     lines above and 5 lines below this message.
 
-    Currently undecided whether we should support modification of ErrorLists
-    (which would require validating any new items and recalculating pre
-    and post context_lines) or having ErrorList inherit tuple and dealing
-    with all the renaming.  Most likely the former, but until then, the
-    supported way of modifying an ErrorList is to create a new one.
+    Creating a new ErrorList is still the preferred way to change one, but
+    the list methods that modify it in place re-validate it, recalculate
+    pre and post context_lines, and reset the matcher, so match() never
+    uses a stale combined regex.
 
     Attributes:
       strict (bool): If True, be more strict about well-formed error_lists.
@@ -153,13 +188,167 @@ class ErrorList(list):
         in pre_context_lines.
       post_context_lines (int): The max number of lines the error_list defines
         in post_context_lines.
+      matcher (Tuple[regex, List[int]]): the combined regex and the indices
+        of the error_checks that couldn't be combined; see compile().  This
+        is None until the first match(), and after any modification.
     """
+    # class defaults, for unpickling, which extends the list before it
+    # restores the attributes
+    strict = True
+    matcher = None
+    pre_context_lines = 0
+    post_context_lines = 0
+
     def __init__(self, error_list, strict=True):
         self.strict = strict
+        self.matcher = None
         (self.pre_context_lines, self.post_context_lines) = \
             self.validate_error_list(error_list)
         super(ErrorList, self).__init__(error_list)
 
+    def modified(self):
+        """Re-validate after an in-place modification, and reset the
+        matcher so the next match() recompiles it.
+        """
+        self.matcher = None
+        (self.pre_context_lines, self.post_context_lines) = \
+            self.validate_error_list(self)
+
+    def __setitem__(self, *args):
+        super(ErrorList, self).__setitem__(*args)
+        self.modified()
+
+    def __delitem__(self, *args):
+        super(ErrorList, self).__delitem__(*args)
+        self.modified()
+
+    def __setslice__(self, *args):
+        # python 2 only
+        super(ErrorList, self).__setslice__(*args)  # pylint: disable=no-member
+        self.modified()
+
+    def __delslice__(self, *args):
+        # python 2 only
+        super(ErrorList, self).__delslice__(*args)  # pylint: disable=no-member
+        self.modified()
+
+    def __iadd__(self, other):
+        result = super(ErrorList, self).__iadd__(other)
+        self.modified()
+        return result
+
+    def __imul__(self, other):
+        result = super(ErrorList, self).__imul__(other)
+        self.modified()
+        return result
+
+    def append(self, *args):
+        super(ErrorList, self).append(*args)
+        self.modified()
+
+    def extend(self, *args):
+        super(ErrorList, self).extend(*args)
+        self.modified()
+
+    def insert(self, *args):
+        super(ErrorList, self).insert(*args)
+        self.modified()
+
+    def remove(self, *args):
+        super(ErrorList, self).remove(*args)
+        self.modified()
+
+    def pop(self, *args):
+        result = super(ErrorList, self).pop(*args)
+        self.modified()
+        return result
+
+    def clear(self):
+        del self[:]
+
+    def sort(self, *args, **kwargs):
+        super(ErrorList, self).sort(*args, **kwargs)
+        self.modified()
+
+    def reverse(self):
+        super(ErrorList, self).reverse()
+        self.modified()
+
+    def compile(self):
+        """Compile the error_checks into a single combined regex.
+
+        Each substr (escaped) and each combinable regex becomes one branch
+        of a non-capturing alternation, so a line that matches nothing (the
+        vast majority of output) is rejected with a single search().
+        Capturing groups would tell us which branch matched, but they also
+        turn off most of the regex engine's optimizations.
+
+        Returns:
+          Tuple[regex, List[int]]: the combined regex (None if nothing could
+            be combined), and the indices of error_checks that need their
+            own search() calls.
+        """
+        alternatives = []
+        uncombined = []
+        for position, error_check in enumerate(self):
+            if 'substr' in error_check:
+                alternatives.append(re.escape(error_check['substr']))
+            elif is_combinable(error_check['regex']):
+                alternatives.append(error_check['regex'].pattern)
+            else:
+                uncombined.append(position)
+        combined = None
+        if alternatives:
+            try:
+                combined = re.compile(
+                    '|'.join(["(?:%s)" % x for x in alternatives])
+                )
+            except re.error:
+                # e.g. duplicate group names across regexes; match()
+                # still works, just without the fast path.
+                uncombined = list(range(len(self)))
+        self.matcher = (combined, uncombined)
+        return self.matcher
+
+    def check_matches(self, position, line):
+        """Does the error_check at position match line?
+
+        Args:
+          position (int): the index of the error_check.
+          line (str): the line to check.
+
+        Returns:
+          bool: True on match.
+        """
+        error_check = self[position]
+        if 'substr' in error_check:
+            return error_check['substr'] in line
+        return error_check['regex'].search(line) is not None
+
+    def match(self, line):
+        """Find the first error_check, in list order, that matches line.
+
+        This gives the same answer as checking each error_check in order,
+        but rejects non-matching lines in a single pass.  Only when the
+        combined regex matches do we walk the error_checks in order to find
+        the winner.
+
+        Args:
+          line (str): the line to match.
+
+        Returns:
+          Dict[str, Any]: the winning error_check, or None.
+        """
+        combined, uncombined = self.matcher or self.compile()
+        if combined is not None and combined.search(line) is not None:
+            candidates = range(len(self))
+        else:
+            candidates = uncombined
+        for position in candidates:
+            if self.check_matches(position, line):
+                return self[position]
+        return None
+
     def validate_error_list(self, error_list):
         """Validate an error_list.
         This is going to be a pain to unit test properly.
@@ -239,165 +428,257 @@ class ErrorList(list):
 
 # ErrorLists {{{1
 # These are largely taken from mozharness, and are posix system oriented.
-SSH_ERROR_LIST = ErrorList([
-    {'substr': 'Name or service not known', 'level': logging.ERROR},
-    {'substr': 'Could not resolve hostname', 'level': logging.ERROR},
-    {'substr': 'POSSIBLE BREAK-IN ATTEMPT', 'level': logging.WARNING},
-    {'substr': 'Network error:', 'level': logging.ERROR},
-    {'substr': 'Access denied', 'level': logging.ERROR},
-    {'substr': 'Authentication refused', 'level': logging.ERROR},
-    {'substr': 'Out of memory', 'level': logging.ERROR},
-    {'substr': 'Connection reset by peer', 'level': logging.WARNING},
-    {'substr': 'Host key verification failed', 'level': logging.ERROR},
-    {'substr': 'logging.WARNING:', 'level': logging.WARNING},
-    {'substr': 'rsync error:', 'level': logging.ERROR},
-    {'substr': 'Broken pipe:', 'level': logging.ERROR},
-    {'substr': 'Permission denied:', 'level': logging.ERROR},
-    {'substr': 'connection unexpectedly closed', 'level': logging.ERROR},
-    {'substr': 'Warning: Identity file', 'level': logging.ERROR},
-    {'substr': 'command-line line 0: Missing argument',
-     'level': logging.ERROR},
-])
-"""For ssh, scp, rsync over ssh.
-"""
+# They're built on first access; see __getattr__().
+def _ssh_error_list():
+    """For ssh, scp, rsync over ssh.
+    """
+    return ErrorList([
+        {'substr': 'Name or service not known', 'level': logging.ERROR},
+        {'substr': 'Could not resolve hostname', 'level': logging.ERROR},
+        {'substr': 'POSSIBLE BREAK-IN ATTEMPT', 'level': logging.WARNING},
+        {'substr': 'Network error:', 'level': logging.ERROR},
+        {'substr': 'Access denied', 'level': logging.ERROR},
+        {'substr': 'Authentication refused', 'level': logging.ERROR},
+        {'substr': 'Out of memory', 'level': logging.ERROR},
+        {'substr': 'Connection reset by peer', 'level': logging.WARNING},
+        {'substr': 'Host key verification failed', 'level': logging.ERROR},
+        {'substr': 'logging.WARNING:', 'level': logging.WARNING},
+        {'substr': 'rsync error:', 'level': logging.ERROR},
+        {'substr': 'Broken pipe:', 'level': logging.ERROR},
+        {'substr': 'Permission denied:', 'level': logging.ERROR},
+        {'substr': 'connection unexpectedly closed', 'level': logging.ERROR},
+        {'substr': 'Warning: Identity file', 'level': logging.ERROR},
+        {'substr': 'command-line line 0: Missing argument',
+         'level': logging.ERROR},
+    ])
+
+
+def _hg_error_list():
+    """For hg.
+    """
+    return ErrorList([{
+        'regex': re.compile(r'^abort:'),
+        'level': logging.ERROR,
+        'explanation': 'Automation Error: hg not responding'
+    }, {
+        'substr': 'unknown exception encountered',
+        'level': logging.ERROR,
+        'explanation': 'Automation Error: python exception in hg'
+    }, {
+        'substr': 'failed to import extension',
+        'level': logging.WARNING,
+        'explanation': 'Automation Error: hg extension missing'
+    }])
+
+
+def _git_error_list():
+    """For git.
+    """
+    return ErrorList([
+        {'substr': 'Permission denied (publickey).', 'level': logging.ERROR},
+        {'substr': 'fatal: The remote end hung up unexpectedly',
+         'level': logging.ERROR},
+        {'substr': 'does not appear to be a git repository',
+         'level': logging.ERROR},
+        {'substr': 'error: src refspec', 'level': logging.ERROR},
+        {'substr': 'invalid author/committer line -', 'level': logging.ERROR},
+        {'substr': 'remote: fatal: Error in object', 'level': logging.ERROR},
+        {'substr': "fatal: sha1 file '<stdout>' write error: Broken pipe",
+         'level': logging.ERROR},
+        {'substr': 'error: failed to push some refs to ',
+         'level': logging.ERROR},
+        {'substr': 'remote: error: denying non-fast-forward ',
+         'level': logging.ERROR},
+        {'substr': '! [remote rejected] ', 'level': logging.ERROR},
+        {'regex': re.compile(r'remote:.*No such file or directory'),
+         'level': logging.ERROR},
+    ])
+
+
+def _python_error_list():
+    """For python tracebacks and exceptions.
+    """
+    return ErrorList([
+        {'regex': re.compile(r'Warning:.*Error: '), 'level': logging.WARNING},
+        {'substr': 'Traceback (most recent call last)',
+         'level': logging.ERROR},
+        {'substr': 'SyntaxError: ', 'level': logging.ERROR},
+        {'substr': 'TypeError: ', 'level': logging.ERROR},
+        {'substr': 'NameError: ', 'level': logging.ERROR},
+        {'substr': 'ZeroDivisionError: ', 'level': logging.ERROR},
+        {'regex': re.compile(r'raise \w*Exception: '),
+         'level': logging.CRITICAL},
+        {'regex': re.compile(r'raise \w*Error: '), 'level': logging.CRITICAL},
+    ])
+
+
+def _virtualenv_error_list():
+    """For virtualenv and pip; includes PYTHON_ERROR_LIST.
+    """
+    return ErrorList([
+        {'substr': 'not found or a compiler error:', 'level': logging.WARNING},
+        {'regex': re.compile(r'\d+: error: '), 'level': logging.ERROR},
+        {'regex': re.compile(r'\d+: warning: '), 'level': logging.WARNING},
+        {
+            'regex': re.compile(
+                r'Downloading .* \(.*\): *([0-9]+%)? *[0-9\.]+[kmKM]b'
+            ),
+            'level': logging.DEBUG
+        },
+    ] + _python_error_list())
+
+
+def _make_error_list():
+    """Make errors.
+    These are prime candidates to add pre_context_lines to.
+    """
+    return ErrorList([
+        {'substr': 'No rule to make target ', 'level': logging.ERROR},
+        {'regex': re.compile(r'akefile.*was not found\.'),
+         'level': logging.ERROR},
+        {'regex': re.compile(r'Stop\.$'), 'level': logging.ERROR},
+        {'regex': re.compile(r':\d+: error:'), 'level': logging.ERROR},
+        {'regex': re.compile(r'make\[\d+\]: \*\*\* \[.*\] Error \d+'),
+         'level': logging.ERROR},
+        {'regex': re.compile(r':\d+: warning:'), 'level': logging.WARNING},
+        {'regex': re.compile(r'make(?:\[\d+\])?: \*\*\*/'),
+         'level': logging.ERROR},
+        {'substr': 'Warning: ', 'level': logging.WARNING},
+    ])
+
+
+def _tar_error_list():
+    """For tar.
+    """
+    return ErrorList([
+        {'substr': '(stdin) is not a bzip2 file.', 'level': logging.ERROR},
+        {'regex': re.compile(r'Child returned status [1-9]'),
+         'level': logging.ERROR},
+        {'substr': 'Error exit delayed from previous errors',
+         'level': logging.ERROR},
+        {'substr': 'stdin: unexpected end of file', 'level': logging.ERROR},
+        {'substr': 'stdin: not in gzip format', 'level': logging.ERROR},
+        {'substr': 'Cannot exec: No such file or directory',
+         'level': logging.ERROR},
+        {'substr': ': Error is not recoverable: exiting now',
+         'level': logging.ERROR},
+    ])
+
+
+def _adb_error_list():
+    """For adb.
+    """
+    return ErrorList([
+        {'substr': 'INSTALL_FAILED_', 'level': logging.ERROR},
+        {'substr': 'Android Debug Bridge version', 'level': logging.ERROR},
+        {'substr': 'error: protocol fault', 'level': logging.ERROR},
+        {'substr': 'unable to connect to ', 'level': logging.ERROR},
+    ])
 
-HG_ERROR_LIST = ErrorList([{
-    'regex': re.compile(r'^abort:'),
-    'level': logging.ERROR,
-    'explanation': 'Automation Error: hg not responding'
-}, {
-    'substr': 'unknown exception encountered',
-    'level': logging.ERROR,
-    'explanation': 'Automation Error: python exception in hg'
-}, {
-    'substr': 'failed to import extension',
-    'level': logging.WARNING,
-    'explanation': 'Automation Error: hg extension missing'
-}])
-
-GIT_ERROR_LIST = ErrorList([
-    {'substr': 'Permission denied (publickey).', 'level': logging.ERROR},
-    {'substr': 'fatal: The remote end hung up unexpectedly',
-     'level': logging.ERROR},
-    {'substr': 'does not appear to be a git repository',
-     'level': logging.ERROR},
-    {'substr': 'error: src refspec', 'level': logging.ERROR},
-    {'substr': 'invalid author/committer line -', 'level': logging.ERROR},
-    {'substr': 'remote: fatal: Error in object', 'level': logging.ERROR},
-    {'substr': "fatal: sha1 file '<stdout>' write error: Broken pipe",
-     'level': logging.ERROR},
-    {'substr': 'error: failed to push some refs to ', 'level': logging.ERROR},
-    {'substr': 'remote: error: denying non-fast-forward ',
-     'level': logging.ERROR},
-    {'substr': '! [remote rejected] ', 'level': logging.ERROR},
-    {'regex': re.compile(r'remote:.*No such file or directory'),
-     'level': logging.ERROR},
-])
-
-PYTHON_ERROR_LIST = ErrorList([
-    {'regex': re.compile(r'Warning:.*Error: '), 'level': logging.WARNING},
-    {'substr': 'Traceback (most recent call last)', 'level': logging.ERROR},
-    {'substr': 'SyntaxError: ', 'level': logging.ERROR},
-    {'substr': 'TypeError: ', 'level': logging.ERROR},
-    {'substr': 'NameError: ', 'level': logging.ERROR},
-    {'substr': 'ZeroDivisionError: ', 'level': logging.ERROR},
-    {'regex': re.compile(r'raise \w*Exception: '), 'level': logging.CRITICAL},
-    {'regex': re.compile(r'raise \w*Error: '), 'level': logging.CRITICAL},
-])
-
-VIRTUALENV_ERROR_LIST = ErrorList([
-    {'substr': 'not found or a compiler error:', 'level': logging.WARNING},
-    {'regex': re.compile(r'\d+: error: '), 'level': logging.ERROR},
-    {'regex': re.compile(r'\d+: warning: '), 'level': logging.WARNING},
-    {
+
+def _jarsigner_error_list():
+    """For jarsigner.  These are fatal.
+    """
+    return ErrorList([{
+        'substr': 'command not found',
+        'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
+    }, {
+        'substr': 'jarsigner error: java.lang.RuntimeException: '
+                  'keystore load: Keystore was tampered with, or password '
+                  'was incorrect',
+        'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
+        'explanation': 'The store passphrase is probably incorrect!',
+    }, {
         'regex': re.compile(
-            r'Downloading .* \(.*\): *([0-9]+%)? *[0-9\.]+[kmKM]b'
+            r'jarsigner: key associated with .* not a private key'
         ),
-        'level': logging.DEBUG
-    },
-] + PYTHON_ERROR_LIST[:])
-
-MAKE_ERROR_LIST = ErrorList([
-    {'substr': 'No rule to make target ', 'level': logging.ERROR},
-    {'regex': re.compile(r'akefile.*was not found\.'), 'level': logging.ERROR},
-    {'regex': re.compile(r'Stop\.$'), 'level': logging.ERROR},
-    {'regex': re.compile(r':\d+: error:'), 'level': logging.ERROR},
-    {'regex': re.compile(r'make\[\d+\]: \*\*\* \[.*\] Error \d+'),
-     'level': logging.ERROR},
-    {'regex': re.compile(r':\d+: warning:'), 'level': logging.WARNING},
-    {'regex': re.compile(r'make(?:\[\d+\])?: \*\*\*/'),
-     'level': logging.ERROR},
-    {'substr': 'Warning: ', 'level': logging.WARNING},
-])
-"""Make errors.  These are prime candidates to add pre_context_lines to.
-"""
+        'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
+        'explanation': 'The key passphrase is probably incorrect!',
+    }, {
+        'regex': re.compile(
+            r'jarsigner error: java.lang.RuntimeException: keystore load: .* '
+            r'.No such file or directory'
+        ),
+        'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
+        'explanation': "The keystore doesn't exist!",
+    }, {
+        'substr': 'jarsigner: unable to open jar file:',
+        'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
+        'explanation': 'The apk is missing!',
+    }])
+
+
+def _zip_error_list():
+    """For zip.
+    """
+    return ErrorList([{
+        'substr': 'zip warning:',
+        'level': logging.WARNING,
+    }, {
+        'substr': 'zip error:',
+        'level': logging.ERROR,
+    }, {
+        'substr': 'Cannot open file: it does not appear to be a valid archive',
+        'level': logging.ERROR,
+    }])
+
+
+def _zipalign_error_list():
+    """For zipalign.
+    """
+    return ErrorList([{
+        'regex': re.compile(r'Unable to open .* as a zip archive'),
+        'level': logging.ERROR,
+    }, {
+        'regex': re.compile(r'Output file .* exists'),
+        'level': logging.ERROR,
+    }, {
+        'substr': "Input and output can't be the same file",
+        'level': logging.ERROR,
+    }])
+
+
+ERROR_LIST_FACTORIES = {
+    'ADB_ERROR_LIST': _adb_error_list,
+    'GIT_ERROR_LIST': _git_error_list,
+    'HG_ERROR_LIST': _hg_error_list,
+    'JARSIGNER_ERROR_LIST': _jarsigner_error_list,
+    'MAKE_ERROR_LIST': _make_error_list,
+    'PYTHON_ERROR_LIST': _python_error_list,
+    'SSH_ERROR_LIST': _ssh_error_list,
+    'TAR_ERROR_LIST': _tar_error_list,
+    'VIRTUALENV_ERROR_LIST': _virtualenv_error_list,
+    'ZIP_ERROR_LIST': _zip_error_list,
+    'ZIPALIGN_ERROR_LIST': _zipalign_error_list,
+}
+
+
+def __getattr__(name):
+    """Build a predefined ErrorList on first access (PEP 562, python 3.7+).
+
+    Each ErrorList is only built once; after that it's a normal module
+    attribute.
+
+    Args:
+      name (str): the attribute name, e.g. 'HG_ERROR_LIST'.
+
+    Raises:
+      AttributeError: if name isn't a predefined ErrorList.
+    """
+    if name not in ERROR_LIST_FACTORIES:
+        raise AttributeError(
+            "module %s has no attribute %s" % (__name__, name)
+        )
+    return globals().setdefault(name, ERROR_LIST_FACTORIES[name]())
+
+
+def __dir__():
+    """Include the predefined ErrorLists that haven't been built yet.
+    """
+    return sorted(set(globals()) | set(ERROR_LIST_FACTORIES))
+
 
-TAR_ERROR_LIST = ErrorList([
-    {'substr': '(stdin) is not a bzip2 file.', 'level': logging.ERROR},
-    {'regex': re.compile(r'Child returned status [1-9]'),
-     'level': logging.ERROR},
-    {'substr': 'Error exit delayed from previous errors',
-     'level': logging.ERROR},
-    {'substr': 'stdin: unexpected end of file', 'level': logging.ERROR},
-    {'substr': 'stdin: not in gzip format', 'level': logging.ERROR},
-    {'substr': 'Cannot exec: No such file or directory',
-     'level': logging.ERROR},
-    {'substr': ': Error is not recoverable: exiting now',
-     'level': logging.ERROR},
-])
-
-ADB_ERROR_LIST = ErrorList([
-    {'substr': 'INSTALL_FAILED_', 'level': logging.ERROR},
-    {'substr': 'Android Debug Bridge version', 'level': logging.ERROR},
-    {'substr': 'error: protocol fault', 'level': logging.ERROR},
-    {'substr': 'unable to connect to ', 'level': logging.ERROR},
-])
-
-JARSIGNER_ERROR_LIST = ErrorList([{
-    'substr': 'command not found',
-    'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
-}, {
-    'substr': 'jarsigner error: java.lang.RuntimeException: keystore load: '
-              'Keystore was tampered with, or password was incorrect',
-    'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
-    'explanation': 'The store passphrase is probably incorrect!',
-}, {
-    'regex': re.compile(
-        r'jarsigner: key associated with .* not a private key'
-    ),
-    'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
-    'explanation': 'The key passphrase is probably incorrect!',
-}, {
-    'regex': re.compile(
-        r'jarsigner error: java.lang.RuntimeException: keystore load: .* '
-        r'.No such file or directory'
-    ),
-    'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
-    'explanation': "The keystore doesn't exist!",
-}, {
-    'substr': 'jarsigner: unable to open jar file:',
-    'level': logging.CRITICAL, 'exception': ScriptHarnessFatal,
-    'explanation': 'The apk is missing!',
-}])
-
-ZIP_ERROR_LIST = ErrorList([{
-    'substr': 'zip warning:',
-    'level': logging.WARNING,
-}, {
-    'substr': 'zip error:',
-    'level': logging.ERROR,
-}, {
-    'substr': 'Cannot open file: it does not appear to be a valid archive',
-    'level': logging.ERROR,
-}])
-
-ZIPALIGN_ERROR_LIST = ErrorList([{
-    'regex': re.compile(r'Unable to open .* as a zip archive'),
-    'level': logging.ERROR,
-}, {
-    'regex': re.compile(r'Output file .* exists'),
-    'level': logging.ERROR,
-}, {
-    'substr': "Input and output can't be the same file",
-    'level': logging.ERROR,
-}])
+if sys.version_info < (3, 7):  # pragma: no cover
+    # No module __getattr__; build them all now.
+    for _name, _factory in ERROR_LIST_FACTORIES.items():
+        globals()[_name] = _factory()
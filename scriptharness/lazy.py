@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Lazily imported modules.
+
+Scriptharness scripts are often short, and modules like requests, psutil,
+multiprocessing and pprint can take longer to import than the script takes
+to run.  A LazyModule stands in for the module until one of its attributes
+is used, so `import scriptharness` only pays for what the script needs.
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import importlib
+
+
+# LazyModule {{{1
+class LazyModule(object):
+    """Import a module on first attribute access.
+
+    Usage::
+
+        requests = LazyModule("requests")
+
+        def download(url):
+            return requests.get(url)  # requests is imported here
+
+    Like a module, this can be replaced with mock.patch() in tests.  The
+    LazyModule's own attributes are prefixed with `lazy_` so they don't
+    shadow the module's.
+
+    Attributes:
+      lazy_name (str): the name of the module to import.
+      lazy_module (module): the module, once it's imported.
+    """
+    def __init__(self, name):
+        self.lazy_name = name
+        self.lazy_module = None
+
+    def lazy_load(self):
+        """Import the module, if it hasn't been imported yet.
+
+        Returns:
+          module: the module.
+        """
+        if self.lazy_module is None:
+            self.lazy_module = importlib.import_module(self.lazy_name)
+        return self.lazy_module
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set in __init__.
+        return getattr(self.lazy_load(), name)
+
+    def __repr__(self):
+        return "<LazyModule %s%s>" % (
+            self.lazy_name, "" if self.lazy_module is None else " (loaded)"
+        )
@@ -8,10 +8,19 @@ Attributes:
   DEFAULT_DATEFMT (str): default logging date format
   DEFAULT_FMT (str): default logging format
   DEFAULT_LEVEL (int): default logging level
+  DEFAULT_BATCH_LINES (int): default number of records an OutputBatcher
+    holds before flushing
+  DEFAULT_BATCH_DELAY (float): default number of seconds an OutputBatcher
+    holds a record before flushing
+  DEFAULT_QUEUE_SIZE (int): default maximum number of records an
+    AsyncHandler queues
+  ASYNC_HANDLERS (weakref.WeakSet): the open AsyncHandlers, for
+    flush_async_handlers()
 """
 
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
+import collections
 from copy import deepcopy
 import logging
 import os
@@ -19,12 +28,21 @@ from scriptharness.exceptions import ScriptHarnessException
 from scriptharness.os import make_parent_dir
 from scriptharness.unicode import to_unicode
 import six
+from six.moves.queue import Empty, Full, Queue
+import sys
+import threading
 import time
+import traceback
+import weakref
 
 LOGGER_NAME = "scriptharness.log"
 DEFAULT_DATEFMT = '%H:%M:%S'
 DEFAULT_FMT = '%(asctime)s %(levelname)8s - %(message)s'
 DEFAULT_LEVEL = logging.INFO
+DEFAULT_BATCH_LINES = 500
+DEFAULT_BATCH_DELAY = .5
+DEFAULT_QUEUE_SIZE = 10000
+ASYNC_HANDLERS = weakref.WeakSet()
 
 
 # UnicodeFormatter {{{1
@@ -59,7 +77,7 @@ def get_formatter(fmt=DEFAULT_FMT, datefmt=DEFAULT_DATEFMT):
 
 
 def prepare_simple_logging(path, mode='w', logger_name='', level=DEFAULT_LEVEL,
-                           formatter=None):
+                           formatter=None, async_handlers=False):
     """Create a unicode-friendly logger.
 
     By default it'll create the root logger with a console handler; if passed
@@ -78,6 +96,9 @@ def prepare_simple_logging(path, mode='w', logger_name='', level=DEFAULT_LEVEL,
       level (Optional[int]): the level to log.  Default DEFAULT_LEVEL
       formatter (Optional[Formatter]): a logging Formatter to use; to handle
         unicode, subclass UnicodeFormatter.
+      async_handlers (Optional[bool]): if True, the console and file
+        handlers sit behind an AsyncHandler, so they format and write from a
+        writer thread rather than the logging thread.  Default False
 
     Returns:
         logger (Logger object).  This is also easily retrievable via
@@ -85,6 +106,14 @@ def prepare_simple_logging(path, mode='w', logger_name='', level=DEFAULT_LEVEL,
     """
     logger = logging.getLogger(logger_name)
     logger.setLevel(level)
+    if async_handlers:
+        handlers = [
+            get_console_handler(level=level, formatter=formatter),
+            get_file_handler(path, mode=mode, level=level,
+                             formatter=formatter),
+        ]
+        logger.addHandler(AsyncHandler(handlers))
+        return logger
     get_console_handler(logger=logger, level=level, formatter=formatter)
     get_file_handler(path, logger=logger, mode=mode, level=level,
                      formatter=formatter)
@@ -291,6 +320,26 @@ class LogMethod(object):
 
 
 # OutputBuffer {{{1
+class BufferedLine(object):
+    """A single line held in the OutputBuffer.
+
+    Attributes:
+      level (int): the logging level the line was added with.
+      line (str): the line to log.
+      args (tuple): the args to log the line with.
+      time (float): the time.time() the line was added.
+      position (int): the line number within the OutputBuffer.
+    """
+    __slots__ = ('level', 'line', 'args', 'time', 'position')
+
+    def __init__(self, level, line, args, position):
+        self.level = level
+        self.line = line
+        self.args = args
+        self.time = time.time()
+        self.position = position
+
+
 class OutputBuffer(object):
     """Buffer output for context lines: essentially, an error_check can set
     the level of X lines in the past or Y lines in the future.  If multiple
@@ -307,19 +356,35 @@ class OutputBuffer(object):
     way up until we match some other pattern, so the buffer had to grow to an
     arbitrary size.  Those could be represented by separate classes/subclasses
     if needed.
+
+    The buffer is a ring of BufferedLine records.  Rather than rewriting the
+    level of every affected line when an error_check matches, each context
+    line update is recorded as a (first, last, level) range, and the highest
+    covering level is applied when a line leaves the buffer.  Lines that
+    aren't near any match cost nothing extra.
+
+    Attributes:
+      buffer (collections.deque): the BufferedLine records, oldest first.
+      pre_levels (collections.deque): pending (first, last, level)
+        pre_context_lines ranges, ordered by last.
+      post_levels (List[Tuple[int, int]]): pending (last, level)
+        post_context_lines ranges.
     """
     def __init__(self, logger, pre_context_lines, post_context_lines):
         self.logger = logger
         self.pre_context_lines = pre_context_lines
         self.post_context_lines = post_context_lines
-        # level, line, time
-        self.buffer = []
+        self.buffer = collections.deque()
+        self.pre_levels = collections.deque()
         self.post_levels = []
+        self.position = 0
 
     def update_buffer_levels(self, level, pre_context_lines):
         """Set the level for each buffer line to level if it's higher than
         the existing level.
 
+        This is O(1); the level is applied when the lines are popped.
+
         Args:
           level (int):  The logging level to set the lines to
 
@@ -327,11 +392,33 @@ class OutputBuffer(object):
             are relative to the current line, these will be counted backwards
             from the end of the buffer.
         """
-        start = max(len(self.buffer) - pre_context_lines, 0)
-        for position, buf in enumerate(self.buffer):
-            if position < start:
-                continue
-            self.buffer[position]['level'] = max(buf['level'], level)
+        if not self.buffer or pre_context_lines <= 0:
+            return
+        last = self.buffer[-1].position
+        first = max(last - pre_context_lines + 1, self.buffer[0].position)
+        self.pre_levels.append((first, last, level))
+
+    def get_buffered_level(self, record):
+        """Get the level to log a buffered line at, taking any pending
+        pre_context_lines ranges into account.
+
+        Ranges that end before this line are dropped, since lines leave the
+        buffer in order.
+
+        Args:
+          record (BufferedLine): the line leaving the buffer.
+
+        Returns:
+          int: the level to log the line at.
+        """
+        pre_levels = self.pre_levels
+        while pre_levels and pre_levels[0][1] < record.position:
+            pre_levels.popleft()
+        level = record.level
+        for first, _, pre_level in pre_levels:
+            if first <= record.position and pre_level > level:
+                level = pre_level
+        return level
 
     def pop_buffer(self, num=1):
         """Pop num lines from the front of the buffer and log them at the
@@ -342,17 +429,43 @@ class OutputBuffer(object):
             to 1.
         """
         for _ in range(0, num):
+            record = self.buffer.popleft()
             self.logger.log(
-                self.buffer[0]['level'], self.buffer[0]['line'],
-                *self.buffer[0]['args']
+                self.get_buffered_level(record), record.line, *record.args
             )
-            self.buffer.pop(0)
 
     def dump_buffer(self):
         """Write all the buffered log lines to the log.
         """
         self.pop_buffer(num=len(self.buffer))
 
+    def get_post_level(self, level, post_context_lines):
+        """Apply and update the pending post_context_lines ranges for the
+        line being added.
+
+        Args:
+          level (int): the logging level of the line being added.
+
+          post_context_lines (int): the number of lines after this one to set
+            to `level`.
+
+        Returns:
+          int: the level for the line being added.
+        """
+        current_level = level
+        position = self.position
+        if self.post_levels:
+            active = []
+            for last, post_level in self.post_levels:
+                if last >= position:
+                    current_level = max(current_level, post_level)
+                    if last > position:
+                        active.append((last, post_level))
+            self.post_levels = active
+        if post_context_lines:
+            self.post_levels.append((position + post_context_lines, level))
+        return current_level
+
     def add_line(self, level, line, *args, **kwargs):
         """Add a line to the buffer.
 
@@ -369,31 +482,21 @@ class OutputBuffer(object):
         """
         current_level = level
         pre_context_lines = kwargs.get('pre_context_lines')
-        post_context_lines = kwargs.get('post_context_lines')
         if self.post_context_lines:
-            if self.post_levels:
-                current_level = max(current_level, self.post_levels.pop(0))
-            if post_context_lines:
-                for position, post_level in enumerate(self.post_levels):
-                    if position >= post_context_lines:
-                        break
-                    self.post_levels[position] = max(post_level, level)
-                length = len(self.post_levels)
-                if length < post_context_lines:
-                    for _ in range(length, post_context_lines):
-                        self.post_levels.append(level)
+            current_level = self.get_post_level(
+                level, kwargs.get('post_context_lines')
+            )
         if self.pre_context_lines:
-            if pre_context_lines and self.buffer:
+            if pre_context_lines:
                 self.update_buffer_levels(level, pre_context_lines)
-            self.buffer.append({
-                'level': current_level, 'line': line, 'args': args,
-                'time': time.time()
-            })
-            num_pop = max(len(self.buffer) - self.pre_context_lines, 0)
-            if num_pop > 0:
-                self.pop_buffer(num=num_pop)
+            self.buffer.append(
+                BufferedLine(current_level, line, args, self.position)
+            )
+            if len(self.buffer) > self.pre_context_lines:
+                self.pop_buffer(num=len(self.buffer) - self.pre_context_lines)
         else:
             self.logger.log(current_level, line, *args)
+        self.position += 1
 
 
 # OutputParser {{{1
@@ -424,7 +527,7 @@ class OutputParser(object):
         self.context_buffer = None
         if error_list.pre_context_lines or error_list.post_context_lines:
             self.context_buffer = OutputBuffer(
-                logger, error_list.pre_context_lines,
+                self.logger, error_list.pre_context_lines,
                 error_list.post_context_lines
             )
 
@@ -465,26 +568,486 @@ class OutputParser(object):
           line (str): a line of output to parse.
         """
         line = to_unicode(line.rstrip())
-        for error_check in self.error_list:
-            match = False
-            if 'substr' in error_check:
-                if error_check['substr'] in line:
-                    match = True
-            elif error_check['regex'].search(line):
-                match = True
-            if match:
-                messages = [' %s' % line]
-                if error_check.get('explanation'):
-                    messages.append(' %s' % error_check['explanation'])
-                # exception default level is logging.ERROR
-                level = error_check.get('level', logging.ERROR)
-                if level >= 0:  # ignore negative levels
-                    self.add_buffer(level, '\n'.join(messages),
-                                    error_check=error_check)
-                if error_check.get('exception'):
-                    if self.context_buffer:
-                        self.context_buffer.dump_buffer()
-                    raise error_check['exception'](messages)
-                break
-        else:
+        error_check = self.error_list.match(line)
+        if error_check is None:
             self.add_buffer(logging.INFO, ' %s' % line, error_check=None)
+            return
+        messages = [' %s' % line]
+        if error_check.get('explanation'):
+            messages.append(' %s' % error_check['explanation'])
+        # exception default level is logging.ERROR
+        level = error_check.get('level', logging.ERROR)
+        if level >= 0:  # ignore negative levels
+            self.add_buffer(level, '\n'.join(messages),
+                            error_check=error_check)
+        if error_check.get('exception'):
+            if self.context_buffer:
+                self.context_buffer.dump_buffer()
+            raise error_check['exception'](messages)
+
+    def add_lines(self, lines):
+        """Parse a batch of lines.
+
+        Args:
+          lines (List[str]): lines of output to parse.
+        """
+        add_line = self.add_line
+        for line in lines:
+            add_line(line)
+
+
+# Bulk logging {{{1
+def emit_records(handler, records):
+    """Emit a list of records to a handler in bulk.
+
+    For stream and file handlers this takes the handler lock and flushes the
+    stream once for the whole list, rather than once per record.  Other
+    handlers get handler.handle() per record.
+
+    Args:
+      handler (logging.Handler): the handler to emit to.
+
+      records (List[logging.LogRecord]): the records to emit.
+    """
+    records = [record for record in records
+               if record.levelno >= handler.level and handler.filter(record)]
+    if not records:
+        return
+    bulk = six.PY3 and isinstance(handler, logging.StreamHandler) and \
+        handler.stream is not None and \
+        type(handler).emit in (logging.StreamHandler.emit,
+                               logging.FileHandler.emit)
+    if not bulk:
+        for record in records:
+            handler.handle(record)
+        return
+    terminator = getattr(handler, 'terminator', '\n')
+    handler.acquire()
+    try:
+        stream = handler.stream
+        for record in records:
+            try:
+                stream.write(handler.format(record) + terminator)
+            except Exception:  # pylint: disable=broad-except
+                handler.handleError(record)
+        handler.flush()
+    finally:
+        handler.release()
+
+
+def handle_records(logger, records):
+    """Bulk version of logger.handle(): send a list of records from logger to
+    the handlers of logger and its ancestors.
+
+    Args:
+      logger (logging.Logger): the logger the records were made by.
+
+      records (List[logging.LogRecord]): the records to handle.
+    """
+    if logger.disabled:
+        return
+    records = [record for record in records if logger.filter(record)]
+    if not records:
+        return
+    found = False
+    current = logger
+    while current:
+        for handler in current.handlers:
+            found = True
+            emit_records(handler, records)
+        if not current.propagate:
+            break
+        current = current.parent
+    last_resort = getattr(logging, 'lastResort', None)
+    if not found and last_resort is not None:
+        emit_records(last_resort, records)
+
+
+# OutputBatcher {{{1
+class BatchLogger(object):
+    """Stand-in logger that makes records for an OutputBatcher rather than
+    handling them immediately.
+
+    Attributes:
+      batcher (OutputBatcher): the batcher to add records to.
+
+      logger (logging.Logger): the logger to make the records with.
+    """
+    def __init__(self, batcher, logger):
+        self.batcher = batcher
+        self.logger = logger
+
+    def isEnabledFor(self, level):  # pylint: disable=invalid-name
+        """logging.Logger.isEnabledFor() wrapper"""
+        return self.logger.isEnabledFor(level)
+
+    @staticmethod
+    def find_caller(stack_info=False, stacklevel=1):
+        """Find the caller's file, line number and function, skipping
+        frames in this module and in logging, like
+        logging.Logger.findCaller().
+
+        Args:
+          stack_info (bool, optional): also return the formatted stack.
+
+          stacklevel (int, optional): skip this many - 1 more frames.
+
+        Returns:
+          tuple: (filename, lineno, funcname, stack info or None)
+        """
+        frame = sys._getframe(0)  # pylint: disable=protected-access
+        skip = set([os.path.normcase(frame.f_code.co_filename)])
+        if getattr(logging, '_srcfile', None):
+            skip.add(logging._srcfile)  # pylint: disable=protected-access
+        while frame is not None and \
+                os.path.normcase(frame.f_code.co_filename) in skip:
+            frame = frame.f_back
+        while frame is not None and stacklevel > 1 and \
+                frame.f_back is not None:
+            frame = frame.f_back
+            stacklevel -= 1
+        if frame is None:
+            return "(unknown file)", 0, "(unknown function)", None
+        sinfo = None
+        if stack_info:
+            sinfo = "Stack (most recent call last):\n" + \
+                "".join(traceback.format_stack(frame)).rstrip("\n")
+        return (frame.f_code.co_filename, frame.f_lineno,
+                frame.f_code.co_name, sinfo)
+
+    def log(self, level, msg, *args, **kwargs):
+        """Make a record and add it to the batch.
+
+        Takes the same keyword arguments as logging.Logger.log():
+        exc_info, extra, stack_info and stacklevel.
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        exc_info = kwargs.pop('exc_info', None)
+        extra = kwargs.pop('extra', None)
+        stack_info = kwargs.pop('stack_info', False)
+        stacklevel = kwargs.pop('stacklevel', 1)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments %s" %
+                            sorted(kwargs))
+        if exc_info:
+            if isinstance(exc_info, BaseException):
+                exc_info = (type(exc_info), exc_info,
+                            getattr(exc_info, '__traceback__', None))
+            elif not isinstance(exc_info, tuple):
+                exc_info = sys.exc_info()
+        filename, lineno, func, sinfo = self.find_caller(
+            stack_info=stack_info, stacklevel=stacklevel
+        )
+        record_kwargs = {'func': func, 'extra': extra}
+        if sinfo is not None:
+            record_kwargs['sinfo'] = sinfo
+        record = self.logger.makeRecord(
+            self.logger.name, level, filename, lineno, msg, args, exc_info,
+            **record_kwargs
+        )
+        self.batcher.add_record(self.logger, record)
+
+    def debug(self, *args, **kwargs):
+        """debug() wrapper"""
+        self.log(logging.DEBUG, *args, **kwargs)
+
+    def info(self, *args, **kwargs):
+        """info() wrapper"""
+        self.log(logging.INFO, *args, **kwargs)
+
+    def warning(self, *args, **kwargs):
+        """warning() wrapper"""
+        self.log(logging.WARNING, *args, **kwargs)
+
+    def error(self, *args, **kwargs):
+        """error() wrapper"""
+        self.log(logging.ERROR, *args, **kwargs)
+
+    def exception(self, *args, **kwargs):
+        """exception() wrapper"""
+        kwargs.setdefault('exc_info', True)
+        self.log(logging.ERROR, *args, **kwargs)
+
+    def critical(self, *args, **kwargs):
+        """critical() wrapper"""
+        self.log(logging.CRITICAL, *args, **kwargs)
+
+
+class OutputBatcher(object):
+    """Collect log records for command output and send them to the handlers
+    in bulk: every max_lines records, max_delay seconds after the first
+    unflushed record, and on flush() or close().
+
+    Records from every logger wrapped by the same OutputBatcher share one
+    batch, so they keep their relative order.  Anything that should stay in
+    order with the batched records should be logged through wrap() as well,
+    or after flush().
+
+    The max_delay flushes come from a single flusher thread, started with
+    the first record and stopped by close().
+
+    Usage::
+
+      batcher = OutputBatcher()
+      logger = batcher.wrap(logging.getLogger(name))
+      ...
+      batcher.close()
+
+    Attributes:
+      max_lines (int): flush once this many records are held.
+
+      max_delay (float): flush this many seconds after the first held
+        record.
+
+      records (List[Tuple[logging.Logger, logging.LogRecord]]): the held
+        records.
+
+      deadline (float): when the held records are due to be flushed, or
+        None if there aren't any.
+
+      thread (threading.Thread): the flusher thread, or None.
+    """
+    def __init__(self, max_lines=DEFAULT_BATCH_LINES,
+                 max_delay=DEFAULT_BATCH_DELAY):
+        self.max_lines = max_lines
+        self.max_delay = max_delay
+        self.records = []
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.deadline = None
+        self.closed = False
+        self.thread = None
+
+    def wrap(self, logger):
+        """Get a logger stand-in that batches records.
+
+        Args:
+          logger (logging.Logger): the logger to wrap.  Anything that isn't a
+            logging.Logger is returned unchanged.
+
+        Returns:
+          BatchLogger: if logger is a logging.Logger, otherwise logger.
+        """
+        if not isinstance(logger, logging.Logger):
+            return logger
+        return BatchLogger(self, logger)
+
+    def add_record(self, logger, record):
+        """Add a record to the batch, flushing if it's full.
+
+        Args:
+          logger (logging.Logger): the logger the record was made by.
+
+          record (logging.LogRecord): the record.
+        """
+        with self.lock:
+            self.records.append((logger, record))
+            if self.closed or len(self.records) >= self.max_lines:
+                self.flush()
+            elif self.deadline is None:
+                self.deadline = time.time() + self.max_delay
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.flush_loop)
+                    self.thread.daemon = True
+                    self.thread.start()
+                self.condition.notify()
+
+    def flush_loop(self):
+        """The flusher thread: flush the held records once they're
+        max_delay old, until close().
+        """
+        with self.condition:
+            while not self.closed:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadline - time.time()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                else:
+                    self.flush()
+
+    def flush(self):
+        """Send the held records to the handlers, in order.
+        """
+        with self.lock:
+            self.deadline = None
+            records, self.records = self.records, []
+            start = 0
+            for num in range(1, len(records) + 1):
+                if num == len(records) or records[num][0] is not \
+                        records[start][0]:
+                    handle_records(records[start][0],
+                                   [record for _, record in
+                                    records[start:num]])
+                    start = num
+
+    def close(self):
+        """Flush the held records and stop the flusher thread.  Records
+        added after this are handled immediately.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+            self.flush()
+        thread, self.thread = self.thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+
+# AsyncHandler {{{1
+class AsyncHandler(logging.Handler):
+    """Send records to other handlers from a writer thread, so slow consoles
+    or disks don't stall the logging thread.
+
+    Records go into a bounded queue.  The writer thread takes them off in
+    batches and sends each batch to the handlers with emit_records(), so the
+    formatting and writing happen in the writer thread.
+
+    When the queue is full, `block=True` makes the logging thread wait for
+    room (backpressure); `block=False` drops the record, and the writer
+    logs a warning with the number dropped.
+
+    flush() waits for the queue to empty.  close() also stops the writer.
+    Script.run() calls flush_async_handlers() when an action is fatal, and
+    logging.shutdown() calls flush() and close() at exit, so queued records
+    are written before the handlers are closed.
+
+    Attributes:
+      handlers (List[logging.Handler]): the handlers to write to.
+
+      queue (Queue): the queued records.
+
+      block (bool): whether to wait for room in a full queue.
+
+      dropped (int): the number of records dropped since the last warning.
+        This is only changed under the handler lock.
+
+      thread (threading.Thread): the writer thread.
+    """
+    def __init__(self, handlers, max_queue=DEFAULT_QUEUE_SIZE, block=True,
+                 batch_size=DEFAULT_BATCH_LINES):
+        super(AsyncHandler, self).__init__()
+        self.handlers = list(handlers)
+        self.queue = Queue(maxsize=max_queue)
+        self.block = block
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.write_records)
+        self.thread.daemon = True
+        self.thread.start()
+        ASYNC_HANDLERS.add(self)
+
+    def prepare(self, record):
+        """Merge the args into the message, so later changes to mutable args
+        don't change what's logged.
+
+        Args:
+          record (logging.LogRecord): the record to prepare.
+
+        Returns:
+          logging.LogRecord: the prepared record.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def emit(self, record):
+        """Queue the record for the writer thread.
+
+        Args:
+          record (logging.LogRecord): the record to queue.
+        """
+        try:
+            record = self.prepare(record)
+            if threading.current_thread() is self.thread:
+                # A handler logged from the writer thread; don't wait on
+                # ourselves.
+                self.send_records([record])
+            elif self.block:
+                self.queue.put(record)
+            else:
+                self.queue.put_nowait(record)
+        except Full:
+            self.acquire()
+            try:
+                self.dropped += 1
+            finally:
+                self.release()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def send_records(self, records):
+        """Send records to each handler.
+
+        Args:
+          records (List[logging.LogRecord]): the records to send.
+        """
+        dropped = 0
+        if self.dropped:
+            self.acquire()
+            try:
+                dropped, self.dropped = self.dropped, 0
+            finally:
+                self.release()
+        if dropped:
+            records = records + [logging.makeLogRecord({
+                'name': LOGGER_NAME, 'levelno': logging.WARNING,
+                'levelname': logging.getLevelName(logging.WARNING),
+                'msg': "AsyncHandler queue full; dropped %d log records." %
+                       dropped,
+            })]
+        for handler in self.handlers:
+            emit_records(handler, records)
+
+    def write_records(self):
+        """The writer thread: send batches of queued records to the
+        handlers until we get the None sentinel from close().
+        """
+        running = True
+        while running:
+            records = [self.queue.get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            if None in records:
+                running = False
+                records = [record for record in records if record is not None]
+            try:
+                self.send_records(records)
+            finally:
+                for _ in range(len(records) + (0 if running else 1)):
+                    self.queue.task_done()
+
+    def flush(self):
+        """Wait for the queued records to be written, then flush the
+        handlers.
+        """
+        if self.thread.is_alive() and \
+                threading.current_thread() is not self.thread:
+            self.queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        """Write the queued records, stop the writer thread, and close the
+        handlers.
+        """
+        ASYNC_HANDLERS.discard(self)
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for handler in self.handlers:
+            handler.close()
+        super(AsyncHandler, self).close()
+
+
+def flush_async_handlers():
+    """Flush every open AsyncHandler, so the records queued so far are
+    written, e.g. before a fatal error ends the script.
+    """
+    for handler in list(ASYNC_HANDLERS):
+        handler.flush()
@@ -0,0 +1,549 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A pool of long-lived worker processes that run commands.
+
+The default Command runner starts a multiprocessing.Process for every
+command, which then starts the command itself.  For a script that runs
+hundreds of short commands, most of the time goes to spawning.  A pool
+worker is a separate, small python process that's started once and then
+runs one command at a time: it's sent the command and its subprocess.Popen
+kwargs, and it sends back the command's pid, batches of output lines, and
+the exit code.  Since the worker is small, forking the command from it is
+cheap, however large the harness has grown.
+
+Workers are started with a fresh interpreter, like the multiprocessing
+forkserver, rather than forked from the harness.  Unlike the forkserver,
+this doesn't re-import the script's __main__, so scripts don't need an
+``if __name__ == '__main__':`` guard.
+
+Commands use the pool with ``runner=RUNNER_POOL``.  A worker whose command
+times out is killed, along with the command, just like the multiprocessing
+runner; the pool starts a new worker when it's needed.
+
+Attributes:
+  WORKER_SCRIPT (str): the python code that a worker process runs, with
+    the path to import scriptharness from.
+  POOL (WorkerPool): the shared pool from get_pool(), or None.
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import atexit
+from contextlib import contextmanager
+import os
+import pickle
+from scriptharness.exceptions import ScriptHarnessError, \
+    ScriptHarnessException, ScriptHarnessFatal
+from scriptharness.lazy import LazyModule
+from scriptharness.process import check_timeouts, get_timeout_delay, \
+    kill_proc_tree, kill_runner, read_line_batches, send_output, \
+    spawn_subprocess
+from six.moves.queue import Empty, Queue
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+# pylint: disable=invalid-name
+multiprocessing = LazyModule("multiprocessing")
+# pylint: enable=invalid-name
+
+WORKER_SCRIPT = (
+    "import sys; sys.path.insert(0, %r); "
+    "from scriptharness.pool import worker_main; worker_main()"
+)
+POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+# Messages {{{1
+def write_message(fileno, obj):
+    """Write a length-prefixed pickle to a pipe.
+
+    Args:
+      fileno (int): the file descriptor to write to.
+      obj (Any): the picklable object to write.
+    """
+    data = pickle.dumps(obj, 2)
+    data = struct.pack(">I", len(data)) + data
+    while data:
+        data = data[os.write(fileno, data):]
+
+
+def read_exactly(fileno, size):
+    """Read exactly `size` bytes from a pipe.
+
+    Args:
+      fileno (int): the file descriptor to read from.
+      size (int): the number of bytes to read.
+
+    Returns:
+      bytes: the data.
+
+    Raises:
+      EOFError: if the pipe closes first.
+    """
+    chunks = []
+    while size:
+        chunk = os.read(fileno, size)
+        if not chunk:
+            raise EOFError("Pipe closed!")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_message(fileno):
+    """Read a message written by write_message().
+
+    Args:
+      fileno (int): the file descriptor to read from.
+
+    Returns:
+      Any: the unpickled object.
+
+    Raises:
+      EOFError: if the pipe closes first.
+    """
+    size = struct.unpack(">I", read_exactly(fileno, 4))[0]
+    return pickle.loads(read_exactly(fileno, size))
+
+
+def read_messages(fileno, queue):
+    """Read messages from a pipe into queue until EOF, then put None.
+    This is the target of the PoolWorker reader thread.
+
+    Args:
+      fileno (int): the file descriptor to read from.
+      queue (Queue): the queue to write to.
+    """
+    try:
+        while True:
+            queue.put(read_message(fileno))
+    except (EOFError, OSError):
+        pass
+    finally:
+        queue.put(None)
+
+
+# Worker process {{{1
+def run_worker(in_fileno, out_fileno):
+    """The main loop of a pool worker process.
+
+    Each message received is a (command, kwargs) tuple, or None to exit.
+    The kwargs are for scriptharness.process.spawn_subprocess().
+    For each command, this sends ('start', pid), then ('lines', lines)
+    for each batch of output lines, then ('exit', exit_code).  If the
+    command can't be started, this sends ('error', message) instead.
+
+    .. Note:: This is intended for non-binary output only.
+
+    Args:
+      in_fileno (int): the pipe to read commands from.
+      out_fileno (int): the pipe to write output messages to.
+    """
+    while True:
+        try:
+            spec = read_message(in_fileno)
+        except EOFError:
+            # The harness went away.
+            break
+        if spec is None:
+            break
+        command, kwargs = spec
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.STDOUT
+        kwargs['bufsize'] = 0
+        try:
+            handle = spawn_subprocess(command, **kwargs)
+        except (OSError, ValueError) as exc_info:
+            write_message(out_fileno, ('error', "%s" % exc_info))
+            continue
+        write_message(out_fileno, ('start', handle.pid))
+        for lines in read_line_batches(handle.stdout):
+            write_message(out_fileno, ('lines', lines))
+        handle.stdout.close()
+        write_message(out_fileno, ('exit', handle.wait()))
+
+
+def worker_main():
+    """The entry point of a pool worker process, started with
+    WORKER_SCRIPT.
+
+    The worker's stdin and stdout are its pipes to the harness.  They're
+    moved out of the way, so the commands get /dev/null as stdin, like the
+    multiprocessing runner, and a stray print can't corrupt the messages.
+    """
+    in_fileno = os.dup(0)
+    out_fileno = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.dup2(2, 1)
+    try:
+        run_worker(in_fileno, out_fileno)
+    except KeyboardInterrupt:
+        # The harness handles ^C and kills its process tree.
+        pass
+
+
+# PoolWorker {{{1
+class PoolWorker(object):
+    """The harness side of a pool worker process.
+
+    A reader thread reads the worker's messages into a queue, so waiting for
+    output works the same way everywhere, and a dead worker shows up as
+    None in the queue.
+
+    Attributes:
+      process (subprocess.Popen): the worker process.
+
+      messages (Queue): the messages read from the worker.
+
+      num_commands (int): the number of commands this worker has started.
+    """
+    def __init__(self):
+        path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", WORKER_SCRIPT % path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0,
+            close_fds=True,
+        )
+        self.messages = Queue()
+        reader = threading.Thread(
+            target=read_messages,
+            args=(self.process.stdout.fileno(), self.messages)
+        )
+        reader.daemon = True
+        reader.start()
+        self.num_commands = 0
+
+    @property
+    def pid(self):
+        """int: the worker process id."""
+        return self.process.pid
+
+    def is_alive(self):
+        """Is the worker process running?
+
+        Returns:
+          bool: True if the worker is alive.
+        """
+        return self.process.poll() is None
+
+    def send(self, obj):
+        """Send a message to the worker.
+
+        Args:
+          obj (Any): the picklable message.
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessError: if the worker died.
+        """
+        try:
+            write_message(self.process.stdin.fileno(), obj)
+        except (OSError, ValueError):
+            raise ScriptHarnessError("Pool worker %s died!" % self.pid,
+                                     self.process.poll())
+
+    def recv(self, timeout=None):
+        """Receive the next message from the worker.
+
+        Args:
+          timeout (Optional[float]): how long to wait, or None to wait
+            until there's a message.
+
+        Returns:
+          Tuple[str, Any]: the message.
+
+        Raises:
+          Empty: on timeout.
+
+          scriptharness.exceptions.ScriptHarnessError: if the worker died.
+        """
+        message = self.messages.get(block=True, timeout=timeout)
+        if message is None:
+            # Let the next recv() see this too.
+            self.messages.put(None)
+            raise ScriptHarnessError("Pool worker %s died!" % self.pid,
+                                     self.process.poll())
+        return message
+
+    def start_command(self, command, kwargs):
+        """Send a command to the worker, and wait for it to start.
+
+        Args:
+          command (List[str] or str): the command to run.
+
+          kwargs (Dict[str, Any]): kwargs for subprocess.Popen.  These must
+            be picklable.
+
+        Returns:
+          int: the command's process id.
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessException: if the kwargs
+            can't be pickled.
+
+          scriptharness.exceptions.ScriptHarnessError: if the command
+            can't be run.
+        """
+        try:
+            pickle.dumps(kwargs, 2)
+        except (AttributeError, TypeError, pickle.PicklingError) as exc_info:
+            raise ScriptHarnessException(
+                "Can't send the command to a pool worker!", command, exc_info
+            )
+        self.send((command, kwargs))
+        self.num_commands += 1
+        kind, value = self.recv()
+        if kind != 'start':
+            raise ScriptHarnessError("Can't run command!", command, value)
+        return value
+
+    def watch(self, logger, add_line_cb, # pylint: disable=too-many-arguments
+              max_timeout=None, output_timeout=None, add_lines_cb=None):
+        """Send the running command's output to the callbacks until it
+        exits, and kill the worker and command on timeout.
+
+        Args:
+          logger (logging.Logger): the logger to use.
+
+          add_line_cb (Callable[[str]]): any output lines read will be sent
+            here.
+
+          max_timeout (Optional[int]): when specified, the command will be
+            killed if it takes longer than this number of seconds.
+            Default: None
+
+          output_timeout (Optional[int]): when specified, the command will
+            be killed if it doesn't produce any output for this number of
+            seconds.  Default: None
+
+          add_lines_cb (Optional[Callable[[List[str]]]]): lists of lines
+            will be sent here.  If None, each line is sent to add_line_cb.
+            Default: None
+
+        Returns:
+          int: the command's exit code, on non-timeout.
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessFatal: on KeyboardInterrupt
+
+          scriptharness.exceptions.ScriptHarnessTimeout: on output_timeout
+            or max_timeout.
+
+          scriptharness.exceptions.ScriptHarnessError: if the worker died.
+        """
+        last_output = start_time = time.time()
+        while True:
+            try:
+                delay = get_timeout_delay(time.time(), start_time,
+                                          last_output,
+                                          max_timeout=max_timeout,
+                                          output_timeout=output_timeout)
+                try:
+                    kind, value = self.recv(timeout=delay)
+                except Empty:
+                    kind = None
+                if kind == 'exit':
+                    return value
+                if kind is not None:
+                    send_output(value, add_line_cb, add_lines_cb)
+                    last_output = time.time()
+                    continue
+            except KeyboardInterrupt:
+                logger.warning("KeyboardInterrupt: Killing processes!")
+                kill_proc_tree(os.getpid(), include_parent=True)
+                raise ScriptHarnessFatal("KeyboardInterrupt")
+            check_timeouts(logger, self.kill, time.time(), start_time,
+                           last_output, max_timeout=max_timeout,
+                           output_timeout=output_timeout)
+
+    def kill(self):
+        """Kill the worker and its command.
+        """
+        kill_runner(self.process)
+        self.close()
+
+    def close(self):
+        """Close our end of the worker's command pipe, and reap it if it's
+        exited.
+        """
+        self.process.stdin.close()
+        self.process.poll()
+
+    def stop(self, timeout=5):
+        """Ask an idle worker to exit, and kill it if it doesn't.
+
+        Args:
+          timeout (Optional[float]): how long to wait.  Defaults to 5.
+        """
+        try:
+            self.send(None)
+        except ScriptHarnessError:
+            pass
+        end_time = time.time() + timeout
+        while self.is_alive() and time.time() < end_time:
+            time.sleep(.01)
+        if self.is_alive():
+            self.kill()
+        self.close()
+
+
+# WorkerPool {{{1
+class WorkerPool(object):
+    """A pool of PoolWorkers.  Workers are started as they're needed, up to
+    `size`, and reused after that.
+
+    Usage::
+
+      pool = WorkerPool(size=4)
+      with pool.worker() as worker:
+          pid = worker.start_command(["hg", "id"], {'shell': False})
+          exit_code = worker.watch(logger, add_line_cb)
+      pool.close()
+
+    Attributes:
+      size (int): the most workers to run.  Defaults to the number of cpus.
+
+      pid (int): the process that created the pool.  A forked child can't
+        use its parent's workers.
+
+      idle (List[PoolWorker]): the workers waiting for a command.
+
+      num_workers (int): the number of live workers, idle or busy.
+
+      num_started (int): the number of workers started so far.
+
+      condition (threading.Condition): protects the pool state.
+
+      closed (bool): whether close() has been called.
+    """
+    def __init__(self, size=None):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        if size < 1:
+            raise ScriptHarnessException("Pool size must be at least 1!",
+                                         size)
+        self.size = size
+        self.pid = os.getpid()
+        self.idle = []
+        self.num_workers = 0
+        self.num_started = 0
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def acquire(self):
+        """Get an idle worker, starting one if there's room, or waiting for
+        one otherwise.
+
+        Returns:
+          PoolWorker: the worker.  Pass it to release() when done.
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessException: if the pool is
+            closed or belongs to another process.
+        """
+        if self.pid != os.getpid():
+            raise ScriptHarnessException(
+                "Can't use a WorkerPool from a forked process!"
+            )
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise ScriptHarnessException("The WorkerPool is closed!")
+                while self.idle:
+                    worker = self.idle.pop()
+                    if worker.is_alive():
+                        return worker
+                    worker.close()
+                    self.num_workers -= 1
+                if self.num_workers < self.size:
+                    self.num_workers += 1
+                    self.num_started += 1
+                    break
+                self.condition.wait()
+        try:
+            return PoolWorker()
+        except Exception:
+            with self.condition:
+                self.num_workers -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, worker, reuse=True):
+        """Return a worker to the pool.
+
+        Args:
+          worker (PoolWorker): the worker from acquire().
+
+          reuse (Optional[bool]): if False, or if the pool is closed, kill
+            the worker rather than keeping it.  Defaults to True.
+        """
+        with self.condition:
+            if reuse and not self.closed and worker.is_alive():
+                self.idle.append(worker)
+                worker = None
+            else:
+                self.num_workers -= 1
+            self.condition.notify()
+        if worker is not None:
+            worker.kill()
+
+    @contextmanager
+    def worker(self):
+        """Hold a worker for the duration.  If the block raises, the worker
+        may be in the middle of a command, so it's killed rather than
+        reused.
+
+        Yields:
+          PoolWorker: the worker.
+        """
+        worker = self.acquire()
+        reuse = False
+        try:
+            yield worker
+            reuse = True
+        finally:
+            self.release(worker, reuse=reuse)
+
+    def close(self):
+        """Stop the idle workers.  Busy workers are killed when they're
+        released.
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.num_workers -= len(idle)
+            self.condition.notify_all()
+        if self.pid != os.getpid():
+            return
+        for worker in idle:
+            worker.stop()
+
+
+# API functions {{{1
+def get_pool():
+    """Get the shared WorkerPool, creating it if needed.  It's closed when
+    the harness exits.
+
+    Returns:
+      WorkerPool: the shared pool.
+    """
+    global POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if POOL is None or POOL.closed or POOL.pid != os.getpid():
+            POOL = WorkerPool()
+            atexit.register(POOL.close)
+        return POOL
+
+
+def close_pool():
+    """Close the shared WorkerPool, if there is one.
+    """
+    global POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        pool, POOL = POOL, None
+    if pool is not None:
+        pool.close()
@@ -1,19 +1,65 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Scriptharness multiprocessing support.
+
+Attributes:
+  CHUNK_SIZE (int): how many bytes to read from a pipe at a time when
+    batching output lines.
+  SPAWN_POPEN (str): spawn backend that starts commands with
+    subprocess.Popen.  This is the default.
+  SPAWN_POSIX (str): spawn backend that starts commands with
+    os.posix_spawn() where the Popen arguments allow it, and falls back to
+    subprocess.Popen otherwise.  posix_spawn() doesn't copy the harness'
+    page tables the way fork() does, so it stays fast as the harness grows.
+  SPAWN_BACKENDS (Tuple[str, ...]): valid spawn backends.
+  POSIX_SPAWN_KWARGS (Tuple[str, ...]): the Popen kwargs that SPAWN_POSIX
+    can handle.  Any others fall back to Popen.
+  POSIX_SPAWN_CHDIR (Tuple[str, ...]): the shell wrapper SPAWN_POSIX runs
+    commands through to change to their cwd, since os.posix_spawn() can't.
+  RESTORE_SIGNALS (Tuple[int, ...]): the signals python ignores that
+    SPAWN_POSIX resets to their defaults in the command, like Popen's
+    restore_signals.
 """
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
+import errno
 import os
-import psutil
-from psutil import NoSuchProcess
 from scriptharness.exceptions import ScriptHarnessError, ScriptHarnessFatal, \
     ScriptHarnessTimeout
-from six.moves.queue import Empty
+from scriptharness.lazy import LazyModule
+import select
+import signal
+import six
+from six.moves.queue import Empty, Queue
 import subprocess
 import sys
+import threading
 import time
 
+psutil = LazyModule("psutil")  # pylint: disable=invalid-name
+
+CHUNK_SIZE = 65536
+SPAWN_POPEN = "popen"
+SPAWN_POSIX = "posix_spawn"
+SPAWN_BACKENDS = (SPAWN_POPEN, SPAWN_POSIX)
+POSIX_SPAWN_KWARGS = ('bufsize', 'close_fds', 'cwd', 'env', 'shell',
+                      'stderr', 'stdout')
+POSIX_SPAWN_CHDIR = ('/bin/sh', '-c', 'cd -- "$0" && exec "$@"')
+RESTORE_SIGNALS = tuple(
+    getattr(signal, name) for name in ('SIGPIPE', 'SIGXFSZ')
+    if hasattr(signal, name)
+)
+
+if sys.version_info >= (3, 3):
+    def wait_for_objects(object_list, timeout=None):
+        """multiprocessing.connection.wait(), imported on first use.
+        """
+        from multiprocessing.connection import wait
+        return wait(object_list, timeout=timeout)
+else:  # pragma: no cover
+    # py2 has no multiprocessing.connection.wait(); see watch_command_events()
+    wait_for_objects = None  # pylint: disable=invalid-name
+
 
 def kill_proc_tree(pid, include_parent=False, wait=5):
     """Find the children of a process and kill them; optionally also kill
@@ -46,12 +92,239 @@ def kill_runner(runner):
     Args:
       runner (multiprocessing.Process): the process to kill.
     """
+    # psutil is needed to kill anything anyway, so import it here; this also
+    # works when the psutil module global is mocked.
+    from psutil import NoSuchProcess
     try:
         kill_proc_tree(runner.pid, include_parent=True)
     except NoSuchProcess:
         pass
 
 
+class SpawnedProcess(object):
+    """The parts of the subprocess.Popen interface that scriptharness uses,
+    for a process started by posix_spawn_subprocess().
+
+    Attributes:
+      pid (int): the process id.
+
+      stdout (file): the read end of the process' output pipe, if
+        stdout=subprocess.PIPE, else None.
+
+      returncode (int): the exit code once the process has been reaped,
+        negative if it was killed by a signal, like Popen.returncode.
+        None while it's running.
+    """
+    def __init__(self, pid, stdout=None):
+        self.pid = pid
+        self.stdout = stdout
+        self.returncode = None
+
+    def _set_status(self, status):
+        """Set returncode from a waitpid() status.
+        """
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+    def poll(self):
+        """Check whether the process has exited, without blocking.
+
+        Returns:
+          int: the returncode, or None if the process is still running.
+        """
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self._set_status(status)
+        return self.returncode
+
+    def wait(self):
+        """Wait for the process to exit.
+
+        Returns:
+          int: the returncode.
+        """
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self._set_status(status)
+        return self.returncode
+
+    def kill(self):
+        """Kill the process, if it's still running.
+        """
+        if self.poll() is None:
+            os.kill(self.pid, signal.SIGKILL)
+
+
+def can_posix_spawn(kwargs):
+    """Can posix_spawn_subprocess() handle these Popen kwargs?
+
+    Only the kwargs in POSIX_SPAWN_KWARGS are supported; anything else,
+    like preexec_fn or stdin, needs Popen.  stdout and stderr must be
+    simple: None, a file or file descriptor, or PIPE for stdout and STDOUT
+    for stderr.  close_fds=False isn't supported, since posix_spawn() only
+    passes on inheritable fds.
+
+    Args:
+      kwargs (Dict[str, Any]): the Popen kwargs.
+
+    Returns:
+      bool: True if posix_spawn_subprocess() can start the command.
+    """
+    if not hasattr(os, 'posix_spawn'):
+        return False
+    for key, value in kwargs.items():
+        if key not in POSIX_SPAWN_KWARGS:
+            return False
+        if key == 'close_fds' and not value:
+            return False
+    for key, special in (('stdout', subprocess.PIPE),
+                         ('stderr', subprocess.STDOUT)):
+        value = kwargs.get(key)
+        if value is None or value == special or \
+                (isinstance(value, six.integer_types) and value >= 0) or \
+                hasattr(value, 'fileno'):
+            continue
+        return False
+    return True
+
+
+def find_executable(name, env=None, cwd=None):
+    """Find an executable the way subprocess.Popen does: a name with a
+    directory is used as is, otherwise it's looked up in the PATH of the
+    command's environment.
+
+    Args:
+      name (str): the executable name or path.
+
+      env (Optional[Dict[str, str]]): the command's environment.  Defaults
+        to os.environ.
+
+      cwd (Optional[str]): the command's working directory.  If set, a
+        relative path must exist relative to it.
+
+    Returns:
+      str: the path to the executable.
+
+    Raises:
+      OSError: if it can't be found.
+    """
+    if os.path.dirname(name):
+        if cwd is not None and not os.path.exists(os.path.join(cwd, name)):
+            raise OSError(errno.ENOENT, "No such file or directory", name)
+        return name
+    for directory in os.get_exec_path(env):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    raise OSError(errno.ENOENT, "No such file or directory", name)
+
+
+def posix_spawn_subprocess(command, stdout=None, stderr=None, env=None,
+                           shell=False, cwd=None, **kwargs):
+    """Start a command with os.posix_spawn().  Check can_posix_spawn()
+    first.
+
+    Args:
+      command (List[str] or str): the command, as for subprocess.Popen.
+
+      stdout (Optional[int or file]): None, subprocess.PIPE, or a file or
+        file descriptor to send STDOUT to.
+
+      stderr (Optional[int or file]): None, subprocess.STDOUT, or a file
+        or file descriptor to send STDERR to.
+
+      env (Optional[Dict[str, str]]): the environment.  Defaults to
+        os.environ.
+
+      shell (Optional[bool]): run the command with /bin/sh.
+
+      cwd (Optional[str]): the directory to run the command in.
+        posix_spawn() can't change directory, so the command is run
+        through POSIX_SPAWN_CHDIR, which changes to cwd and execs it.
+        That's still much cheaper than fork() from a large harness.
+
+      **kwargs: the rest of the Popen kwargs, which don't affect this.
+
+    Returns:
+      SpawnedProcess: the running process.
+
+    Raises:
+      OSError: if the command can't be started.
+    """
+    del kwargs  # bufsize doesn't apply, and close_fds is always True.
+    if isinstance(command, six.string_types + (bytes, )):
+        args = [command]
+    else:
+        args = list(command)
+    if shell:
+        args = ["/bin/sh", "-c"] + args
+    if env is None:
+        env = os.environ
+    executable = find_executable(args[0], env, cwd=cwd)
+    if cwd is not None:
+        # Fail like Popen does, rather than with the wrapper's exit code.
+        if not os.path.isdir(cwd):
+            raise OSError(errno.ENOENT, "No such file or directory", cwd)
+        args = list(POSIX_SPAWN_CHDIR) + [os.path.abspath(cwd)] + args
+        executable = POSIX_SPAWN_CHDIR[0]
+    file_actions = []
+    read_fd = write_fd = None
+    if stdout == subprocess.PIPE:
+        read_fd, write_fd = os.pipe()
+        stdout = write_fd
+    for target, value in ((1, stdout), (2, stderr)):
+        if value is None:
+            continue
+        if value == subprocess.STDOUT:
+            fileno = 1
+        elif isinstance(value, six.integer_types):
+            fileno = value
+        else:
+            fileno = value.fileno()
+        if fileno != target:
+            file_actions.append((os.POSIX_SPAWN_DUP2, fileno, target))
+    try:
+        pid = os.posix_spawn(executable, args, env,
+                             file_actions=file_actions,
+                             setsigdef=RESTORE_SIGNALS)
+    except Exception:
+        if read_fd is not None:
+            os.close(read_fd)
+        raise
+    finally:
+        if write_fd is not None:
+            os.close(write_fd)
+    if read_fd is not None:
+        return SpawnedProcess(pid, stdout=os.fdopen(read_fd, 'rb', 0))
+    return SpawnedProcess(pid)
+
+
+def spawn_subprocess(command, spawn_backend=SPAWN_POPEN, **kwargs):
+    """Start a command with the spawn backend, falling back to
+    subprocess.Popen when the backend can't handle the kwargs.
+
+    Args:
+      command (List[str] or str): the command, as for subprocess.Popen.
+
+      spawn_backend (Optional[str]): one of SPAWN_BACKENDS.  Defaults to
+        SPAWN_POPEN.
+
+      **kwargs: sent to subprocess.Popen.
+
+    Returns:
+      subprocess.Popen or SpawnedProcess: the running process.
+
+    Raises:
+      OSError: if the command can't be started.
+    """
+    if spawn_backend == SPAWN_POSIX and can_posix_spawn(kwargs):
+        return posix_spawn_subprocess(command, **kwargs)
+    return subprocess.Popen(command, **kwargs)
+
+
 def command_subprocess(queue, *args, **kwargs):
     """Run a subprocess as a multiprocess.Process.
     This will open STDOUT and STDERR to the same pipe, and read lines from
@@ -61,14 +334,14 @@ def command_subprocess(queue, *args, **kwargs):
 
     Args:
       queue (multiprocessing.Queue): the queue to write to
-      *args: sent to subprocess.Popen
-      **kwargs: sent to subprocess.Popen
+      *args: sent to spawn_subprocess()
+      **kwargs: sent to spawn_subprocess()
     """
     kwargs['stdout'] = subprocess.PIPE
     kwargs['stderr'] = subprocess.STDOUT
     kwargs['bufsize'] = 0
     try:
-        handle = subprocess.Popen(*args, **kwargs)
+        handle = spawn_subprocess(*args, **kwargs)
     except OSError as exc_info:
         raise ScriptHarnessError("Can't run command!", args, exc_info)
     loop = True
@@ -83,8 +356,105 @@ def command_subprocess(queue, *args, **kwargs):
     sys.exit(handle.returncode)
 
 
+def split_lines(data, partial=b''):
+    """Split a chunk of output into complete lines.
+
+    Only b'\\n' ends a line, to match file.readline().
+
+    Args:
+      data (bytes): the chunk of output that was just read.
+
+      partial (Optional[bytes]): the incomplete trailing line from the
+        previous chunk, if any.  Defaults to b''
+
+    Returns:
+      Tuple[List[bytes], bytes]: (lines, partial).  Each line keeps its
+        trailing newline; partial is the incomplete trailing line, to be
+        passed to the next call.
+    """
+    lines = (partial + data).split(b'\n')
+    partial = lines.pop()
+    return [line + b'\n' for line in lines], partial
+
+
+def read_line_batches(pipe, chunk_size=CHUNK_SIZE):
+    """Read a pipe in large chunks, and yield lists of complete lines.
+
+    Each os.read() returns as soon as any output is available, so this
+    doesn't add latency; it just delivers everything that's ready at once.
+    An incomplete last line is held until it's completed, or until EOF.
+
+    Args:
+      pipe (file): the pipe to read from.
+      chunk_size (Optional[int]): the max bytes per read.  Defaults to
+        CHUNK_SIZE
+
+    Yields:
+      List[bytes]: the lines read.
+    """
+    fileno = pipe.fileno()
+    partial = b''
+    while True:
+        data = os.read(fileno, chunk_size)
+        if not data:
+            break
+        lines, partial = split_lines(data, partial)
+        if lines:
+            yield lines
+    if partial:
+        yield [partial]
+
+
+def command_subprocess_batched(queue, *args, **kwargs):
+    """Run a subprocess as a multiprocess.Process, like command_subprocess(),
+    but send lists of lines through the queue rather than one line per
+    message.  This saves a pickle and a pipe write per line.
+
+    .. Note:: This is intended for non-binary output only.
+
+    Args:
+      queue (multiprocessing.Queue): the queue to write to
+      *args: sent to spawn_subprocess()
+      **kwargs: sent to spawn_subprocess()
+    """
+    kwargs['stdout'] = subprocess.PIPE
+    kwargs['stderr'] = subprocess.STDOUT
+    kwargs['bufsize'] = 0
+    try:
+        handle = spawn_subprocess(*args, **kwargs)
+    except OSError as exc_info:
+        raise ScriptHarnessError("Can't run command!", args, exc_info)
+    for lines in read_line_batches(handle.stdout):
+        queue.put(lines)
+    handle.stdout.close()
+    sys.exit(handle.wait())
+
+
+def send_output(item, add_line_cb, add_lines_cb=None):
+    """Send a queue item to the right callback.
+
+    Args:
+      item (str or List[str]): a line, or a list of lines from a batched
+        runner.
+
+      add_line_cb (Callable[[str]]): called for single lines, or for each
+        line in a list if add_lines_cb isn't set.
+
+      add_lines_cb (Optional[Callable[[List[str]]]]): called for lists of
+        lines.  Defaults to None.
+    """
+    if not isinstance(item, list):
+        add_line_cb(item)
+    elif add_lines_cb is not None:
+        add_lines_cb(item)
+    else:
+        for line in item:
+            add_line_cb(line)
+
+
 def watch_command(logger, queue, runner, # pylint: disable=too-many-arguments
-                  add_line_cb, max_timeout=None, output_timeout=None):
+                  add_line_cb, max_timeout=None, output_timeout=None,
+                  add_lines_cb=None):
     """This function watches the queue of the command_subprocess process.
 
     Usage::
@@ -112,6 +482,10 @@ def watch_command(logger, queue, runner, # pylint: disable=too-many-arguments
         killed if it doesn't produce any output for this number of seconds.
         Default: None
 
+      add_lines_cb (Optional[Callable[[List[str]]]]): lists of lines from
+        a batched runner will be sent here.  If None, each line is sent to
+        add_line_cb.  Default: None
+
     Returns:
       runner.exitcode (int): on non-timeout.
 
@@ -126,7 +500,7 @@ def watch_command(logger, queue, runner, # pylint: disable=too-many-arguments
         empty = False
         try:
             line = queue.get(block=True, timeout=.001)
-            add_line_cb(line)
+            send_output(line, add_line_cb, add_lines_cb)
             last_output = time.time()
         except KeyboardInterrupt:
             logger.warning("KeyboardInterrupt: Killing processes!")
@@ -139,17 +513,285 @@ def watch_command(logger, queue, runner, # pylint: disable=too-many-arguments
         if empty:
             if not runner.is_alive():
                 return runner.exitcode
-            now = time.time()
-            if output_timeout and (last_output + output_timeout < now):
-                message = "%d seconds without output!" % output_timeout
-                logger.error(message + "  Killing process...")
-                kill_runner(runner)
-                raise ScriptHarnessTimeout(message)
-            if max_timeout and (start_time + max_timeout < now):
-                message = "Hit max timeout of %d seconds!" % max_timeout
-                logger.error(message + "  Killing process...")
-                kill_runner(runner)
-                raise ScriptHarnessTimeout(message)
+            check_timeouts(logger, lambda: kill_runner(runner), time.time(),
+                           start_time, last_output, max_timeout=max_timeout,
+                           output_timeout=output_timeout)
+
+
+def get_timeout_delay(now, start_time, last_output, max_timeout=None,
+                      output_timeout=None):
+    """Find out how long we can block before a timeout may need to fire.
+
+    Args:
+      now (float): the current time.time()
+
+      start_time (float): the time.time() the process was started.
+
+      last_output (float): the time.time() of the last output.
+
+      max_timeout (Optional[int]): the max_timeout, if any.  Default: None
+
+      output_timeout (Optional[int]): the output_timeout, if any.
+        Default: None
+
+    Returns:
+      float: the number of seconds until the next timeout deadline, or None
+        if there are no timeouts.  This is never negative.
+    """
+    deadlines = []
+    if output_timeout:
+        deadlines.append(last_output + output_timeout)
+    if max_timeout:
+        deadlines.append(start_time + max_timeout)
+    if not deadlines:
+        return None
+    return max(min(deadlines) - now, 0)
+
+
+def check_timeouts(logger, kill_cb, now, # pylint: disable=too-many-arguments
+                   start_time, last_output, max_timeout=None,
+                   output_timeout=None):
+    """Kill the process and raise if we've hit output_timeout or max_timeout.
+
+    Args:
+      logger (logging.Logger): the logger to use.
+
+      kill_cb (Callable[[]]): called to kill the process on timeout.
+
+      now (float): the current time.time()
+
+      start_time (float): the time.time() the process was started.
+
+      last_output (float): the time.time() of the last output.
+
+      max_timeout (Optional[int]): the max_timeout, if any.  Default: None
+
+      output_timeout (Optional[int]): the output_timeout, if any.
+        Default: None
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessTimeout: on output_timeout or
+        max_timeout.
+    """
+    message = None
+    if output_timeout and (last_output + output_timeout < now):
+        message = "%d seconds without output!" % output_timeout
+    elif max_timeout and (start_time + max_timeout < now):
+        message = "Hit max timeout of %d seconds!" % max_timeout
+    if message:
+        logger.error(message + "  Killing process...")
+        kill_cb()
+        raise ScriptHarnessTimeout(message)
+
+
+def watch_command_events(logger, queue, # pylint: disable=too-many-arguments
+                         runner, add_line_cb, max_timeout=None,
+                         output_timeout=None, add_lines_cb=None):
+    """Event-driven version of watch_command().
+
+    Rather than polling the queue every millisecond, this blocks on the
+    queue's pipe and the runner's exit sentinel until there's output, the
+    runner exits, or the next timeout deadline arrives.  An idle command
+    costs no cpu.
+
+    This falls back to watch_command() when the queue or runner don't expose
+    waitable handles (py2, or non-multiprocessing objects).
+
+    Args:
+      logger (logging.Logger): the logger to use.
+
+      queue (multiprocessing.Queue): the queue that the runner is writing to.
+
+      runner (multiprocessing.Process): the runner Process to watch.
+
+      add_line_cb (Callable[[str]]): any output lines read will be sent here.
+
+      max_timeout (Optional[int]): when specified, the process will be killed
+        if it takes longer than this number of seconds.  Default: None
+
+      output_timeout (Optional[int]): when specified, the process will be
+        killed if it doesn't produce any output for this number of seconds.
+        Default: None
+
+      add_lines_cb (Optional[Callable[[List[str]]]]): lists of lines from
+        a batched runner will be sent here.  If None, each line is sent to
+        add_line_cb.  Default: None
+
+    Returns:
+      runner.exitcode (int): on non-timeout.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessFatal: on KeyboardInterrupt
+
+      scriptharness.exceptions.ScriptHarnessTimeout: on output_timeout or
+        max_timeout.
+    """
+    # pylint: disable=protected-access
+    reader = getattr(queue, '_reader', None)
+    sentinel = getattr(runner, 'sentinel', None)
+    if wait_for_objects is None or reader is None or sentinel is None:
+        return watch_command(logger, queue, runner, add_line_cb,
+                             max_timeout=max_timeout,
+                             output_timeout=output_timeout,
+                             add_lines_cb=add_lines_cb)
+    last_output = start_time = time.time()
+    exited = False
+    while not exited:
+        try:
+            delay = get_timeout_delay(time.time(), start_time, last_output,
+                                      max_timeout=max_timeout,
+                                      output_timeout=output_timeout)
+            ready = wait_for_objects([reader, sentinel], timeout=delay)
+            exited = sentinel in ready
+            # Drain what's there, but come up for air every so often so a
+            # chatty command can't starve the max_timeout check.
+            for _ in range(1000):
+                try:
+                    line = queue.get(block=False)
+                except Empty:
+                    break
+                send_output(line, add_line_cb, add_lines_cb)
+                last_output = time.time()
+        except KeyboardInterrupt:
+            logger.warning("KeyboardInterrupt: Killing processes!")
+            kill_proc_tree(os.getpid(), include_parent=True)
+            raise ScriptHarnessFatal("KeyboardInterrupt")
+        if not exited:
+            check_timeouts(logger, lambda: kill_runner(runner), time.time(),
+                           start_time, last_output, max_timeout=max_timeout,
+                           output_timeout=output_timeout)
+    # The runner has exited, so its queue feeder has flushed everything into
+    # the pipe.
+    while True:
+        try:
+            line = queue.get(block=False)
+        except Empty:
+            break
+        send_output(line, add_line_cb, add_lines_cb)
+    runner.join()
+    return runner.exitcode
+
+
+def pipe_subprocess(*args, **kwargs):
+    """Run a subprocess directly from this process, with STDOUT and STDERR
+    going to the same pipe.  Use this with watch_pipe() for timeout support.
+
+    Unlike command_subprocess(), there's no intermediate
+    multiprocessing.Process, so there's no extra fork and no pickling of
+    each line.
+
+    .. Note:: This is intended for non-binary output only.
+
+    Args:
+      *args: sent to spawn_subprocess()
+      **kwargs: sent to spawn_subprocess()
+
+    Returns:
+      subprocess.Popen or SpawnedProcess: the running process.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessError: if the command can't be
+        run.
+    """
+    kwargs['stdout'] = subprocess.PIPE
+    kwargs['stderr'] = subprocess.STDOUT
+    kwargs['bufsize'] = 0
+    try:
+        return spawn_subprocess(*args, **kwargs)
+    except OSError as exc_info:
+        raise ScriptHarnessError("Can't run command!", args, exc_info)
+
+
+def read_pipe(pipe, queue):
+    """Read lists of lines from pipe into queue until EOF, then put None.
+    This is the target of the watch_pipe() reader thread.
+
+    Args:
+      pipe (file): the pipe to read from.
+      queue (Queue): the queue to write to.
+    """
+    try:
+        for lines in read_line_batches(pipe):
+            queue.put(lines)
+    finally:
+        queue.put(None)
+
+
+def watch_pipe(logger, handle, add_line_cb, # pylint: disable=too-many-arguments
+               max_timeout=None, output_timeout=None, add_lines_cb=None):
+    """Watch the output of a pipe_subprocess() process.
+
+    A reader thread reads the pipe; this thread blocks on the reader's queue
+    until there's output, EOF, or the next timeout deadline.
+
+    Usage::
+
+      handle = pipe_subprocess(command)
+      watch_pipe(logger, handle, add_line_cb, output_timeout=output_timeout,
+                 max_timeout=max_timeout)
+
+    Args:
+      logger (logging.Logger): the logger to use.
+
+      handle (subprocess.Popen): the process to watch.
+
+      add_line_cb (Callable[[str]]): any output lines read will be sent here.
+
+      max_timeout (Optional[int]): when specified, the process will be killed
+        if it takes longer than this number of seconds.  Default: None
+
+      output_timeout (Optional[int]): when specified, the process will be
+        killed if it doesn't produce any output for this number of seconds.
+        Default: None
+
+      add_lines_cb (Optional[Callable[[List[str]]]]): lists of lines will
+        be sent here.  If None, each line is sent to add_line_cb.
+        Default: None
+
+    Returns:
+      handle.returncode (int): on non-timeout.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessFatal: on KeyboardInterrupt
+
+      scriptharness.exceptions.ScriptHarnessTimeout: on output_timeout or
+        max_timeout.
+    """
+    queue = Queue()
+    reader = threading.Thread(target=read_pipe, args=(handle.stdout, queue))
+    reader.daemon = True
+    reader.start()
+    last_output = start_time = time.time()
+    while True:
+        try:
+            delay = get_timeout_delay(time.time(), start_time, last_output,
+                                      max_timeout=max_timeout,
+                                      output_timeout=output_timeout)
+            try:
+                lines = queue.get(block=True, timeout=delay)
+            except Empty:
+                lines = []
+            if lines is None:
+                break
+            if lines:
+                send_output(lines, add_line_cb, add_lines_cb)
+                last_output = time.time()
+        except KeyboardInterrupt:
+            logger.warning("KeyboardInterrupt: Killing processes!")
+            kill_proc_tree(os.getpid(), include_parent=True)
+            raise ScriptHarnessFatal("KeyboardInterrupt")
+        check_timeouts(logger, lambda: kill_runner(handle), time.time(),
+                       start_time, last_output, max_timeout=max_timeout,
+                       output_timeout=output_timeout)
+    reader.join()
+    handle.stdout.close()
+    # The process may close its output and keep running for a bit.
+    while handle.poll() is None:
+        check_timeouts(logger, lambda: kill_runner(handle), time.time(),
+                       start_time, last_output, max_timeout=max_timeout,
+                       output_timeout=output_timeout)
+        time.sleep(.01)
+    return handle.returncode
 
 
 def watch_output(logger, runner, stdout, # pylint: disable=too-many-arguments
@@ -204,3 +846,106 @@ def watch_output(logger, runner, stdout, # pylint: disable=too-many-arguments
             runner.kill()
             raise ScriptHarnessTimeout(message)
         time.sleep(.1)
+
+
+def open_pidfd(pid):
+    """Get a pidfd for the process, which becomes readable when the process
+    exits.
+
+    Args:
+      pid (int): the process id.
+
+    Returns:
+      int: the pidfd, or None if pidfds aren't supported here (non-Linux,
+        Linux < 5.3, or python < 3.9).
+    """
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:
+        return None
+    try:
+        return pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def get_last_output(start_time, *handles):
+    """Find the last time any of the output files was written to.
+
+    This fstat()s the open files, rather than stat()ing the paths.
+
+    Args:
+      start_time (float): the time.time() the process was started.
+
+      *handles (file): the open output files.
+
+    Returns:
+      float: the latest of start_time and the files' mtimes.
+    """
+    last_output = start_time
+    for handle in handles:
+        last_output = max(last_output, os.fstat(handle.fileno()).st_mtime)
+    return last_output
+
+
+def watch_output_events(logger, runner, # pylint: disable=too-many-arguments
+                        stdout, stderr, max_timeout=None, output_timeout=None):
+    """Event-driven version of watch_output().
+
+    Rather than waking every 100ms to check for exit and stat the output
+    files, this blocks on a pidfd until the runner exits or the next timeout
+    deadline arrives.  The output files are only checked at the
+    output_timeout deadline: if they've been written to since, the deadline
+    moves to their mtime + output_timeout.  So this returns as soon as the
+    runner exits, and an idle runner costs no cpu or syscalls.
+
+    This falls back to watch_output() where pidfds aren't available.
+
+    Args:
+      logger (logging.Logger): the logger to use.
+
+      runner (subprocess.Popen): the runner process to watch.
+
+      stdout (file): the open file the runner's STDOUT goes to.
+
+      stderr (file): the open file the runner's STDERR goes to.
+
+      max_timeout (Optional[int]): when specified, the process will be killed
+        if it takes longer than this number of seconds.  Default: None
+
+      output_timeout (Optional[int]): when specified, the process will be
+        killed if it doesn't produce any output for this number of seconds.
+        Default: None
+
+    Returns:
+      runner.returncode (int): on non-timeout.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessTimeout: on output_timeout or
+        max_timeout.
+    """
+    pidfd = open_pidfd(runner.pid)
+    if pidfd is None:
+        return watch_output(logger, runner, stdout, stderr,
+                            max_timeout=max_timeout,
+                            output_timeout=output_timeout)
+    try:
+        # poll() rather than select(), which can't handle fds >= FD_SETSIZE
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        last_output = start_time = time.time()
+        while True:
+            delay = get_timeout_delay(time.time(), start_time, last_output,
+                                      max_timeout=max_timeout,
+                                      output_timeout=output_timeout)
+            if delay is not None:
+                # milliseconds, rounded up so we don't wake early
+                delay = int(delay * 1000) + 1
+            if poller.poll(delay):
+                return runner.wait()
+            if output_timeout:
+                last_output = get_last_output(last_output, stdout, stderr)
+            check_timeouts(logger, runner.kill, time.time(), start_time,
+                           last_output, max_timeout=max_timeout,
+                           output_timeout=output_timeout)
+    finally:
+        os.close(pidfd)
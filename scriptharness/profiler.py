@@ -0,0 +1,599 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Profile a Script run: wall time, cpu time, peak rss and i/o for each
+action and each command's process tree.
+
+The Profiler hooks into the Script listeners (PRE_RUN, POST_RUN,
+PRE_ACTION, POST_ACTION, POST_FATAL) and the command listeners
+(PRE_COMMAND, POST_COMMAND), and samples the running commands' process
+trees with psutil from a background thread.
+
+Usage::
+
+  profiler = enable_profiling(script)
+  script.run()
+
+At POST_RUN, or at POST_FATAL if an action is fatal, a summary table is
+logged and a json report is written to ``profile.json`` in the artifact
+dir.  Each action's and command's profile
+is also saved in its history['profile'].
+
+Command metrics come from sampling, every `interval` seconds, so a
+command that finishes before it's sampled reports no cpu, rss or i/o, and
+the last `interval` of each command is missed.  An action's metrics are
+the harness process' own usage during the action, plus its commands'.
+When actions run concurrently, the harness process' usage can't be split
+between them, so each action is charged all of it.
+
+Attributes:
+  LOGGER_NAME (str): logging.Logger name to use
+  DEFAULT_INTERVAL (float): the default seconds between samples
+  REPORT_FILENAME (str): the report filename, in the artifact dir
+  METRICS (Tuple[str, ...]): the metrics in each profile
+  SUMMARY_FORMAT (str): the format of each row of the summary table
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import json
+import logging
+import os
+import scriptharness.commands
+from scriptharness.lazy import LazyModule
+from scriptharness.os import make_parent_dir
+import scriptharness.script
+import threading
+import time
+
+psutil = LazyModule("psutil")  # pylint: disable=invalid-name
+
+LOGGER_NAME = "scriptharness.profiler"
+DEFAULT_INTERVAL = .1
+REPORT_FILENAME = "profile.json"
+METRICS = ("wall_time", "cpu_user", "cpu_system", "peak_rss", "read_bytes",
+           "write_bytes")
+SUMMARY_FORMAT = "%-24s %9s %9s %9s %9s %9s %9s"
+
+
+# Helper functions {{{1
+def sample_process(process):
+    """Sample one psutil.Process.
+
+    Args:
+      process (psutil.Process): the process to sample.
+
+    Returns:
+      Tuple[float, float, int, int, int]: cpu user and system seconds, rss,
+        and bytes read and written.  I/O is 0 where psutil can't get it.
+    """
+    with process.oneshot():
+        cpu_times = process.cpu_times()
+        rss = process.memory_info().rss
+        try:
+            io_counters = process.io_counters()
+            io_bytes = (io_counters.read_bytes, io_counters.write_bytes)
+        except (AttributeError, psutil.AccessDenied):
+            io_bytes = (0, 0)
+    return (cpu_times.user, cpu_times.system, rss) + io_bytes
+
+
+def sample_tree(pid, include_root=True):
+    """Sample a process and all its descendants.
+
+    Args:
+      pid (int): the pid of the root process.
+
+      include_root (Optional[bool]): whether to sample the root process
+        itself, or just its descendants.  Defaults to True.
+
+    Returns:
+      Dict[int, Tuple]: sample_process() for each pid still running.
+    """
+    samples = {}
+    try:
+        root = psutil.Process(pid)
+        processes = root.children(recursive=True)
+        if include_root:
+            processes.insert(0, root)
+    except psutil.Error:
+        return samples
+    for process in processes:
+        try:
+            samples[process.pid] = sample_process(process)
+        except psutil.Error:
+            pass
+    return samples
+
+
+def format_bytes(num_bytes):
+    """Format a number of bytes as MiB for the summary table.
+
+    Args:
+      num_bytes (int): the number of bytes.
+
+    Returns:
+      str: the MiB, with one decimal place.
+    """
+    return "%.1f" % (num_bytes / 1048576.)
+
+
+# Profile {{{1
+class Profile(object):
+    """The resource usage of an action or a command.
+
+    Attributes:
+      name (str): the action name, or the command line.
+
+      start_time (float): when the action or command started.
+
+      end_time (float): when it ended, or None while it's running.
+
+      cpu_user (float): cpu user seconds.
+
+      cpu_system (float): cpu system seconds.
+
+      peak_rss (int): the peak resident set size, in bytes.
+
+      read_bytes (int): bytes read.
+
+      write_bytes (int): bytes written.
+
+      processes (Dict[int, Tuple]): the last sample of each process in a
+        command's process tree; see sample_process().
+
+      rss (int): the rss of a command's process tree at the last sample.
+    """
+    def __init__(self, name, start_time=None):
+        self.name = name
+        self.start_time = start_time or time.time()
+        self.end_time = None
+        self.cpu_user = 0.
+        self.cpu_system = 0.
+        self.peak_rss = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.processes = {}
+        self.rss = 0
+
+    @property
+    def wall_time(self):
+        """float: the seconds from start_time to end_time, or to now."""
+        return (self.end_time or time.time()) - self.start_time
+
+    def update(self, samples):
+        """Add a process tree sample.
+
+        CPU and i/o counters are cumulative per process, so the latest
+        sample of each process replaces the earlier ones, and processes
+        that have exited keep their last sample.
+
+        Args:
+          samples (Dict[int, Tuple]): sample_tree() output.
+        """
+        self.processes.update(samples)
+        self.rss = sum([sample[2] for sample in samples.values()])
+        self.peak_rss = max(self.peak_rss, self.rss)
+        totals = [sum(column) for column in zip(*self.processes.values())]
+        if totals:
+            (self.cpu_user, self.cpu_system, _, self.read_bytes,
+             self.write_bytes) = totals
+
+    def as_dict(self):
+        """Get the metrics as a dict.
+
+        Returns:
+          Dict[str, Any]: the name, start_time, end_time, and METRICS.
+        """
+        result = {
+            'name': self.name,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+        }
+        for metric in METRICS:
+            result[metric] = getattr(self, metric)
+        return result
+
+
+# Profiler {{{1
+class Profiler(object):
+    """Profile a Script's actions and commands.
+
+    Attributes:
+      interval (float): the seconds between samples.
+
+      path (str): the path to write the report to.  If None, it's written
+        to REPORT_FILENAME in the artifact dir, if the config has one.
+
+      logger (logging.Logger): the logger for the summary.
+
+      lock (threading.Lock): protects the running actions and commands.
+
+      process (psutil.Process): the harness process.
+
+      run_profile (Profile): the whole run.
+
+      run_start (Tuple): the harness' sample_process() at start().
+
+      actions (List[Profile]): the finished action profiles, in order.
+
+      commands (List[Tuple[Profile, str]]): the finished command profiles
+        and the name of the action they ran in.
+
+      running_actions (Dict[int, Tuple[Profile, Tuple]]): the running
+        action profiles and the harness' sample_process() at the start of
+        the action, by thread id.
+
+      running_commands (Dict[int, Tuple]): the running Command, its
+        Profile, and its action Profile, by id(command).
+
+      sampler (threading.Thread): the sampler thread, while it's running.
+
+      stop_event (threading.Event): set to stop the sampler thread.
+
+      finished (bool): whether finish() has run since start().
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL, path=None,
+                 logger_name=LOGGER_NAME):
+        self.interval = interval
+        self.path = path
+        self.logger = logging.getLogger(logger_name)
+        self.lock = threading.Lock()
+        self.process = psutil.Process()
+        self.run_profile = None
+        self.run_start = None
+        self.actions = []
+        self.commands = []
+        self.running_actions = {}
+        self.running_commands = {}
+        self.sampler = None
+        self.stop_event = threading.Event()
+        self.finished = False
+
+    # Sampling {{{2
+    def start(self):
+        """Start the run profile and the sampler thread.
+        """
+        self.run_profile = Profile("run")
+        self.run_start = self.harness_sample()
+        self.finished = False
+        self.stop_event.clear()
+        self.sampler = threading.Thread(target=self.sample_loop,
+                                        name="scriptharness.profiler")
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def stop(self):
+        """Stop the sampler thread and end the run profile: the harness
+        process' usage since start(), plus all the commands'.
+        """
+        if self.sampler is None:
+            return
+        self.stop_event.set()
+        self.sampler.join()
+        self.sampler = None
+        self.sample()
+        harness = self.harness_sample()
+        profile = self.run_profile
+        profile.end_time = time.time()
+        profile.cpu_user = harness[0] - self.run_start[0]
+        profile.cpu_system = harness[1] - self.run_start[1]
+        profile.read_bytes = harness[3] - self.run_start[3]
+        profile.write_bytes = harness[4] - self.run_start[4]
+        profile.peak_rss = max(profile.peak_rss, harness[2])
+        for command_profile, _ in self.commands:
+            profile.cpu_user += command_profile.cpu_user
+            profile.cpu_system += command_profile.cpu_system
+            profile.read_bytes += command_profile.read_bytes
+            profile.write_bytes += command_profile.write_bytes
+
+    def sample_loop(self):
+        """The sampler thread: sample every `interval` seconds until
+        stop().
+        """
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def harness_sample(self):
+        """Sample the harness process.
+
+        Returns:
+          Tuple: sample_process() of the harness process.
+        """
+        return sample_process(self.process)
+
+    def sample(self):
+        """Sample the running commands' process trees, and update the peak
+        rss of the running actions and the run.
+        """
+        with self.lock:
+            running_commands = list(self.running_commands.values())
+        for command, profile, _ in running_commands:
+            pid = command.history.get('pid')
+            if pid is not None:
+                # the multiprocessing runner is a fork of the harness; only
+                # the command under it should be charged
+                samples = sample_tree(
+                    pid, include_root=pid != command.history.get('runner_pid')
+                )
+                if samples:
+                    profile.update(samples)
+        harness = self.harness_sample()
+        with self.lock:
+            running_actions = [
+                action_profile for action_profile, _ in
+                self.running_actions.values()
+            ]
+        commands_rss = 0
+        for action_profile in running_actions:
+            action_rss = sum([
+                profile.rss for _, profile, parent in running_commands
+                if parent is action_profile
+            ])
+            commands_rss += action_rss
+            action_profile.peak_rss = max(action_profile.peak_rss,
+                                          harness[2] + action_rss)
+        commands_rss += sum([
+            profile.rss for _, profile, parent in running_commands
+            if parent is None
+        ])
+        if self.run_profile is not None:
+            self.run_profile.peak_rss = max(self.run_profile.peak_rss,
+                                            harness[2] + commands_rss)
+
+    # Script listeners {{{2
+    def pre_run(self, context):
+        """PRE_RUN listener: start profiling.
+
+        Args:
+          context (scriptharness.script.Context): the run context.
+        """
+        if self.path is None:
+            artifact_dir = context.config.get('scriptharness_artifact_dir')
+            if artifact_dir:
+                self.path = os.path.join(artifact_dir, REPORT_FILENAME)
+        self.start()
+
+    def finish(self):
+        """Stop profiling, remove the command listeners, log the summary,
+        and write the report.  Only the first call does anything, so the
+        POST_RUN and POST_FATAL paths can both call it.
+        """
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        self.stop()
+        self.remove_command_listeners()
+        for line in self.summary():
+            self.logger.info(line)
+        if self.path is not None:
+            self.write_report(self.path)
+
+    def post_run(self, context):  # pylint: disable=unused-argument
+        """POST_RUN listener: finish().
+
+        Args:
+          context (scriptharness.script.Context): the run context.
+        """
+        self.finish()
+
+    def pre_action(self, context):
+        """PRE_ACTION listener: start the action's profile.
+
+        Args:
+          context (scriptharness.script.Context): the action context.
+        """
+        profile = Profile(context.action.name)
+        with self.lock:
+            self.running_actions[threading.current_thread().ident] = (
+                profile, self.harness_sample()
+            )
+
+    def post_action(self, context):
+        """POST_ACTION listener: finish the action's profile and save it in
+        the action's history.
+
+        Args:
+          context (scriptharness.script.Context): the action context.
+        """
+        harness = self.harness_sample()
+        with self.lock:
+            profile, start = self.running_actions.pop(
+                threading.current_thread().ident
+            )
+        profile.start_time = context.action.history.get(
+            'start_time', profile.start_time
+        )
+        profile.end_time = context.action.history.get('end_time',
+                                                      time.time())
+        profile.cpu_user += harness[0] - start[0]
+        profile.cpu_system += harness[1] - start[1]
+        profile.peak_rss = max(profile.peak_rss, harness[2])
+        profile.read_bytes += harness[3] - start[3]
+        profile.write_bytes += harness[4] - start[4]
+        context.action.history['profile'] = profile.as_dict()
+        self.actions.append(profile)
+
+    def post_fatal(self, context):
+        """POST_FATAL listener: finish the action's profile, then finish(),
+        since POST_RUN won't fire.
+
+        Args:
+          context (scriptharness.script.Context): the action context.
+        """
+        self.post_action(context)
+        self.finish()
+
+    def add_script_listeners(self, script):
+        """Add the run and action listeners to a Script.
+
+        Args:
+          script (scriptharness.script.Script): the script to profile.
+        """
+        script.add_listener(self.pre_run, scriptharness.script.PRE_RUN)
+        script.add_listener(self.post_run, scriptharness.script.POST_RUN)
+        script.add_listener(self.pre_action, scriptharness.script.PRE_ACTION)
+        script.add_listener(self.post_action,
+                            scriptharness.script.POST_ACTION)
+        script.add_listener(self.post_fatal, scriptharness.script.POST_FATAL)
+
+    # Command listeners {{{2
+    def pre_command(self, command):
+        """PRE_COMMAND listener: start the command's profile.
+
+        A command is charged to the action running in its thread.  If the
+        command runs in another thread, e.g. from run_many(), it's charged
+        to the running action, if there's only one.
+
+        Args:
+          command (scriptharness.commands.Command): the command.
+        """
+        profile = Profile(command.command,
+                          start_time=command.history.get('start_time'))
+        with self.lock:
+            action = self.running_actions.get(
+                threading.current_thread().ident
+            )
+            if action is None and len(self.running_actions) == 1:
+                action = list(self.running_actions.values())[0]
+            self.running_commands[id(command)] = (
+                command, profile, action and action[0]
+            )
+
+    def post_command(self, command):
+        """POST_COMMAND listener: finish the command's profile, charge it to
+        its action, and save it in the command's history.
+
+        Args:
+          command (scriptharness.commands.Command): the command.
+        """
+        with self.lock:
+            _, profile, action_profile = self.running_commands.pop(
+                id(command), (None, None, None)
+            )
+        if profile is None:
+            return
+        profile.end_time = command.history.get('end_time', time.time())
+        command.history['profile'] = profile.as_dict()
+        if action_profile is not None:
+            action_profile.cpu_user += profile.cpu_user
+            action_profile.cpu_system += profile.cpu_system
+            action_profile.read_bytes += profile.read_bytes
+            action_profile.write_bytes += profile.write_bytes
+        self.commands.append(
+            (profile, action_profile and action_profile.name)
+        )
+
+    def add_command_listeners(self):
+        """Add the command listeners.
+        """
+        scriptharness.commands.add_listener(
+            self.pre_command, scriptharness.commands.PRE_COMMAND
+        )
+        scriptharness.commands.add_listener(
+            self.post_command, scriptharness.commands.POST_COMMAND
+        )
+
+    def remove_command_listeners(self):
+        """Remove the command listeners.
+        """
+        scriptharness.commands.remove_listener(
+            self.pre_command, scriptharness.commands.PRE_COMMAND
+        )
+        scriptharness.commands.remove_listener(
+            self.post_command, scriptharness.commands.POST_COMMAND
+        )
+
+    # Reporting {{{2
+    def report(self):
+        """Build the machine-readable report.
+
+        Returns:
+          Dict[str, Any]: the `run` profile, and lists of `actions` and
+            `commands` profiles.  Each command also has its `action`.
+        """
+        commands = []
+        for profile, action_name in self.commands:
+            command = profile.as_dict()
+            command['action'] = action_name
+            commands.append(command)
+        return {
+            'run': self.run_profile and self.run_profile.as_dict(),
+            'actions': [profile.as_dict() for profile in self.actions],
+            'commands': commands,
+        }
+
+    def write_report(self, path):
+        """Write the report as json.
+
+        Args:
+          path (str): the path to write to.
+        """
+        make_parent_dir(path)
+        with open(path, 'w') as filehandle:
+            json.dump(self.report(), filehandle, indent=2, sort_keys=True,
+                      default=str)
+
+    def summary(self, num_commands=5):
+        """Build the summary table: each action, the run, and the slowest
+        commands.
+
+        Args:
+          num_commands (Optional[int]): how many of the slowest commands to
+            list.  Defaults to 5.
+
+        Returns:
+          List[str]: the lines of the table.
+        """
+        def row(name, profile):
+            """Format one row of the table."""
+            return SUMMARY_FORMAT % (
+                name[:24], "%.2f" % profile.wall_time,
+                "%.2f" % profile.cpu_user, "%.2f" % profile.cpu_system,
+                format_bytes(profile.peak_rss),
+                format_bytes(profile.read_bytes),
+                format_bytes(profile.write_bytes),
+            )
+        lines = [SUMMARY_FORMAT % (
+            "Action", "Wall(s)", "User(s)", "Sys(s)", "RSS(MiB)", "Read(MiB)",
+            "Write(MiB)"
+        )]
+        for profile in self.actions:
+            lines.append(row(profile.name, profile))
+        if self.run_profile is not None:
+            lines.append(row("Total", self.run_profile))
+        slowest = sorted(self.commands, key=lambda x: x[0].wall_time,
+                         reverse=True)[:num_commands]
+        if slowest:
+            lines.append("Slowest of %d commands:" % len(self.commands))
+            for profile, action_name in slowest:
+                name = profile.name
+                if isinstance(name, (list, tuple)):
+                    name = " ".join(name)
+                lines.append(" %.2fs [%s] %s" % (
+                    profile.wall_time, action_name, name
+                ))
+        return lines
+
+
+def enable_profiling(script, path=None, interval=DEFAULT_INTERVAL,
+                     logger_name=LOGGER_NAME):
+    """Profile a Script's actions and commands.
+
+    Args:
+      script (scriptharness.script.Script): the script to profile.
+
+      path (Optional[str]): the path to write the report to.  Defaults to
+        REPORT_FILENAME in the artifact dir.
+
+      interval (Optional[float]): the seconds between samples.  Defaults to
+        DEFAULT_INTERVAL.
+
+      logger_name (Optional[str]): the logger for the summary.
+
+    Returns:
+      Profiler: the profiler.
+    """
+    profiler = Profiler(interval=interval, path=path, logger_name=logger_name)
+    profiler.add_script_listeners(script)
+    profiler.add_command_listeners()
+    return profiler
@@ -19,15 +19,23 @@ import collections
 import json
 import logging
 import os
-import pprint
 from scriptharness.actions import Action
 from scriptharness.os import make_parent_dir
 import scriptharness.config as shconfig
 from scriptharness.exceptions import ScriptHarnessException, ScriptHarnessFatal
-from scriptharness.structures import iterate_pairs, LoggingDict, ReadOnlyDict
+from scriptharness.lazy import LazyModule
+from scriptharness.log import flush_async_handlers
+from scriptharness.structures import freeze, iterate_pairs, LoggingDict, \
+    ReadOnlyDict
+from scriptharness.trace import span, start_tracing, stop_tracing, \
+    tracing_enabled
+from six.moves.queue import Queue
+import six
 import sys
+import threading
 import time
 
+pprint = LazyModule("pprint")  # pylint: disable=invalid-name
 
 LOGGER_NAME = "scriptharness.script"
 PRE_RUN = "pre_run"
@@ -51,6 +59,34 @@ phases, Context.action is None.
 
 
 # Helper functions {{{1
+def get_listener_name(listener):
+    """Get a listener's name, for logging and tracing.
+
+    Args:
+      listener (Callable): the listener.
+
+    Returns:
+      str: the listener's __qualname__ or __name__, or None if it has
+        neither.
+    """
+    for name_var in ('__qualname__', '__name__'):
+        if hasattr(listener, name_var):
+            return getattr(listener, name_var)
+    return None
+
+
+def call_listener(listener, context):
+    """Call a listener, in a trace span.
+
+    Args:
+      listener (Callable[[Context]]): the listener.
+      context (Context): the context to pass it.
+    """
+    with span(get_listener_name(listener), category="listener",
+              phase=context.phase):
+        listener(context)
+
+
 def save_config(config, path):
     """Save the configuration file to path as json.
 
@@ -134,8 +170,11 @@ class Script(object):
       listeners (Dict[str, Tuple[Callable[], List[str]]): Callbacks for run().
         Listener functions can be set for each of LISTENER_PHASES.
       logger (logging.Logger): the logger for the script
+      trace_file (str): if set, run() writes a Chrome trace here; from
+        --trace-file.
     """
     config = None
+    trace_file = None
 
     def __init__(self, actions, template, name='root', **kwargs):
         """Script.__init__
@@ -181,6 +220,9 @@ class Script(object):
         config = shconfig.build_config(template, parsed_args, initial_config)
         self.dict_to_config(config)
         enable_actions(parsed_args, self.actions)
+        self.trace_file = parsed_args.__dict__.get(
+            "scriptharness_volatile_trace_file"
+        )
         if parsed_args.__dict__.get("scriptharness_volatile_dump_config"):
             logger = self.get_logger()
             logger.info("Dumping config:")
@@ -213,7 +255,8 @@ class Script(object):
 
     def verify_actions(self, actions):
         """Make sure actions consists of Action objects, with no duplicate
-        names.
+        names, and that each action only requires actions defined before it.
+        That keeps the action list a valid serial order, with no cycles.
 
         Then set self.actions to a namedtuple so we can find each action
         by name easily.
@@ -231,6 +274,12 @@ class Script(object):
                 raise ScriptHarnessException(
                     "%s action is defined more than once!" % action.name
                 )
+            for name in action.requires or ():
+                if name not in action_dict:
+                    raise ScriptHarnessException(
+                        "%s action requires %s, which isn't defined before "
+                        "it!" % (action.name, name)
+                    )
             action_dict[action.name] = action
         action_tuple = collections.namedtuple('Actions', action_dict.keys())
         self.actions = action_tuple(**action_dict)
@@ -262,11 +311,8 @@ class Script(object):
           action_names (Iterable[str]): for pre/post action phase listeners,
             only run before/after these action(s).
         """
-        for name_var in ('__qualname__', '__name__'):
-            if hasattr(listener, name_var):
-                listener_name = getattr(listener, name_var)
-                break
-        else:
+        listener_name = get_listener_name(listener)
+        if listener_name is None:
             raise ScriptHarnessException("Listener has no __name__!", listener)
         if phase not in LISTENER_PHASES:
             raise ScriptHarnessException(
@@ -302,28 +348,115 @@ class Script(object):
         if not action.enabled:
             logger.info(action.strings['skip_message'], repl_dict)
             return
-        context = build_context(self, PRE_ACTION, action=action)
-        for listener, actions in iterate_pairs(self.listeners[PRE_ACTION]):
-            if actions and action.name not in actions:
-                continue
-            listener(context)
-        logger.info(action.strings['run_message'], repl_dict)
-        try:
-            context = build_context(self, RUN_ACTION, action=action)
-            action.run(context)
-        except ScriptHarnessFatal:
-            context = build_context(self, POST_FATAL, action=action)
+        with span(action.name, category="action"):
+            context = build_context(self, PRE_ACTION, action=action)
             for listener, actions in \
-                    iterate_pairs(self.listeners['post_fatal']):
+                    iterate_pairs(self.listeners[PRE_ACTION]):
                 if actions and action.name not in actions:
                     continue
-                listener(context)
-            raise
-        context = build_context(self, POST_ACTION, action=action)
-        for listener, actions in iterate_pairs(self.listeners['post_action']):
-            if actions and action.name not in actions:
-                continue
-            listener(context)
+                call_listener(listener, context)
+            logger.info(action.strings['run_message'], repl_dict)
+            try:
+                context = build_context(self, RUN_ACTION, action=action)
+                action.run(context)
+            except ScriptHarnessFatal:
+                context = build_context(self, POST_FATAL, action=action)
+                for listener, actions in \
+                        iterate_pairs(self.listeners['post_fatal']):
+                    if actions and action.name not in actions:
+                        continue
+                    call_listener(listener, context)
+                raise
+            context = build_context(self, POST_ACTION, action=action)
+            for listener, actions in \
+                    iterate_pairs(self.listeners['post_action']):
+                if actions and action.name not in actions:
+                    continue
+                call_listener(listener, context)
+
+    def run_actions_parallel(self, max_workers):
+        """Run the actions on up to max_workers threads, starting each
+        action once the actions it requires have finished.
+
+        Actions that don't declare requires (requires is None) require the
+        previous enabled action, so existing scripts keep running in order.
+        Only actions that declare their requirements, even as an empty list,
+        run alongside others.
+
+        Disabled actions are skipped in the scheduling thread and count as
+        finished straight away.  The listeners for each action run in that
+        action's thread.
+
+        If an action raises, no more actions are started; the running
+        actions finish, and the first exception is re-raised.  The
+        post_fatal listeners have already run in the action's thread by then.
+
+        Args:
+          max_workers (int): the most actions to run at once.
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessFatal: when an Action
+          raises ScriptHarnessFatal, this method re-raises.
+        """
+        pending = list(self.actions)
+        requires = {}
+        previous = ()
+        for action in pending:
+            if not action.enabled:
+                # skipped actions count as finished straight away
+                requires[action.name] = set()
+            elif action.requires is None:
+                requires[action.name] = set(previous)
+            else:
+                requires[action.name] = set(action.requires)
+            if action.enabled:
+                previous = (action.name, )
+        finished = Queue()
+        done = set()
+        running = {}
+        exc_info = None
+
+        def run_action(action):
+            """Run the action and report back to the scheduling thread."""
+            try:
+                self.run_action(action)
+            except BaseException:  # pylint: disable=broad-except
+                finished.put((action.name, sys.exc_info()))
+            else:
+                finished.put((action.name, None))
+
+        while pending or running:
+            if exc_info is None:
+                for action in list(pending):
+                    if len(running) >= max_workers:
+                        break
+                    if not requires[action.name].issubset(done):
+                        continue
+                    pending.remove(action)
+                    if not action.enabled:
+                        self.run_action(action)
+                        done.add(action.name)
+                        continue
+                    thread = threading.Thread(target=run_action,
+                                              args=(action, ),
+                                              name=action.name)
+                    thread.daemon = True
+                    running[action.name] = thread
+                    thread.start()
+            if not running:
+                if exc_info is None and pending:
+                    raise ScriptHarnessException(
+                        "Can't satisfy action requirements!",
+                        [action.name for action in pending]
+                    )
+                break
+            name, action_exc_info = finished.get()
+            running.pop(name).join()
+            done.add(name)
+            if action_exc_info is not None and exc_info is None:
+                exc_info = action_exc_info
+        if exc_info is not None:
+            six.reraise(*exc_info)
 
     def get_logger(self):
         """Get a logger to log messages.
@@ -367,15 +500,41 @@ class Script(object):
 
     def run(self):
         """Run all enabled actions.
+
+        If config['scriptharness_action_workers'] is more than 1, run
+        independent actions concurrently via run_actions_parallel().
+
+        If self.trace_file is set and tracing isn't already on, trace the
+        run and write the trace there at the end; see scriptharness.trace.
         """
-        context = build_context(self, PRE_RUN)
-        for listener, _ in iterate_pairs(self.listeners[PRE_RUN]):
-            listener(context)
-        for action in self.actions:
-            self.run_action(action)
-        context = build_context(self, POST_RUN)
-        for listener, _ in iterate_pairs(self.listeners[POST_RUN]):
-            listener(context)
+        trace_file = self.trace_file
+        if trace_file and not tracing_enabled():
+            start_tracing()
+        else:
+            trace_file = None
+        try:
+            with span("run", category="script", script=self.name):
+                context = build_context(self, PRE_RUN)
+                for listener, _ in iterate_pairs(self.listeners[PRE_RUN]):
+                    call_listener(listener, context)
+                max_workers = \
+                    self.config.get('scriptharness_action_workers') or 1
+                if max_workers > 1:
+                    self.run_actions_parallel(max_workers)
+                else:
+                    for action in self.actions:
+                        self.run_action(action)
+                context = build_context(self, POST_RUN)
+                for listener, _ in iterate_pairs(self.listeners[POST_RUN]):
+                    call_listener(listener, context)
+        except ScriptHarnessFatal:
+            # write the queued log records, including the fatal error's,
+            # before the exception ends the script
+            flush_async_handlers()
+            raise
+        finally:
+            if trace_file:
+                stop_tracing(trace_file)
         self.end_message()
 
 
@@ -422,3 +581,20 @@ class StrictScript(Script):
     def run(self):
         self._lock = True
         super(StrictScript, self).run()
+
+
+# FrozenScript {{{1
+class FrozenScript(StrictScript):
+    """A StrictScript whose config is a FrozenDict.
+
+    ReadOnlyDict.lock() copies the whole config into LockedTuples and
+    ReadOnlyDicts.  A FrozenDict is built once and is hashable, so it can be
+    used as a cache key, and per-action variations can be made cheaply with
+    FrozenDict.derive().
+    """
+    def dict_to_config(self, config):
+        """Let pre_config_lock() change the config dict, then freeze it.
+        """
+        self.config = config
+        self.pre_config_lock()
+        self.config = freeze(self.config)
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Structured logging: a compact JSON-lines log alongside the text log, with
+a side index to seek to each action or command.
+
+Each line of the structured log is a json object with an `event` and a
+`time`:
+
+  * ``action_start``, ``action_end``: action boundaries, with the action name
+    and, at the end, its status.
+  * ``command_start``, ``command_end``: command boundaries, with the command
+    id, command line, and action.  The end has the command's history and,
+    for ParsedCommands, the parser's num_errors, num_warnings and
+    worst_level.
+  * ``log``: a log record, with its level, logger name, message, and the
+    command id if it was logged while a command was running in that
+    thread.
+
+The index (``PATH.idx``) has a json line for each action and command
+boundary, with the byte offset of the event in the structured log.
+
+Usage::
+
+  structured_log = enable_structured_logging("artifacts/log.jsonl", script)
+  script.run()
+  structured_log.close()
+
+  reader = StructuredLogReader("artifacts/log.jsonl")
+  for command in reader.failed_commands():
+      for event in reader.iter_command(command['command_id']):
+          ...
+
+Commands run through run_many() log their output after they finish, so
+those lines don't have a command id.
+
+Attributes:
+  LOGGER_NAME (str): logging.Logger name to use
+  INDEX_SUFFIX (str): the suffix for the index file path
+  INDEX_EVENTS (Tuple[str, ...]): the events that are written to the index
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import json
+import logging
+import scriptharness.commands
+from scriptharness.exceptions import ScriptHarnessException
+from scriptharness.os import make_parent_dir
+import scriptharness.script
+import scriptharness.status
+import six
+import threading
+import time
+
+LOGGER_NAME = "scriptharness.structured"
+INDEX_SUFFIX = ".idx"
+INDEX_EVENTS = ("action_start", "action_end", "command_start", "command_end")
+
+
+def to_json(obj):
+    """Compact json, with anything json doesn't know about as a string.
+
+    Args:
+      obj (Any): the object to encode.
+
+    Returns:
+      bytes: the utf-8 encoded json.
+    """
+    return json.dumps(
+        obj, separators=(',', ':'), sort_keys=True, default=six.text_type
+    ).encode('utf-8')
+
+
+# StructuredLog {{{1
+class StructuredLog(object):
+    """Write structured events to a JSON-lines file and its index.
+
+    Attributes:
+      path (str): the path to the structured log.
+
+      filehandle (file): the structured log, opened in binary mode.
+
+      index (file): the index file, opened in binary mode.
+
+      lock (threading.Lock): serializes writes from multiple threads.
+
+      num_commands (int): the number of commands started so far, for
+        command ids.
+
+      thread_actions (Dict[int, str]): the running action for each thread.
+
+      thread_commands (Dict[int, int]): the running command id for each
+        thread.
+
+      command_ids (Dict[int, int]): the command id for each running
+        Command, keyed by id(command).
+    """
+    def __init__(self, path):
+        make_parent_dir(path)
+        self.path = path
+        self.filehandle = open(path, 'wb')
+        self.index = open(path + INDEX_SUFFIX, 'wb')
+        self.lock = threading.Lock()
+        self.num_commands = 0
+        self.thread_actions = {}
+        self.thread_commands = {}
+        self.command_ids = {}
+
+    def write(self, event, **kwargs):
+        """Write an event to the structured log, and to the index if it's a
+        boundary event.
+
+        Args:
+          event (str): the event name.
+
+          **kwargs: the event fields.  `time` defaults to time.time().
+        """
+        kwargs['event'] = event
+        kwargs.setdefault('time', time.time())
+        line = to_json(kwargs) + b'\n'
+        with self.lock:
+            if self.filehandle is None:
+                return
+            offset = self.filehandle.tell()
+            self.filehandle.write(line)
+            if event in INDEX_EVENTS:
+                entry = dict([(key, kwargs[key]) for key in (
+                    'action', 'command_id', 'command', 'status'
+                ) if key in kwargs])
+                entry['event'] = event
+                entry['offset'] = offset
+                self.index.write(to_json(entry) + b'\n')
+
+    def flush(self):
+        """Flush the structured log and index to disk.
+        """
+        with self.lock:
+            if self.filehandle is not None:
+                self.filehandle.flush()
+                self.index.flush()
+
+    def close(self):
+        """Close the structured log and index.
+        """
+        with self.lock:
+            if self.filehandle is not None:
+                self.filehandle.close()
+                self.index.close()
+                self.filehandle = self.index = None
+
+    # Script listeners {{{2
+    def pre_action(self, context):
+        """PRE_ACTION listener: write an action_start event.
+
+        Args:
+          context (scriptharness.script.Context): the action context.
+        """
+        self.thread_actions[threading.current_thread().ident] = \
+            context.action.name
+        self.write("action_start", action=context.action.name)
+
+    def post_action(self, context):
+        """POST_ACTION and POST_FATAL listener: write an action_end event.
+
+        Args:
+          context (scriptharness.script.Context): the action context.
+        """
+        self.thread_actions.pop(threading.current_thread().ident, None)
+        self.write("action_end", action=context.action.name,
+                   status=context.action.history.get('status'))
+
+    def add_script_listeners(self, script):
+        """Add the action listeners to a Script.
+
+        Args:
+          script (scriptharness.script.Script): the script to listen to.
+        """
+        script.add_listener(self.pre_action, scriptharness.script.PRE_ACTION)
+        script.add_listener(self.post_action,
+                            scriptharness.script.POST_ACTION)
+        script.add_listener(self.post_action, scriptharness.script.POST_FATAL)
+
+    # Command listeners {{{2
+    def pre_command(self, command):
+        """PRE_COMMAND listener: write a command_start event.
+
+        Args:
+          command (scriptharness.commands.Command): the command.
+        """
+        thread_id = threading.current_thread().ident
+        with self.lock:
+            self.num_commands += 1
+            command_id = self.num_commands
+        self.command_ids[id(command)] = command_id
+        self.thread_commands[thread_id] = command_id
+        self.write("command_start", command_id=command_id,
+                   command=command.command,
+                   action=self.thread_actions.get(thread_id),
+                   time=command.history.get('start_time', time.time()))
+
+    def post_command(self, command):
+        """POST_COMMAND listener: write a command_end event with the
+        command's history and parser stats.
+
+        Args:
+          command (scriptharness.commands.Command): the command.
+        """
+        self.thread_commands.pop(threading.current_thread().ident, None)
+        command_id = self.command_ids.pop(id(command), None)
+        parser = getattr(command, 'parser', None)
+        parser_history = None
+        if parser is not None:
+            parser_history = dict(parser.history)
+        self.write("command_end", command_id=command_id,
+                   command=command.command,
+                   status=command.history.get('status'),
+                   history=command.history, parser=parser_history,
+                   time=command.history.get('end_time', time.time()))
+
+    def add_command_listeners(self):
+        """Add the command listeners.
+        """
+        scriptharness.commands.add_listener(
+            self.pre_command, scriptharness.commands.PRE_COMMAND
+        )
+        scriptharness.commands.add_listener(
+            self.post_command, scriptharness.commands.POST_COMMAND
+        )
+
+    def remove_command_listeners(self):
+        """Remove the command listeners.
+        """
+        scriptharness.commands.remove_listener(
+            self.pre_command, scriptharness.commands.PRE_COMMAND
+        )
+        scriptharness.commands.remove_listener(
+            self.post_command, scriptharness.commands.POST_COMMAND
+        )
+
+
+# StructuredHandler {{{1
+class StructuredHandler(logging.Handler):
+    """Logging handler that writes `log` events to a StructuredLog.
+
+    Attributes:
+      structured_log (StructuredLog): the log to write to.
+    """
+    def __init__(self, structured_log, level=logging.NOTSET):
+        super(StructuredHandler, self).__init__(level=level)
+        self.structured_log = structured_log
+
+    def emit(self, record):
+        """Write the record as a `log` event.  The command id comes from the
+        thread that made the record, so batched records keep it.
+
+        Args:
+          record (logging.LogRecord): the record to write.
+        """
+        try:
+            self.structured_log.write(
+                "log", time=record.created, level=record.levelno,
+                logger=record.name, msg=record.getMessage(),
+                command_id=self.structured_log.thread_commands.get(
+                    record.thread
+                ),
+            )
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def flush(self):
+        """Flush the structured log."""
+        self.structured_log.flush()
+
+
+# enable_structured_logging {{{1
+class StructuredLogging(StructuredLog):
+    """A StructuredLog hooked up to a logger, the command listeners, and
+    optionally a Script's action listeners.
+
+    Attributes:
+      handler (StructuredHandler): the handler added to the logger.
+
+      logger (logging.Logger): the logger the handler was added to.
+    """
+    def __init__(self, path, script=None, logger_name='',
+                 level=logging.NOTSET):
+        super(StructuredLogging, self).__init__(path)
+        self.handler = StructuredHandler(self, level=level)
+        self.logger = logging.getLogger(logger_name)
+        self.logger.addHandler(self.handler)
+        self.add_command_listeners()
+        if script is not None:
+            self.add_script_listeners(script)
+
+    def close(self):
+        """Remove the handler and command listeners, then close the files.
+        """
+        self.logger.removeHandler(self.handler)
+        self.remove_command_listeners()
+        super(StructuredLogging, self).close()
+
+
+def enable_structured_logging(path, script=None, logger_name='',
+                              level=logging.NOTSET):
+    """Start writing a structured log.
+
+    Args:
+      path (str): the path to the structured log.  The index is written to
+        path + INDEX_SUFFIX.
+
+      script (Optional[scriptharness.script.Script]): the script to record
+        action boundaries for.
+
+      logger_name (Optional[str]): the logger to record log events from.
+        Defaults to the root logger.
+
+      level (Optional[int]): the lowest level of log event to record.
+
+    Returns:
+      StructuredLogging: call close() when done.
+    """
+    return StructuredLogging(path, script=script, logger_name=logger_name,
+                             level=level)
+
+
+# StructuredLogReader {{{1
+class StructuredLogReader(object):
+    """Read a structured log, using its index to seek to an action or
+    command.
+
+    Attributes:
+      path (str): the path to the structured log.
+
+      index (List[Dict[str, Any]]): the index entries, in order.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = []
+        try:
+            with open(path + INDEX_SUFFIX, 'rb') as filehandle:
+                for line in filehandle:
+                    self.index.append(json.loads(line.decode('utf-8')))
+        except (IOError, OSError, ValueError) as exc_info:
+            raise ScriptHarnessException(
+                "Can't read structured log index for %s!" % path, exc_info
+            )
+
+    def actions(self):
+        """Get the action_end index entries.
+
+        Returns:
+          List[Dict[str, Any]]: with action, status, and offset.
+        """
+        return [entry for entry in self.index
+                if entry['event'] == 'action_end']
+
+    def commands(self):
+        """Get the command_end index entries.
+
+        Returns:
+          List[Dict[str, Any]]: with command_id, command, status, and
+            offset.
+        """
+        return [entry for entry in self.index
+                if entry['event'] == 'command_end']
+
+    def failed_commands(self):
+        """Get the command_end index entries for unsuccessful commands.
+
+        Returns:
+          List[Dict[str, Any]]
+        """
+        return [entry for entry in self.commands()
+                if entry.get('status') != scriptharness.status.SUCCESS]
+
+    def get_range(self, start_event, end_event, key, value):
+        """Find the byte offsets of the first start_event to end_event
+        boundary where key == value.
+
+        Returns:
+          Tuple[int, int]: the start offset and the end offset (inclusive).
+
+        Raises:
+          scriptharness.exceptions.ScriptHarnessException: if not found.
+        """
+        start = None
+        for entry in self.index:
+            if entry.get(key) != value:
+                continue
+            if entry['event'] == start_event and start is None:
+                start = entry['offset']
+            elif entry['event'] == end_event and start is not None:
+                return start, entry['offset']
+        raise ScriptHarnessException(
+            "Can't find %s %s in %s!" % (key, value, self.path)
+        )
+
+    def iter_events(self, start=0, end=None):
+        """Iterate over the events, starting at byte offset `start`.
+
+        Args:
+          start (Optional[int]): the offset to seek to.  Defaults to 0.
+
+          end (Optional[int]): stop after the event at this offset.
+            Defaults to None, the end of the file.
+
+        Yields:
+          Dict[str, Any]: each event.
+        """
+        with open(self.path, 'rb') as filehandle:
+            filehandle.seek(start)
+            while end is None or filehandle.tell() <= end:
+                line = filehandle.readline()
+                if not line:
+                    return
+                yield json.loads(line.decode('utf-8'))
+
+    def iter_action(self, name):
+        """Iterate over the events from an action's start to its end.
+
+        Args:
+          name (str): the action name.
+
+        Yields:
+          Dict[str, Any]: each event.
+        """
+        start, end = self.get_range('action_start', 'action_end',
+                                    'action', name)
+        for event in self.iter_events(start, end):
+            yield event
+
+    def iter_command(self, command_id):
+        """Iterate over a command's events: its start, its log events, and
+        its end.  Events from other threads are skipped.
+
+        Args:
+          command_id (int): the command id.
+
+        Yields:
+          Dict[str, Any]: each event.
+        """
+        start, end = self.get_range('command_start', 'command_end',
+                                    'command_id', command_id)
+        for event in self.iter_events(start, end):
+            if event.get('command_id') == command_id:
+                yield event
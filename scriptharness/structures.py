@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """Data structures for configs.
 
-There are two config dict models here:
+There are three config dict models here:
  * LoggingDict logs any changes to the dict or its children.  When debugging,
    config changes will be marked in the log.  This is the default model.
 
@@ -10,6 +10,11 @@ There are two config dict models here:
    one can assume the config hasn't changed from the moment of locking.
    This is the original `mozharness` model.
 
+ * FrozenDict is immutable from creation, and hashable, so it can be used as
+   a cache key.  freeze() shares identical sub-configs between FrozenDicts,
+   and FrozenDict.derive() makes modified copies that share the unchanged
+   children.
+
 Attributes:
   DEFAULT_LEVEL (int): the default logging level to set
   DEFAULT_LOGGER_NAME (str): the default logger name to use
@@ -20,21 +25,35 @@ Attributes:
     the values in the list/dict shouldn't be logged
   SUPPORTED_LOGGING_TYPES (Dict[TypeVar, Class]): a non-logging to logging class map, e.g.
     dict: LoggingDict.  Not currently supporting sets or collections.
+  SUPPORTED_TYPES (Tuple[TypeVar, ...]): the keys of SUPPORTED_LOGGING_TYPES,
+    for isinstance()
+  SNAPSHOT_LEAF_TYPES (FrozenSet[TypeVar]): immutable types that snapshot()
+    doesn't copy
+  LIST_TUPLE_TYPES (Tuple[TypeVar, ...]): locked list types that snapshot()
+    copies to lists
+  WRAP_LOCK (threading.RLock): held while LoggingDicts and LoggingLists
+    add logging to a child and store it, so threads sharing a config all
+    get the same wrapper
 """
 
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
 from copy import deepcopy
 from scriptharness.exceptions import ScriptHarnessException
+from scriptharness.lazy import LazyModule
 import six
 import logging
-import pprint
+import threading
+import weakref
+
+pprint = LazyModule("pprint")  # pylint: disable=invalid-name
 
 
 # Constants {{{1
 DEFAULT_LEVEL = logging.INFO
 DEFAULT_LOGGER_NAME = 'scriptharness.data_structures'
 QUOTES = ("'", '"', "'''", '"""')
+WRAP_LOCK = threading.RLock()
 LOGGING_STRINGS = {
     # position, self, item
     "list": {
@@ -73,6 +92,8 @@ LOGGING_STRINGS = {
             "changed": "update: %(key)s now %(value)s",
             "unchanged": "update: %(key)s unchanged",
         },
+        "bulk_update": "bulk update: %(num_changed)d of %(num_keys)d keys "
+                       "changed: %(keys)s",
     },
 }
 MUTED_LOGGING_STRINGS = {
@@ -112,6 +133,8 @@ MUTED_LOGGING_STRINGS = {
             "changed": "update: %(key)s changed",
             "unchanged": "update: %(key)s unchanged",
         },
+        "bulk_update": "bulk update: %(num_changed)d of %(num_keys)d keys "
+                       "changed: %(keys)s",
     },
 }
 
@@ -137,6 +160,28 @@ def iterate_pairs(data):
 
 
 # LoggingClasses and helpers {{{1
+def format_child_name(name):
+    """Format a child's name for LoggingClass.full_name().
+
+    Indices become [0].  Keys are quoted with the first of QUOTES that isn't
+    in the key, e.g. ['key'], or not quoted at all if they all are.
+
+    Args:
+      name (str or int): the child's key or index.
+
+    Returns:
+      str: the formatted name.
+    """
+    if isinstance(name, int):
+        return "[%d]" % name
+    quote = ""
+    for sep in QUOTES:
+        if sep not in name:
+            quote = sep
+            break
+    return "[%s%s%s]" % (quote, name, quote)
+
+
 # LoggingClass {{{2
 class LoggingClass(object):
     """General logging methods for the Logging* classes to subclass.
@@ -146,11 +191,13 @@ class LoggingClass(object):
       logger_name (str): the logger name to use
       name (str): the name of the class for logs
       parent (str): the name of the parent, if applicable, for logs
+      _full_name (str): the cached full_name(), or None
     """
     name = None
     parent = None
     level = None
     logger_name = None
+    _full_name = None
 
     def items(self):
         """Return dict.items() for dicts, and enumerate(self) for lists+tuples.
@@ -160,11 +207,121 @@ class LoggingClass(object):
 
         The main negative here might be adding an attr items to non-dict
         data types.
+
+        Any children that don't have logging yet get it first.
+        """
+        self.add_logging_to_children()
+        return self.raw_items()
+
+    def raw_items(self):
+        """Like items(), but without adding logging to the children.
+
+        Children are only wrapped in Logging* classes when they're accessed,
+        so this can return a mix of Logging* and plain objects.
+        """
+        if isinstance(self, dict):
+            return dict.items(self)
+        elif isinstance(self, list):
+            return enumerate(list.__iter__(self))
+        return enumerate(tuple.__iter__(self))
+
+    def add_logging_to_child(self, child_name, child):
+        """Add logging to a child, if it's a supported type and doesn't
+        already have logging as our child.
+
+        LoggingDicts and LoggingLists wrap their children lazily, the first
+        time they're accessed, so building a large config is cheap.  The
+        new Logging* child gets our level, muted and logger_name settings,
+        and its name and parent are set here rather than in a separate
+        recursively_set_parent() pass.
+
+        Args:
+          child_name (str or int): the key or index of the child.
+          child (Any): the child.
+
+        Returns:
+          Any: the child, with logging if applicable.
+        """
+        if not self.needs_logging(child):
+            return child
+        return self.add_logging_to_new_child(child_name, child)
+
+    def needs_logging(self, child):
+        """Check whether add_logging_to_child() would wrap child.
+
+        Args:
+          child (Any): the child.
+
+        Returns:
+          bool: True if child is a supported type without logging as our
+            child.
+        """
+        return isinstance(child, SUPPORTED_TYPES) and \
+            not (is_logging_class(child) and child.parent is self)
+
+    def get_child(self, child_name):
+        """Get a child, adding logging to it and storing it in self first if
+        it doesn't have logging yet.
+
+        The wrapper is a copy of the plain child, so two threads mustn't
+        both wrap and store it: changes through the wrapper that's
+        overwritten would be lost.  The check, wrap and store happen under
+        WRAP_LOCK, and the child is checked again once it's held.
+
+        Args:
+          child_name (str or int): the key or index of the child.
+
+        Returns:
+          Any: the child, with logging if applicable.
         """
-        if issubclass(self.__class__, dict):
-            return super(LoggingClass, self).items()
+        if isinstance(self, dict):
+            getitem, setitem = dict.__getitem__, dict.__setitem__
         else:
-            return enumerate(self)
+            getitem, setitem = list.__getitem__, list.__setitem__
+        child = getitem(self, child_name)
+        if not self.needs_logging(child):
+            return child
+        with WRAP_LOCK:
+            child = getitem(self, child_name)
+            wrapped = self.add_logging_to_child(child_name, child)
+            if wrapped is not child:
+                setitem(self, child_name, wrapped)
+            return wrapped
+
+    def add_logging_to_new_child(self, child_name, child):
+        """Add logging to a child that's being added to self, and set its
+        name and parent in the same step.
+
+        Unlike add_logging_to_child(), Logging* objects get a new wrapper,
+        so the same object is never the child of two parents.
+
+        Args:
+          child_name (str or int): the key or index of the child.
+          child (Any): the child.
+
+        Returns:
+          Any: the child, with logging if applicable.
+        """
+        child = add_logging_to_obj(
+            child, logger_name=self.logger_name, level=self.level,
+            muted=getattr(self, 'muted', False)
+        )
+        if is_logging_class(child):
+            child.name = child_name
+            child.parent = self
+        return child
+
+    def add_logging_to_children(self):
+        """Add logging to all of our children that don't have it yet.
+
+        Tuples can't be changed in place, so LoggingTuples add logging to
+        their children when they're created.
+        """
+        if isinstance(self, tuple):
+            return
+        for child_name, child in list(self.raw_items()):
+            if self.needs_logging(child):
+                self.get_child(child_name)
 
     def recursively_set_parent(self, name=None, parent=None):
         """Recursively set name + parent.
@@ -176,7 +333,9 @@ class LoggingClass(object):
         message is helpful.
 
         For each child, set name automatically.  For dicts, the name is the
-        key.  For everything else, the name is the index.
+        key.  For everything else, the name is the index.  Children without
+        logging are skipped; they get their name and parent when they're
+        wrapped.
 
         Args:
           name (Optional[str]): set self.name, for later logging purposes.
@@ -189,7 +348,9 @@ class LoggingClass(object):
             self.name = name
         if parent is not None:
             self.parent = parent
-        for child_name, child in self.items():
+        # our full name, and our descendents', may have changed
+        self._full_name = None
+        for child_name, child in self.raw_items():
             if is_logging_class(child):
                 child.recursively_set_parent(
                     child_name, self
@@ -205,6 +366,17 @@ class LoggingClass(object):
         if is_logging_class(child):
             child.recursively_set_parent(child_name, parent=self)
 
+    def snapshot(self, frozen=False):
+        """Get a plain-data copy of self; see snapshot().
+
+        Args:
+          frozen (Optional[bool]): return a FrozenDict/FrozenList instead.
+
+        Returns:
+          dict, list, tuple, FrozenDict or FrozenList: the copy.
+        """
+        return snapshot(self, frozen=frozen)
+
     def ancestor_child_list(self, child_list=None):
         """Get the original ancestor of self, and the descending, linear list
         of descendents' names leading up to (and including) self.
@@ -230,31 +402,30 @@ class LoggingClass(object):
     def full_name(self):
         """Get the full name of self.
 
-        This will call self.ancestor_child_list to get the original ancestor +
-        all the names of its descendents up to and including self, then
-        build the name from that.
-
-        Args:
-          ancestor (Optional[LoggingClass]): specify the ancestor
-          child_list (Optional[List[str]]): a list of descendents' names, in order
+        This is the parent's full name plus our formatted name, or just our
+        name if we don't have a parent.  The result is cached until
+        recursively_set_parent() renames or re-parents self or one of our
+        ancestors, so logging changes doesn't walk up to the root each time.
 
         Returns:
           str: the full name of self.
         """
-        ancestor, child_list = self.ancestor_child_list()
-        name = ancestor.name or ""
-        for item in child_list:
-            if isinstance(item, int):
-                name += "[%d]" % item
+        if self._full_name is None:
+            if self.parent is None:
+                self._full_name = self.name or ""
             else:
-                quote = ""
-                item = item
-                for sep in QUOTES:
-                    if sep not in item:
-                        quote = sep
-                        break
-                name += "[%s%s%s]" % (quote, item, quote)
-        return name
+                self._full_name = self.parent.full_name() + \
+                    format_child_name(self.name)
+        return self._full_name
+
+    def logging_enabled(self):
+        """Check whether changes to self will be logged, to avoid building
+        messages that won't be.
+
+        Returns:
+          bool: True if our logger is enabled for self.level.
+        """
+        return logging.getLogger(self.logger_name).isEnabledFor(self.level)
 
     def log_change(self, message, repl_dict=None):
         """Log a change to self.
@@ -263,6 +434,8 @@ class LoggingClass(object):
           message (str): The message to log.
         """
         logger = logging.getLogger(self.logger_name)
+        if not logger.isEnabledFor(self.level):
+            return None
         name = self.full_name()
         if name:
             message = "{}: {}".format(name, message)
@@ -276,6 +449,9 @@ class LoggingClass(object):
 class LoggingList(LoggingClass, list):
     """A list that logs any changes, as do its children.
 
+    Children get logging the first time they're accessed, including through
+    iteration, slices, copy() and pop().
+
     Attributes:
       level (int): the logging level for changes
       logger_name (str): the logger name to use
@@ -288,15 +464,29 @@ class LoggingList(LoggingClass, list):
         self.logger_name = logger_name
         self.muted = muted
         self.strings = get_strings(self, muted=self.muted)
-        super(LoggingList, self).__init__(
-            [add_logging_to_obj(x, logger_name=self.logger_name,
-                                level=level, muted=self.muted) for x in items]
-        )
+        super(LoggingList, self).__init__(items)
 
     def __deepcopy__(self, memo):
         """Return a list on deepcopy.
         """
-        return [deepcopy(elem, memo) for elem in self]
+        return snapshot(self, memo=memo)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            self.add_logging_to_children()
+            return super(LoggingList, self).__getitem__(position)
+        # normalize negative indices, for the child's name
+        position = range(len(self))[position]
+        return self.get_child(position)
+
+    def __iter__(self):
+        self.add_logging_to_children()
+        return super(LoggingList, self).__iter__()
+
+    def copy(self):
+        """Return a shallow copy as a list; see LoggingDict.copy().
+        """
+        return self[:]
 
     def __delitem__(self, item):
         self.log_change(self.strings['delitem'],
@@ -325,8 +515,8 @@ class LoggingList(LoggingClass, list):
         children's names (which correspond to indeces) or a subset of
         [position:]
         """
-        for count, elem in enumerate(self, start=position):
-            self._child_set_parent(elem, int(count))
+        for count in range(position, len(self)):
+            self._child_set_parent(list.__getitem__(self, count), count)
 
     def log_self(self):
         """Log the current list.
@@ -334,7 +524,7 @@ class LoggingList(LoggingClass, list):
         Since some methods insert values or rearrange them, it'll be easier to
         debug things if we log the list after those operations.
         """
-        if self.strings.get('log_self'):
+        if self.strings.get('log_self') and self.logging_enabled():
             self.log_change(self.strings['log_self'],
                             repl_dict={'self': pprint.pformat(self)})
 
@@ -350,14 +540,14 @@ class LoggingList(LoggingClass, list):
 
     def extend(self, item):
         position = len(self)
-        self.log_change(self.strings['extend'],
-                        repl_dict={'item': pprint.pformat(item)})
+        if self.logging_enabled():
+            self.log_change(self.strings['extend'],
+                            repl_dict={'item': pprint.pformat(item)})
         super(LoggingList, self).extend(
-            add_logging_to_obj(item, logger_name=self.logger_name,
-                               level=self.level, muted=self.muted)
+            self.add_logging_to_new_child(count, child)
+            for count, child in enumerate(item, start=position)
         )
         self.log_self()
-        self.child_set_parent(position)
 
     def insert(self, position, item):
         self.log_change(
@@ -396,7 +586,10 @@ class LoggingList(LoggingClass, list):
         self.log_self()
         if position is not None:
             self.child_set_parent(position)
-        return value
+        if is_logging_class(value):
+            return value
+        return add_logging_to_obj(value, logger_name=self.logger_name,
+                                  level=self.level, muted=self.muted)
 
     def sort(self, *args, **kwargs):
         self.log_change(self.strings['sort'])
@@ -414,24 +607,41 @@ class LoggingList(LoggingClass, list):
 # LoggingTuple {{{2
 class LoggingTuple(LoggingClass, tuple):
     """A tuple whose children log any changes.
+
+    Tuples can't be changed, so the children get logging here, but their
+    own children are still wrapped lazily.
     """
     def __new__(cls, items, **kwargs):
-        return tuple.__new__(
+        obj = tuple.__new__(
             cls, (add_logging_to_obj(x, **kwargs) for x in items)
         )
+        for position, child in obj.raw_items():
+            if is_logging_class(child):
+                child.name = position
+                child.parent = obj
+        return obj
 
     def __deepcopy__(self, memo):
         """Return a tuple on deepcopy.
         """
-        return tuple(
-            [deepcopy(elem, memo) for elem in self]
-        )
+        return snapshot(self, memo=memo)
 
 
 # LoggingDict {{{2
 class LoggingDict(LoggingClass, dict):
     """A dict that logs any changes, as do its children.
 
+    The children get logging the first time they're accessed, so creating a
+    LoggingDict from a large config only makes a shallow copy.  Until then,
+    unaccessed nested dicts and lists are shared with `items`, which isn't
+    modified.
+
+    Everything that hands out children counts as access: indexing, get(),
+    items(), values(), copy(), pop(), popitem(), setdefault(), and dict(self)
+    or {**self}.  Only calling the dict methods directly, e.g.
+    dict.values(self), returns the unwrapped children, whose changes aren't
+    logged.
+
     Attributes:
       level (int): the logging level for changes
       logger_name (str): the logger name to use
@@ -444,12 +654,34 @@ class LoggingDict(LoggingClass, dict):
         self.logger_name = logger_name
         self.muted = muted
         self.strings = get_strings(self, muted=muted)
-        for key, value in items.items():
-            items[key] = add_logging_to_obj(
-                value, logger_name=logger_name, level=level, muted=self.muted
-            )
         super(LoggingDict, self).__init__(items)
 
+    def __getitem__(self, key):
+        return self.get_child(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        self.add_logging_to_children()
+        return super(LoggingDict, self).values()
+
+    def __iter__(self):
+        # Overriding __iter__ stops dict(self), {**self} and dict.update()
+        # from copying our values directly, so they use keys() and
+        # __getitem__() and get the children with logging.
+        return super(LoggingDict, self).__iter__()
+
+    def copy(self):
+        """Return a shallow copy as a dict, like dict.copy().  The children
+        are the same Logging* objects as ours, so changes to them through
+        the copy are logged.
+        """
+        self.add_logging_to_children()
+        return super(LoggingDict, self).copy()
+
     def __setitem__(self, key, value):
         repl_dict = {'key': key, 'value': value}
         self.log_change(
@@ -489,6 +721,9 @@ class LoggingDict(LoggingClass, dict):
         else:
             message = self.strings['pop']['message_no_default']
         self.log_change(message, repl_dict=repl_dict)
+        if key in self:
+            # add logging to the popped child, as if it had been accessed
+            self[key]  # pylint: disable=pointless-statement
         return super(LoggingDict, self).pop(key, *args)
 
     def popitem(self):
@@ -501,7 +736,8 @@ class LoggingDict(LoggingClass, dict):
             self.strings['popitem']['changed'],
             repl_dict={'key': key[0]},
         )
-        return status
+        # add logging to the popped child, as pop() does
+        return status[0], self.add_logging_to_child(status[0], status[1])
 
     def setdefault(self, key, default=None):
         changed = True
@@ -517,7 +753,8 @@ class LoggingDict(LoggingClass, dict):
         )
         default = add_logging_to_obj(default, logger_name=self.logger_name,
                                      level=self.level, muted=self.muted)
-        status = super(LoggingDict, self).setdefault(key, default)
+        super(LoggingDict, self).setdefault(key, default)
+        status = self[key]
         if not changed:
             message = self.strings['setdefault']['unchanged']
         else:
@@ -545,11 +782,18 @@ class LoggingDict(LoggingClass, dict):
             repl_dict=repl_dict,
         )
         status = [key, None]
-        if key not in self or self[key] != value:
+        if key not in self or dict.__getitem__(self, key) != value:
             status = [key, value]
         return status
 
     def update(self, args):
+        if not self.logging_enabled():
+            # nothing to log: add logging and set parents in one pass
+            super(LoggingDict, self).update(
+                (key, self.add_logging_to_new_child(key, value))
+                for key, value in iterate_pairs(args)
+            )
+            return
         changed_keys = []
         new_args = {}
         for key, value in iterate_pairs(args):
@@ -571,14 +815,41 @@ class LoggingDict(LoggingClass, dict):
             )
             self.child_set_parent(key)
 
+    def bulk_update(self, args):
+        """Like update(), but log a single summary of the changed keys
+        rather than two messages per key.  This is much faster for large
+        updates, e.g. merging in a config file.
+
+        If the logger isn't enabled for self.level, nothing is compared or
+        logged.
+
+        Args:
+          args (Sequence[Any, Any]): a dict, or an iterable of pairs, as
+            for iterate_pairs().
+        """
+        if not self.logging_enabled():
+            self.update(args)
+            return
+        changed = []
+        new_items = []
+        for key, value in iterate_pairs(args):
+            if key not in self or dict.__getitem__(self, key) != value:
+                changed.append(key)
+            new_items.append((key, self.add_logging_to_new_child(key, value)))
+        super(LoggingDict, self).update(new_items)
+        self.log_change(
+            self.strings['bulk_update'],
+            repl_dict={
+                'num_changed': len(changed),
+                'num_keys': len(new_items),
+                'keys': pprint.pformat(changed),
+            },
+        )
+
     def __deepcopy__(self, memo):
         """Return a dict on deepcopy()
         """
-        result = {}
-        memo[id(self)] = result
-        for key, value in self.items():
-            result[key] = deepcopy(value, memo)
-        return result
+        return snapshot(self, memo=memo)
 
 
 # LoggingHelpers {{{2
@@ -587,6 +858,7 @@ SUPPORTED_LOGGING_TYPES = {
     list: LoggingList,
     tuple: LoggingTuple,
 }
+SUPPORTED_TYPES = tuple(SUPPORTED_LOGGING_TYPES)
 
 def is_logging_class(item):
     """Determine if a class is one of the Logging* classes.
@@ -597,9 +869,10 @@ def is_logging_class(item):
     return issubclass(item.__class__, LoggingClass)
 
 def add_logging_to_obj(item, **kwargs):
-    """Recursively add logging to all contents of a LoggingDict.
+    """Add logging to a child of a LoggingDict.
 
-    Any children of supported types will also have logging enabled.
+    Any children of supported types will also have logging enabled, when
+    they're first accessed.
     Currently supported:: list, tuple, dict.
 
     Args:
@@ -744,3 +1017,302 @@ class ReadOnlyDict(dict):
         for key, value in self.items():
             result[key] = deepcopy(value, memo)
         return result
+
+    def snapshot(self, frozen=False):
+        """Get a plain-data copy of self; see snapshot().
+
+        Args:
+          frozen (Optional[bool]): return a FrozenDict instead.
+
+        Returns:
+          dict or FrozenDict: the copy.
+        """
+        return snapshot(self, frozen=frozen)
+
+
+# FrozenDict {{{1
+# Interned FrozenDicts, keyed by intern_key(); see freeze()
+_INTERNED = weakref.WeakValueDictionary()
+
+
+def intern_key(item):
+    """Build a structural key for a frozen item, for hash-consing.
+
+    Unlike ==, this distinguishes types, so {'a': 1} and {'a': True} don't
+    share a FrozenDict.  FrozenDicts are interned, so their key is their
+    id(); FrozenLists can't be weakly referenced, so theirs is built from
+    their contents.
+
+    Args:
+      item (Any): a frozen item.
+
+    Returns:
+      Hashable: the key.
+    """
+    if isinstance(item, FrozenDict):
+        return id(item)
+    elif isinstance(item, FrozenList):
+        return item.intern_key
+    return (type(item), item)
+
+
+def freeze(item):
+    """Recursively convert an item to its frozen equivalent.
+
+    Dicts become FrozenDicts, lists and tuples become FrozenLists, and sets
+    become frozensets.  Equal FrozenDicts are hash-consed: freezing two
+    equal configs returns the same FrozenDict, and equal sub-configs are
+    shared.
+
+    Args:
+      item (Any): the item to freeze.
+
+    Returns:
+      Any: the frozen item.
+
+    Raises:
+      scriptharness.exceptions.ScriptHarnessException: if item contains
+        something unhashable that can't be frozen.
+    """
+    if isinstance(item, FrozenList):
+        return item
+    elif isinstance(item, FrozenDict):
+        result = item
+    elif isinstance(item, dict):
+        result = FrozenDict(item)
+    elif isinstance(item, (list, tuple)):
+        return FrozenList(item)
+    elif isinstance(item, (set, frozenset)):
+        return frozenset(freeze(x) for x in item)
+    else:
+        try:
+            hash(item)
+        except TypeError:
+            raise ScriptHarnessException("Can't freeze unhashable item!",
+                                         item)
+        return item
+    return _INTERNED.setdefault(result.intern_key, result)
+
+
+def thaw(item):
+    """Recursively convert frozen items back to dicts and lists.
+
+    Args:
+      item (Any): the item to thaw.
+
+    Returns:
+      Any: a mutable copy of item, or item if it isn't frozen.
+    """
+    if isinstance(item, FrozenDict):
+        return dict((key, thaw(value)) for key, value in item.items())
+    elif isinstance(item, FrozenList):
+        return [thaw(value) for value in item]
+    return item
+
+
+class FrozenList(tuple):
+    """An immutable, hashable list, with frozen children.  It compares equal
+    to lists and tuples with the same contents.
+
+    Attributes:
+      intern_key (Hashable): the structural key used by freeze().
+    """
+    def __new__(cls, items=()):
+        obj = tuple.__new__(cls, (freeze(x) for x in items))
+        obj.intern_key = ('list',) + tuple(intern_key(x) for x in obj)
+        return obj
+
+    def __eq__(self, other):
+        # compare equal to the list it was frozen from
+        if isinstance(other, list):
+            other = tuple(other)
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = tuple.__hash__
+
+    def __deepcopy__(self, memo):
+        """Return a list on deepcopy.
+        """
+        return thaw(self)
+
+    def __reduce__(self):
+        return (self.__class__, (tuple(self),))
+
+
+class FrozenDict(dict):
+    """An immutable, hashable dict, with frozen children.
+
+    It's a dict subclass, so it can be json-dumped and used anywhere a
+    config dict is read.  Any change raises ScriptHarnessException; use
+    derive() or without() to build a modified copy, or deepcopy() for a
+    mutable one.  Since it's frozen from creation, lock() is a noop.
+
+    The hash is computed once; comparisons between FrozenDicts short-circuit
+    on identity and on the hash, so equal interned configs compare in O(1).
+
+    Attributes:
+      intern_key (Hashable): the structural key used by freeze().
+    """
+    _hash = None
+    intern_key = None
+
+    def __init__(self, *args, **kwargs):
+        super(FrozenDict, self).__init__()
+        for key, value in iterate_pairs(dict(*args, **kwargs)):
+            dict.__setitem__(self, key, freeze(value))
+        self.intern_key = ('dict', frozenset(
+            (type(key), key, intern_key(value))
+            for key, value in iterate_pairs(self)
+        ))
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(iterate_pairs(self)))
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, FrozenDict) and hash(self) != hash(other):
+            return False
+        return super(FrozenDict, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @staticmethod
+    def _frozen(*args):
+        """Throw an exception on any change.
+        """
+        raise ScriptHarnessException("FrozenDict is frozen!", args)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = __ior__ = _frozen
+
+    def lock(self):  # pylint: disable=no-self-use
+        """Noop, for ReadOnlyDict compatibility: FrozenDicts are always
+        locked.
+        """
+        return None
+
+    def derive(self, *args, **kwargs):
+        """Return a frozen copy of self with some keys changed, e.g. for a
+        per-action override.  Unchanged children are shared, not copied.
+
+        Args:
+          *args, **kwargs: the changes, as for dict.update().
+
+        Returns:
+          FrozenDict: the modified copy.
+        """
+        result = dict(self)
+        result.update(*args, **kwargs)
+        return freeze(result)
+
+    def without(self, *keys):
+        """Return a frozen copy of self without some keys.
+
+        Args:
+          *keys: the keys to remove.  Missing keys are ignored.
+
+        Returns:
+          FrozenDict: the modified copy.
+        """
+        return freeze(dict(
+            (key, value) for key, value in iterate_pairs(self)
+            if key not in keys
+        ))
+
+    def __deepcopy__(self, memo):
+        """Return a mutable dict on deepcopy()
+        """
+        return thaw(self)
+
+    def snapshot(self, frozen=False):
+        """Get a plain-data copy of self, or self if frozen is True.
+
+        Args:
+          frozen (Optional[bool]): return self.
+
+        Returns:
+          dict or FrozenDict: the copy.
+        """
+        if frozen:
+            return self
+        return thaw(self)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+# snapshot {{{1
+# Immutable leaf types that snapshot() returns as-is
+SNAPSHOT_LEAF_TYPES = frozenset(
+    (six.text_type, six.binary_type, bool, float, type(None)) +
+    six.integer_types
+)
+# Tuple types that are locked lists, and snapshot() to lists
+LIST_TUPLE_TYPES = (LockedTuple, FrozenList)
+
+
+def snapshot(item, frozen=False, memo=None):
+    """Get a plain-data copy of a config, e.g. to audit it before an action.
+
+    This is a single specialized traversal: dicts (including LoggingDicts,
+    ReadOnlyDicts and FrozenDicts) become dicts, lists, LockedTuples and
+    FrozenLists become lists, and other tuples become tuples.  Strings,
+    numbers, bools and None are returned as-is, without going through
+    deepcopy(); anything else is deepcopy()ed.  LoggingDict children that
+    haven't been accessed yet are copied without adding logging to them.
+
+    Args:
+      item (Any): the config to copy.
+
+      frozen (Optional[bool]): return a FrozenDict via freeze() instead.
+        Unchanged sub-configs are shared with previous frozen snapshots
+        rather than copied.
+
+      memo (Optional[Dict[int, Any]]): the deepcopy() memo dict, for
+        __deepcopy__() support.
+
+    Returns:
+      Any: the copy.
+    """
+    if frozen:
+        return freeze(item)
+    if memo is None:
+        memo = {}
+    return _snapshot(item, memo)
+
+
+def _snapshot(item, memo):
+    """Recursive helper for snapshot().
+    """
+    if type(item) in SNAPSHOT_LEAF_TYPES:
+        return item
+    item_id = id(item)
+    if item_id in memo:
+        return memo[item_id]
+    if isinstance(item, dict):
+        result = {}
+        memo[item_id] = result
+        for key, value in dict.items(item):
+            result[key] = _snapshot(value, memo)
+    elif isinstance(item, list):
+        result = []
+        memo[item_id] = result
+        for value in list.__iter__(item):
+            result.append(_snapshot(value, memo))
+    elif isinstance(item, LIST_TUPLE_TYPES):
+        result = [_snapshot(value, memo) for value in tuple.__iter__(item)]
+        memo[item_id] = result
+    elif isinstance(item, tuple):
+        result = tuple(_snapshot(value, memo)
+                       for value in tuple.__iter__(item))
+        memo[item_id] = result
+    else:
+        result = deepcopy(item, memo)
+    return result
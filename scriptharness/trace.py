@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Trace a Script run as nested spans, and write them in the Chrome
+trace-event format, which chrome://tracing, Perfetto, and speedscope can
+open.
+
+Script.run(), Script.run_action(), Action.run(), the listener loops, and
+each Command's run are wrapped in span()s.  Spans in the same thread nest;
+concurrent actions and run_many() commands show up in their own threads.
+
+Tracing is off unless it's started, either with ``--trace-file PATH``,
+which traces Script.run() and writes the trace at the end of the run, or by
+hand::
+
+  scriptharness.trace.start_tracing()
+  try:
+      script.run()
+  finally:
+      scriptharness.trace.stop_tracing("artifacts/trace.json")
+
+When tracing is off, span() returns a shared no-op context manager, so the
+instrumentation costs a function call per span.
+
+Attributes:
+  TRACER (Tracer): the running Tracer, or None when tracing is off.
+  NULL_SPAN (NullSpan): the no-op span returned when tracing is off.
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import json
+import os
+from scriptharness.os import make_parent_dir
+import threading
+import time
+
+TRACER = None
+
+
+# Spans {{{1
+class NullSpan(object):
+    """A span that doesn't record anything.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    """A span that records a complete ('X') event when it exits.
+
+    Attributes:
+      tracer (Tracer): the tracer to record to.
+      name (str): the event name.
+      category (str): the event category.
+      args (Dict[str, Any]): extra information for the event.
+      start_time (float): when the span was entered.
+    """
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start_time')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self.args['exception'] = exc_type.__name__
+        self.tracer.add_event(self.name, self.category, self.start_time,
+                              time.time(), self.args)
+        return False
+
+
+# Tracer {{{1
+class Tracer(object):
+    """Collect trace events.
+
+    Attributes:
+      pid (int): the process id for the events.
+      events (List[Dict[str, Any]]): the complete events so far.
+      thread_names (Dict[int, str]): the name of each thread with events.
+      lock (threading.Lock): serializes adding events.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+
+    def span(self, name, category, args):
+        """Create a Span that records to this tracer.
+
+        Args:
+          name (str): the event name.
+          category (str): the event category.
+          args (Dict[str, Any]): extra information for the event.
+
+        Returns:
+          Span: the span.
+        """
+        return Span(self, name, category, args)
+
+    def add_event(self, name, category, start_time, end_time, args):
+        """Add a complete event for the current thread.
+
+        Args:
+          name (str): the event name.
+          category (str): the event category.
+          start_time (float): the start, in seconds since the epoch.
+          end_time (float): the end, in seconds since the epoch.
+          args (Dict[str, Any]): extra information for the event.
+        """
+        thread = threading.current_thread()
+        event = {
+            'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid,
+            'tid': thread.ident, 'args': args,
+            # microseconds
+            'ts': start_time * 1000000,
+            'dur': (end_time - start_time) * 1000000,
+        }
+        with self.lock:
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+    def trace_events(self):
+        """Get the events, with process and thread name metadata.
+
+        Returns:
+          List[Dict[str, Any]]: the trace events, sorted by start time.
+        """
+        with self.lock:
+            events = sorted(self.events, key=lambda x: (x['ts'], -x['dur']))
+            thread_names = dict(self.thread_names)
+        metadata = [{
+            'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+            'args': {'name': 'scriptharness'},
+        }]
+        for thread_id, thread_name in sorted(thread_names.items()):
+            metadata.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                'tid': thread_id, 'args': {'name': thread_name},
+            })
+        return metadata + events
+
+    def write(self, path):
+        """Write the trace as Chrome trace-event json.
+
+        Args:
+          path (str): the path to write to.
+        """
+        make_parent_dir(path)
+        with open(path, 'w') as filehandle:
+            json.dump({
+                'traceEvents': self.trace_events(),
+                'displayTimeUnit': 'ms',
+            }, filehandle, default=str)
+
+
+# API functions {{{1
+def span(name, category="scriptharness", **kwargs):
+    """Trace a block of code, if tracing is on.
+
+    Usage::
+
+      with span("upload", category="action", url=url):
+          ...
+
+    Args:
+      name (str): the event name.
+      category (Optional[str]): the event category.
+      **kwargs: extra information for the event.
+
+    Returns:
+      Span or NullSpan: a context manager.
+    """
+    tracer = TRACER
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, category, kwargs)
+
+
+def tracing_enabled():
+    """Is tracing on?
+
+    Returns:
+      bool: True if there's a running Tracer.
+    """
+    return TRACER is not None
+
+
+def start_tracing():
+    """Start tracing, if it isn't already on.
+
+    Returns:
+      Tracer: the running tracer.
+    """
+    global TRACER  # pylint: disable=global-statement
+    if TRACER is None:
+        TRACER = Tracer()
+    return TRACER
+
+
+def stop_tracing(path=None):
+    """Stop tracing, and optionally write the trace.
+
+    Args:
+      path (Optional[str]): the path to write the trace to.
+
+    Returns:
+      Tracer: the stopped tracer, or None if tracing was off.
+    """
+    global TRACER  # pylint: disable=global-statement
+    tracer, TRACER = TRACER, None
+    if tracer is not None and path is not None:
+        tracer.write(path)
+    return tracer
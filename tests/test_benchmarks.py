@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks for scriptharness.
+
+These print their timings, so run them with ``nosetests -s`` (or
+``pytest -s``) to see the numbers.  They only assert on correctness, since
+timings vary wildly between machines.
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import os
+import scriptharness.commands as commands
+import scriptharness.process as process
+import sys
+import time
+import unittest
+from . import LoggerReplacement
+
+NUM_SPAWNS = 10
+NUM_LINES = 20000
+NUM_SHORT_COMMANDS = 100
+# A command that does next to nothing, so spawning is all there is to time.
+if os.name == 'nt':  # pragma: no cover
+    SHORT_COMMAND = [sys.executable, "-c", "pass"]
+else:
+    SHORT_COMMAND = ["true"]
+
+
+# Helper functions {{{1
+def time_command(command, runner, repeat=1,
+                 spawn_backend=process.SPAWN_POPEN):
+    """Run a Command `repeat` times with `runner` and `spawn_backend`.
+
+    Returns:
+      Tuple[float, Command]: the average wall time per run, and the last
+        Command run.
+    """
+    start = time.time()
+    for _ in range(repeat):
+        cmd = commands.Command(command, logger=LoggerReplacement(),
+                               runner=runner, spawn_backend=spawn_backend)
+        cmd.run()
+    return (time.time() - start) / repeat, cmd
+
+
+# TestCommandBenchmarks {{{1
+class TestCommandBenchmarks(unittest.TestCase):
+    """Compare the Command runners.
+    """
+    def test_spawn_latency(self):
+        """test_benchmarks | Command spawn latency per runner
+        """
+        for runner in commands.RUNNERS:
+            elapsed, cmd = time_command([sys.executable, "-c", "pass"],
+                                        runner, repeat=NUM_SPAWNS)
+            print("%s: %.2f ms per command" % (runner, elapsed * 1000))
+            self.assertEqual(cmd.history['return_value'], 0)
+
+    def test_per_line_overhead(self):
+        """test_benchmarks | Command per-line overhead per runner
+        """
+        command = [
+            sys.executable, "-c",
+            "from __future__ import print_function\n"
+            "for i in range(%d):\n"
+            "    print('line %%d' %% i)\n" % NUM_LINES
+        ]
+        for runner in commands.RUNNERS:
+            empty, _ = time_command([sys.executable, "-c", "pass"], runner)
+            elapsed, cmd = time_command(command, runner)
+            print("%s: %.2f us per line" %
+                  (runner, (elapsed - empty) * 1000000 / NUM_LINES))
+            self.assertEqual(len(cmd.logger.all_messages), NUM_LINES + 2)
+
+    def test_commands_per_second(self):
+        """test_benchmarks | Short commands per second per runner
+        """
+        for runner in commands.RUNNERS:
+            # Warm up, e.g. start a pool worker.
+            time_command(SHORT_COMMAND, runner)
+            elapsed, cmd = time_command(SHORT_COMMAND, runner,
+                                        repeat=NUM_SHORT_COMMANDS)
+            print("%s: %.1f commands per second" % (runner, 1 / elapsed))
+            self.assertEqual(cmd.history['return_value'], 0)
+
+    def test_spawn_backends(self):
+        """test_benchmarks | Command spawn_time per spawn backend
+        """
+        for backend in process.SPAWN_BACKENDS:
+            for runner in (commands.RUNNER_PIPE,
+                           commands.RUNNER_MULTIPROCESSING):
+                spawn_time = 0
+                for _ in range(NUM_SPAWNS):
+                    _, cmd = time_command(SHORT_COMMAND, runner,
+                                          spawn_backend=backend)
+                    spawn_time += cmd.history['spawn_time']
+                print("%s %s: %.2f ms to spawn" %
+                      (backend, runner, spawn_time * 1000 / NUM_SPAWNS))
+                self.assertEqual(cmd.history['return_value'], 0)
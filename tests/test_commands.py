@@ -9,17 +9,21 @@ import logging
 import mock
 import os
 import pprint
+import psutil
 import scriptharness.commands as commands
 from scriptharness.errorlists import ErrorList
 from scriptharness.exceptions import ScriptHarnessError, \
     ScriptHarnessException, ScriptHarnessFatal, ScriptHarnessTimeout
 import scriptharness.log as log
+from scriptharness.pool import WorkerPool
+import scriptharness.process as process
 import scriptharness.status as status
 from scriptharness.unicode import to_unicode
 import shutil
 import six
 import subprocess
 import sys
+import threading
 import time
 import unittest
 from . import LoggerReplacement
@@ -80,6 +84,14 @@ def get_timeout_cmdlns():
     ]
     return cmdlns
 
+def pid_is_running(pid):
+    """Is the process running, rather than gone or a zombie?
+    """
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
 
 # TestFunctions {{{1
 class TestFunctions(unittest.TestCase):
@@ -256,6 +268,212 @@ class TestCommand(unittest.TestCase):
         )
         self.assertRaises(ScriptHarnessError, command.run)
 
+    def test_listeners(self):
+        """test_commands | Command pre_command and post_command listeners
+        """
+        seen = []
+
+        def listener(cmd):
+            """record the phase"""
+            seen.append((cmd.history.get('start_time') is not None,
+                         cmd.history.get('status')))
+
+        self.assertRaises(ScriptHarnessException, commands.add_listener,
+                          listener, "bad_phase")
+        for phase in commands.LISTENER_PHASES:
+            commands.add_listener(listener, phase)
+        try:
+            get_command().run()
+            command = get_command(
+                command=[sys.executable, "-c", 'import sys; sys.exit(1)']
+            )
+            self.assertRaises(ScriptHarnessError, command.run)
+        finally:
+            for phase in commands.LISTENER_PHASES:
+                commands.remove_listener(listener, phase)
+        self.assertEqual(seen, [
+            (True, None), (True, status.SUCCESS),
+            (True, None), (True, status.ERROR),
+        ])
+        self.assertTrue(
+            command.history['end_time'] >= command.history['start_time']
+        )
+
+    def test_add_line_subclass(self):
+        """test_commands | Command subclass overriding add_line() only
+        """
+        lines = []
+        class LineCommand(commands.Command):
+            """Only override add_line()"""
+            def add_line(self, line):
+                lines.append(to_unicode(line).rstrip())
+        for runner in commands.RUNNERS:
+            del lines[:]
+            command = LineCommand(
+                [sys.executable, "-c",
+                 "from __future__ import print_function;"
+                 "print('a');print('b');print('c', end='')"],
+                logger=LoggerReplacement(), runner=runner
+            )
+            command.run()
+            self.assertEqual(lines, ["a", "b", "c"])
+
+    def test_parsed_add_line_subclass(self):
+        """test_commands | ParsedCommand subclass overriding add_line() only
+        """
+        lines = []
+        class LineCommand(commands.ParsedCommand):
+            """Only override add_line()"""
+            def add_line(self, line):
+                lines.append(to_unicode(line).rstrip())
+        for runner in commands.RUNNERS:
+            del lines[:]
+            command = LineCommand(
+                [sys.executable, "-c",
+                 "from __future__ import print_function;"
+                 "print('a');print('b')"],
+                error_list=ErrorList([]), logger=LoggerReplacement(),
+                runner=runner
+            )
+            command.run()
+            self.assertEqual(lines, ["a", "b"])
+
+    def test_bad_runner(self):
+        """test_commands | Command bad runner
+        """
+        self.assertRaises(ScriptHarnessException, get_command,
+                          runner="this_runner_should_not_exist")
+
+    def test_pipe_command(self):
+        """test_commands | Command.run() with RUNNER_PIPE
+        """
+        command = get_command(runner=commands.RUNNER_PIPE)
+        command.run()
+        self.assertEqual(command.logger.all_messages[-1][2][0], "hello")
+        self.assertEqual(command.history['return_value'], 0)
+
+    def test_pipe_timeouts(self):
+        """test_commands | Command RUNNER_PIPE output_timeout and timeout
+        """
+        for kwargs in ({'output_timeout': .5}, {'timeout': .5}):
+            for cmdln in get_timeout_cmdlns():
+                now = time.time()
+                command = get_command(command=cmdln,
+                                      runner=commands.RUNNER_PIPE, **kwargs)
+                self.assertRaises(ScriptHarnessTimeout, command.run)
+                self.assertTrue(now + 1 > time.time())
+
+    def test_pipe_errors(self):
+        """test_commands | Command RUNNER_PIPE error and nonexistent command
+        """
+        command = get_command(
+            command=[sys.executable, "-c", 'import sys; sys.exit(1)'],
+            runner=commands.RUNNER_PIPE
+        )
+        self.assertRaises(ScriptHarnessError, command.run)
+        command = get_command(command=["this_command_should_not_exist"],
+                              runner=commands.RUNNER_PIPE)
+        self.assertRaises(ScriptHarnessError, command.run)
+
+    def test_pool_command(self):
+        """test_commands | Command.run() with RUNNER_POOL
+        """
+        pool = WorkerPool(size=1)
+        try:
+            for _ in range(2):
+                command = get_command(runner=commands.RUNNER_POOL, pool=pool)
+                command.run()
+                self.assertEqual(command.logger.all_messages[-1][2][0],
+                                 "hello")
+                self.assertEqual(command.history['return_value'], 0)
+            self.assertEqual(pool.num_started, 1)
+        finally:
+            pool.close()
+
+    def test_pool_cwd_env(self):
+        """test_commands | RUNNER_POOL follows the harness cwd and env
+        """
+        pool = WorkerPool(size=1)
+        cwd = os.getcwd()
+        cmdln = [sys.executable, "-c",
+                 "import os; print(os.getcwd()); "
+                 "print(os.environ.get('SCRIPTHARNESS_POOL_TEST', ''))"]
+        try:
+            for path, value in ((cwd, None), (os.path.dirname(cwd), "new")):
+                os.chdir(path)
+                if value is not None:
+                    os.environ['SCRIPTHARNESS_POOL_TEST'] = value
+                command = get_command(command=cmdln, pool=pool,
+                                      runner=commands.RUNNER_POOL)
+                command.run()
+                messages = [args[0] for _, _, args in
+                            command.logger.all_messages[-2:]]
+                self.assertEqual(messages, [path, value or ""])
+            self.assertEqual(pool.num_started, 1)
+        finally:
+            os.chdir(cwd)
+            os.environ.pop('SCRIPTHARNESS_POOL_TEST', None)
+            pool.close()
+
+    def test_pool_timeouts(self):
+        """test_commands | Command RUNNER_POOL output_timeout and timeout
+        """
+        pool = WorkerPool(size=1)
+        try:
+            for kwargs in ({'output_timeout': .5}, {'timeout': .5}):
+                for cmdln in get_timeout_cmdlns():
+                    now = time.time()
+                    command = get_command(command=cmdln, pool=pool,
+                                          runner=commands.RUNNER_POOL,
+                                          **kwargs)
+                    self.assertRaises(ScriptHarnessTimeout, command.run)
+                    self.assertTrue(now + 1 > time.time())
+                    self.assertFalse(pid_is_running(command.history['pid']))
+            # The timed out workers were killed, not reused.
+            self.assertEqual(pool.num_workers, 0)
+        finally:
+            pool.close()
+
+    def test_pool_errors(self):
+        """test_commands | Command RUNNER_POOL error and nonexistent command
+        """
+        pool = WorkerPool(size=1)
+        try:
+            command = get_command(
+                command=[sys.executable, "-c", 'import sys; sys.exit(1)'],
+                runner=commands.RUNNER_POOL, pool=pool
+            )
+            self.assertRaises(ScriptHarnessError, command.run)
+            command = get_command(command=["this_command_should_not_exist"],
+                                  runner=commands.RUNNER_POOL, pool=pool)
+            self.assertRaises(ScriptHarnessError, command.run)
+        finally:
+            pool.close()
+
+    @unittest.skipUnless(hasattr(os, 'posix_spawn'), "needs os.posix_spawn")
+    def test_posix_spawn(self):
+        """test_commands | Command SPAWN_POSIX with each runner
+        """
+        pool = WorkerPool(size=1)
+        try:
+            for runner in commands.RUNNERS:
+                command = get_command(runner=runner, pool=pool,
+                                      spawn_backend=process.SPAWN_POSIX)
+                command.run()
+                self.assertEqual(command.logger.all_messages[-1][2][0],
+                                 "hello")
+                self.assertEqual(command.history['return_value'], 0)
+                self.assertTrue(command.history['spawn_time'] >= 0)
+                command = get_command(
+                    command=["this_command_should_not_exist"], runner=runner,
+                    pool=pool, spawn_backend=process.SPAWN_POSIX
+                )
+                self.assertRaises(ScriptHarnessError, command.run)
+        finally:
+            pool.close()
+        self.assertRaises(ScriptHarnessException, get_command,
+                          spawn_backend="this_backend_should_not_exist")
+
     @mock.patch('scriptharness.commands.os')
     def test_fix_env(self, mock_os):
         """test_commands | Command.fix_env()
@@ -369,6 +587,356 @@ class TestParsedCommand(unittest.TestCase):
         )
 
 
+# TestRunMany {{{1
+def print_command(name, num_lines=3, exit_code=0):
+    """Command line that prints a few lines and exits with exit_code
+    """
+    return [
+        sys.executable, "-c",
+        'from __future__ import print_function; import sys, time\n'
+        'for i in range(%d):\n'
+        '    print("%s %%d" %% i); sys.stdout.flush(); time.sleep(.01)\n'
+        'sys.exit(%d)' % (num_lines, name, exit_code)
+    ]
+
+
+class TestRunMany(unittest.TestCase):
+    """test commands.run_many() and parse_many()
+    """
+    def test_grouped_output(self):
+        """test_commands | run_many() groups each command's output
+        """
+        logger = LoggerReplacement(simple=True)
+        names = ["one", "two", "three", "four"]
+        cmds = commands.run_many(
+            [print_command(name) for name in names], max_workers=4,
+            logger=logger
+        )
+        self.assertEqual([cmd.command[-1] for cmd in cmds],
+                         [print_command(name)[-1] for name in names])
+        for cmd in cmds:
+            self.assertEqual(cmd.history['status'], status.SUCCESS)
+        pprint.pprint(logger.all_messages)
+        for num, name in enumerate(names):
+            prefix = "[%d/4] " % (num + 1)
+            lines = [line for line in logger.all_messages
+                     if line.startswith(prefix)]
+            start = logger.all_messages.index(lines[0])
+            # each command's lines are contiguous
+            self.assertEqual(
+                logger.all_messages[start:start + len(lines)], lines
+            )
+            self.assertEqual(
+                lines[-3:], ["%s %s %d" % (prefix, name, i) for i in range(3)]
+            )
+
+    def test_collect_all(self):
+        """test_commands | run_many() runs every command despite failures
+        """
+        logger = LoggerReplacement()
+        cmds = commands.run_many(
+            [print_command("a", exit_code=1), print_command("b"),
+             print_command("c")],
+            max_workers=1, logger=logger
+        )
+        self.assertEqual(
+            [cmd.history['status'] for cmd in cmds],
+            [status.ERROR, status.SUCCESS, status.SUCCESS]
+        )
+        self.assertEqual(
+            logger.level_messages[logging.ERROR][-1],
+            (commands.STRINGS['run_many']['failed'],
+             ({'num': 1, 'total': 3}, ))
+        )
+
+    def test_fail_fast(self):
+        """test_commands | run_many() fail_fast and halt_on_failure
+        """
+        cmds = [get_command(print_command(name, exit_code=1))
+                for name in ("a", "b", "c")]
+        self.assertRaises(
+            ScriptHarnessFatal, commands.run_many, cmds, max_workers=1,
+            fail_fast=True, halt_on_failure=True,
+            logger=LoggerReplacement()
+        )
+        self.assertEqual(cmds[0].history['status'], status.ERROR)
+        self.assertEqual(cmds[1].history, {})
+        self.assertEqual(cmds[2].history, {})
+
+    def test_exception(self):
+        """test_commands | run_many() re-raises unexpected exceptions
+        """
+        cleanup()
+        cmds = [get_command(), get_command(cwd=TEST_DIR)]
+        self.assertRaises(
+            ScriptHarnessException, commands.run_many, cmds,
+            logger=LoggerReplacement()
+        )
+        self.assertEqual(commands.run_many([]), [])
+
+    def test_parse_many(self):
+        """test_commands | parse_many() groups parser output
+        """
+        error_list = ErrorList([
+            {'substr': 'two', 'level': logging.WARNING}
+        ])
+        parsers = []
+        cmds = []
+        logger = LoggerReplacement()
+        for name in ("one", "two"):
+            parser = log.OutputParser(error_list, logger=logger)
+            parsers.append(parser)
+            cmds.append(get_parsed_command(print_command(name),
+                                           parser=parser))
+        commands.parse_many(cmds)
+        self.assertEqual(parsers[0].history['num_warnings'], 0)
+        self.assertEqual(parsers[1].history['num_warnings'], 3)
+        self.assertEqual(cmds[1].history['status'], status.SUCCESS)
+        self.assertTrue(parsers[0].logger is logger)
+        self.assertEqual(
+            logger.level_messages[logging.WARNING],
+            [("[2/2]  two %d" % i, ()) for i in range(3)]
+        )
+
+    def test_parse_many_errors(self):
+        """test_commands | parse_many() parser errors with a real Logger
+        """
+        class RaisingParser(log.OutputParser):
+            """Parser that logs an exception for error lines"""
+            def add_line(self, line):
+                text = to_unicode(line).rstrip()
+                if "two" in text and self.logger.isEnabledFor(logging.ERROR):
+                    try:
+                        raise ValueError(text)
+                    except ValueError:
+                        self.logger.exception("bad line %s", text,
+                                              extra={'bad': True})
+                super(RaisingParser, self).add_line(line)
+
+        stream = six.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(levelname)s:%(message)s'))
+        logger = logging.getLogger("scriptharness.test_parse_many_errors")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        error_list = ErrorList([
+            {'substr': 'two', 'level': logging.ERROR}
+        ])
+        cmds = []
+        for name in ("one", "two"):
+            parser = RaisingParser(error_list, logger=logger)
+            cmds.append(commands.ParsedCommand(
+                print_command(name, num_lines=1), parser=parser,
+                logger=logger
+            ))
+        try:
+            commands.parse_many(cmds, max_workers=2)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(cmds[1].parser.history['num_errors'], 1)
+        output = stream.getvalue()
+        self.assertTrue("ERROR:[2/2] bad line two 0" in output)
+        self.assertTrue("ValueError: two 0" in output)
+        self.assertTrue("ERROR:[2/2]  two 0" in output)
+
+    def test_max_records(self):
+        """test_commands | run_many() logs held records every max_records
+        """
+        logger = LoggerReplacement(simple=True)
+        records = []
+        with mock.patch('scriptharness.commands.replay_records',
+                        side_effect=lambda x, _: records.append(len(x))):
+            commands.run_many([print_command("one", num_lines=5)],
+                              max_records=3, logger=logger)
+        # the first group is logged early, the rest when the command ends
+        self.assertEqual(records[0], 3)
+        self.assertTrue(len(records) > 1)
+        self.assertTrue(max(records) <= 3)
+
+
+    def test_batched_logs(self):
+        """test_commands | ParsedCommand batched logs keep order and levels
+        """
+        stream = six.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(levelname)s:%(message)s'))
+        logger = logging.getLogger("scriptharness.test_batched_logs")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        error_list = ErrorList([
+            {'substr': 'three', 'level': logging.ERROR,
+             'pre_context_lines': 1},
+        ])
+        parser = log.OutputParser(error_list, logger=logger)
+        cmd = commands.ParsedCommand(
+            [sys.executable, "-c",
+             'from __future__ import print_function\n'
+             'for i in ("one", "two", "three", "four"):\n'
+             '    print(i)'],
+            parser=parser, logger=logger
+        )
+        cmd.batch_lines = 2
+        self.assertRaises(ScriptHarnessError, cmd.run)
+        parser.context_buffer.dump_buffer()
+        self.assertTrue(cmd.logger is logger)
+        self.assertTrue(parser.logger is logger)
+        lines = stream.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("INFO:Running command: "))
+        self.assertEqual(
+            lines[-4:],
+            ["INFO: one", "ERROR: two", "ERROR: three", "INFO: four"]
+        )
+
+
+# TestScheduler {{{1
+def acquire_in_thread(scheduler, admitted, name, **kwargs):
+    """Acquire a Scheduler ticket in a new thread, and record the admission
+    order in admitted.
+    """
+    def target():
+        """Acquire and record"""
+        ticket = scheduler.acquire(**kwargs)
+        admitted.append((name, ticket))
+    thread = threading.Thread(target=target, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def wait_for(function, timeout=10):
+    """Poll until function() is true"""
+    end_time = time.time() + timeout
+    while not function():
+        if time.time() > end_time:
+            raise AssertionError("Timed out waiting for %s" % function)
+        time.sleep(.01)
+
+
+class TestScheduler(unittest.TestCase):
+    """test commands.Scheduler
+    """
+    def test_capacity(self):
+        """test_commands | Scheduler admits commands within capacity
+        """
+        scheduler = commands.Scheduler(cores=2, memory=1000,
+                                       check_memory=False)
+        first = scheduler.acquire(cores=1, memory=400)
+        second = scheduler.acquire(cores=1, memory=400)
+        self.assertEqual(scheduler.running, 2)
+        admitted = []
+        thread = acquire_in_thread(scheduler, admitted, "third", cores=1)
+        wait_for(lambda: len(scheduler.waiting) == 1)
+        self.assertEqual(admitted, [])
+        scheduler.release(first)
+        thread.join(10)
+        self.assertEqual([name for name, _ in admitted], ["third"])
+        self.assertEqual(scheduler.reserved_cores, 2)
+        self.assertEqual(scheduler.reserved_memory, 400)
+        scheduler.release(second)
+        scheduler.release(admitted[0][1])
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.stats['admitted'], 3)
+        self.assertTrue(scheduler.stats['max_wait'] > 0)
+
+    def test_oversized(self):
+        """test_commands | Scheduler admits oversized commands when idle
+        """
+        scheduler = commands.Scheduler(cores=1, memory=100,
+                                       check_memory=False)
+        ticket = scheduler.acquire(cores=4, memory=1000)
+        self.assertEqual(scheduler.running, 1)
+        scheduler.release(ticket)
+
+    def test_memory(self):
+        """test_commands | Scheduler checks available memory
+        """
+        scheduler = commands.Scheduler(cores=4, memory=1000,
+                                       poll_interval=.01)
+        ticket = scheduler.acquire(cores=1)
+        with mock.patch('scriptharness.commands.psutil') as mock_psutil:
+            mock_psutil.virtual_memory.return_value.available = 10
+            admitted = []
+            thread = acquire_in_thread(scheduler, admitted, "big",
+                                       memory=500)
+            wait_for(lambda: mock_psutil.virtual_memory.call_count > 1)
+            self.assertEqual(admitted, [])
+            mock_psutil.virtual_memory.return_value.available = 1000
+            thread.join(10)
+        self.assertEqual(len(admitted), 1)
+        scheduler.release(ticket)
+        scheduler.release(admitted[0][1])
+
+    def test_priority(self):
+        """test_commands | Scheduler admits higher priorities first
+        """
+        scheduler = commands.Scheduler(cores=1, memory=0,
+                                       check_memory=False)
+        ticket = scheduler.acquire()
+        admitted = []
+        threads = [
+            acquire_in_thread(scheduler, admitted, "low", group="a"),
+            acquire_in_thread(scheduler, admitted, "high", priority=5,
+                              group="a"),
+        ]
+        wait_for(lambda: len(scheduler.waiting) == 2)
+        scheduler.release(ticket)
+        for num in range(len(threads)):
+            wait_for(lambda: len(admitted) > num)
+            scheduler.release(admitted[num][1])
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual([name for name, _ in admitted], ["high", "low"])
+
+    def test_fair_queuing(self):
+        """test_commands | Scheduler fair-queues between groups
+        """
+        scheduler = commands.Scheduler(cores=1, memory=0,
+                                       check_memory=False)
+        ticket = scheduler.acquire(group="x")
+        admitted = []
+        threads = []
+        for name in ("a1", "a2", "a3", "b1"):
+            threads.append(acquire_in_thread(scheduler, admitted, name,
+                                             group=name[0]))
+            wait_for(lambda: scheduler.num_tickets == len(threads) + 1)
+        scheduler.release(ticket)
+        for num in range(len(threads)):
+            wait_for(lambda: len(admitted) > num)
+            scheduler.release(admitted[num][1])
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual([name for name, _ in admitted],
+                         ["a1", "b1", "a2", "a3"])
+
+    def test_run_many(self):
+        """test_commands | run_many() with a Scheduler
+        """
+        scheduler = commands.Scheduler(cores=1, memory=0,
+                                       check_memory=False)
+        cmds = [
+            get_command(print_command(name, num_lines=1), priority=priority,
+                        cores=1)
+            for name, priority in (("a", 0), ("b", 0), ("c", 5))
+        ]
+        logger = LoggerReplacement()
+        commands.run_many(cmds, max_workers=3, scheduler=scheduler,
+                          logger=logger)
+        for cmd in cmds:
+            self.assertEqual(cmd.history['status'], status.SUCCESS)
+            self.assertTrue('queue_wait' in cmd.history)
+        times = sorted((cmd.history['start_time'], cmd.history['end_time'])
+                       for cmd in cmds)
+        for (_, end_time), (start_time, _) in zip(times, times[1:]):
+            self.assertTrue(end_time <= start_time)
+        self.assertEqual(
+            min(cmds, key=lambda x: x.history['start_time']), cmds[2]
+        )
+        self.assertEqual(scheduler.stats['admitted'], 3)
+        self.assertEqual(scheduler.running, 0)
+
+
 # Output {{{1
 class TestOutput(unittest.TestCase):
     """Test Output()
@@ -390,6 +958,21 @@ class TestOutput(unittest.TestCase):
             command.cleanup()  # This will result in cleanup() being called
                                # twice; idempotence test
 
+    @unittest.skipUnless(hasattr(os, 'posix_spawn'), "needs os.posix_spawn")
+    def test_posix_spawn_output(self):
+        """test_commands | Output with SPAWN_POSIX
+        """
+        cmd = [
+            sys.executable, "-c",
+            'import sys; sys.stdout.write("out"); sys.stderr.write("err")'
+        ]
+        with get_output(command=cmd,
+                        spawn_backend=process.SPAWN_POSIX) as command:
+            command.run()
+            self.assertEqual(command.get_output(), "out")
+            self.assertEqual(command.get_output("stderr"), "err")
+            self.assertTrue('spawn_time' in command.history)
+
     def test_output_timeout(self):
         """test_commands | Output output_timeout
         """
@@ -430,6 +1013,37 @@ class TestOutput(unittest.TestCase):
                 "hello"
             )
 
+    def test_streaming_output(self):
+        """test_commands | Output iter_lines(), iter_chunks(), mmap_output()
+        """
+        cmd = [
+            sys.executable, "-c",
+            'from __future__ import print_function\n'
+            'for i in range(1000):\n'
+            '    print("line %d" % i)'
+        ]
+        expected = ["line %d" % i for i in range(1000)]
+        with get_output(command=cmd) as command:
+            command.run()
+            self.assertEqual(list(command.iter_lines()), expected)
+            self.assertEqual(
+                list(command.iter_lines(text=False))[:2],
+                [b"line 0" + os.linesep.encode(), b"line 1" +
+                 os.linesep.encode()]
+            )
+            chunks = list(command.iter_chunks(chunk_size=1000))
+            self.assertTrue(len(chunks) > 1)
+            self.assertTrue(max([len(chunk) for chunk in chunks]) <= 1000)
+            with command.mmap_output() as mapped:
+                self.assertEqual(mapped[:], b''.join(chunks))
+                self.assertTrue(mapped.find(b"line 999") > 0)
+            with command.mmap_output(handle_name="stderr") as mapped:
+                self.assertEqual(mapped, b'')
+            self.assertRaises(
+                ScriptHarnessException, list,
+                command.iter_lines(handle_name="bad_handle")
+            )
+
     def test_nonexistent_command(self):
         """test_commands | Output nonexistent command
         """
@@ -444,7 +1058,7 @@ class TestGetOutput(unittest.TestCase):
     The ScriptHarnessFatal tests are testing get_text_output() because
     it's trickier to test the contextmanager method directly.
     """
-    @mock.patch('scriptharness.commands.subprocess')
+    @mock.patch('scriptharness.process.subprocess')
     def test_error(self, mock_subprocess):
         """test_commands | get_text_output() error
         """
@@ -459,7 +1073,7 @@ class TestGetOutput(unittest.TestCase):
             "echo", halt_on_failure=True
         )
 
-    @mock.patch('scriptharness.commands.subprocess')
+    @mock.patch('scriptharness.process.subprocess')
     def test_timeout(self, mock_subprocess):
         """test_commands | get_text_output() timeout
         """
@@ -474,7 +1088,7 @@ class TestGetOutput(unittest.TestCase):
             "echo", halt_on_failure=True
         )
 
-    @mock.patch('scriptharness.commands.subprocess')
+    @mock.patch('scriptharness.process.subprocess')
     def test_no_halt(self, mock_subprocess):
         """test_commands | get_output() halt_on_error=False
         """
@@ -492,3 +1106,41 @@ class TestGetOutput(unittest.TestCase):
         """
         output = commands.get_text_output(TEST_COMMAND)
         self.assertEqual(output, "hello")
+
+    def test_get_text_output_tail(self):
+        """test_commands | get_text_output() tail
+        """
+        cmd = [
+            sys.executable, "-c",
+            'from __future__ import print_function\n'
+            'for i in range(5):\n'
+            '    print("line %d" % i)'
+        ]
+        logger = LoggerReplacement()
+        output = commands.get_text_output(cmd, tail=2, logger=logger)
+        self.assertEqual(output, "line 3\nline 4")
+        self.assertEqual(
+            [message[1] for message in logger.all_messages[-6:]],
+            ["Got output:"] + [" line %d" % i for i in range(5)]
+        )
+
+    def test_get_text_output_newlines(self):
+        """test_commands | get_text_output() line endings
+        """
+        cmd = [
+            sys.executable, "-c",
+            'import sys\n'
+            'out = getattr(sys.stdout, "buffer", sys.stdout)\n'
+            'out.write(b"a\\r\\nb\\rc\\n\\nd \\x0ce\\n\\n  \\n")'
+        ]
+        logger = LoggerReplacement()
+        output = commands.get_text_output(cmd, logger=logger)
+        self.assertEqual(output, "a\nb\nc\n\nd \x0ce")
+        self.assertEqual(
+            [message[1] for message in logger.all_messages[-7:]],
+            ["Got output:", " a", " b", " c", " ", " d", " e"]
+        )
+        with commands.get_output(cmd) as command:
+            self.assertEqual(command.get_output(), output)
+            self.assertEqual(command.get_output(text=False),
+                             b"a\r\nb\rc\n\nd \x0ce\n\n  \n")
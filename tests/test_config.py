@@ -5,6 +5,7 @@
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
 from contextlib import contextmanager
+import hashlib
 import json
 import mock
 import os
@@ -14,6 +15,7 @@ import scriptharness.config as shconfig
 from scriptharness.exceptions import ScriptHarnessException, \
     ScriptHarnessTimeout
 from scriptharness.unicode import to_unicode
+import shutil
 import six
 import subprocess
 import sys
@@ -28,7 +30,10 @@ else:
     BUILTIN = '__builtin__'
 
 TEST_FILE = '_test_config_file'
-TEST_FILES = (TEST_FILE, 'invalid_json.json', 'test_config.json')
+TEST_FILES = (TEST_FILE, TEST_FILE + shconfig.PARTIAL_SUFFIX,
+              TEST_FILE + shconfig.PARTIAL_SUFFIX + shconfig.VALIDATOR_SUFFIX,
+              'invalid_json.json', 'test_config.json')
+TEST_CACHE_DIR = '_test_config_cache'
 
 
 # Helper functions {{{1
@@ -37,6 +42,8 @@ def cleanup():
     for path in TEST_FILES:
         if os.path.exists(path):
             os.remove(path)
+    if os.path.exists(TEST_CACHE_DIR):
+        shutil.rmtree(TEST_CACHE_DIR)
 
 @contextmanager
 def start_webserver():
@@ -193,6 +200,183 @@ class TestUrlFunctionss(unittest.TestCase):
                 "%s/test_config.json" % host, path=path
             )
 
+    def test_resume_download_url(self):
+        """test_config | download_url() resumes a partial download
+        """
+        with start_webserver() as (path, host):
+            with open(os.path.join(path, "test_config.json"), 'rb') as fh:
+                orig_contents = fh.read()
+            with open(TEST_FILE + shconfig.PARTIAL_SUFFIX, 'wb') as fh:
+                fh.write(orig_contents[:10])
+            checksum = "sha256:%s" % hashlib.sha256(orig_contents).hexdigest()
+            shconfig.download_url("%s/test_config.json" % host,
+                                  path=TEST_FILE, chunk_size=7,
+                                  checksum=checksum)
+        with open(TEST_FILE, 'rb') as filehandle:
+            contents = filehandle.read()
+        self.assertEqual(contents, orig_contents)
+        self.assertFalse(os.path.exists(TEST_FILE + shconfig.PARTIAL_SUFFIX))
+
+    def test_range_download_url(self):
+        """test_config | download_url() Range requests, 206 and 416
+        """
+        class Response(object):
+            """Test response class"""
+            def __init__(self, status_code, contents=b'', headers=None):
+                self.status_code = status_code
+                self.contents = contents
+                self.headers = headers or {}
+
+            def iter_content(self, chunk_size):
+                """Yield the contents"""
+                assert chunk_size
+                yield self.contents
+
+            def raise_for_status(self):
+                """Noop"""
+                assert self
+
+            def close(self):
+                """Noop"""
+                assert self
+
+        class Session(object):
+            """Test session class"""
+            def __init__(self, responses):
+                self.responses = responses
+                self.headers = []
+
+            def get(self, url, **kwargs):
+                """Return the next response"""
+                assert url
+                self.headers.append(kwargs.get('headers'))
+                return self.responses.pop(0)
+
+        part_path = TEST_FILE + shconfig.PARTIAL_SUFFIX
+        validator_path = part_path + shconfig.VALIDATOR_SUFFIX
+        url = "http://example.com/%s" % TEST_FILE
+        with open(part_path, 'wb') as filehandle:
+            filehandle.write(b'abc')
+        session = Session([Response(206, b'def')])
+        shconfig.download_url(
+            url, path=TEST_FILE, session=session,
+            checksum="sha1:%s" % hashlib.sha1(b'abcdef').hexdigest()
+        )
+        self.assertEqual(session.headers, [{'Range': 'bytes=3-'}])
+        with open(TEST_FILE, 'rb') as filehandle:
+            self.assertEqual(filehandle.read(), b'abcdef')
+        with open(part_path, 'wb') as filehandle:
+            filehandle.write(b'abcdefg')
+        with open(validator_path, 'w') as filehandle:
+            filehandle.write('"v1"')
+        session = Session([Response(416), Response(200, b'xyz')])
+        shconfig.download_url(url, path=TEST_FILE, session=session)
+        self.assertEqual(session.headers, [
+            {'Range': 'bytes=7-', 'If-Range': '"v1"'}, None
+        ])
+        with open(TEST_FILE, 'rb') as filehandle:
+            self.assertEqual(filehandle.read(), b'xyz')
+        self.assertFalse(os.path.exists(validator_path))
+
+    def test_if_range_download_url(self):
+        """test_config | download_url() only resumes unchanged files
+        """
+        class Response(object):
+            """Test response class"""
+            def __init__(self, status_code, contents, headers):
+                self.status_code = status_code
+                self.contents = contents
+                self.headers = headers
+
+            def iter_content(self, chunk_size):
+                """Yield the contents, then fail if they end with '!'"""
+                assert chunk_size
+                yield self.contents.rstrip(b'!')
+                if self.contents.endswith(b'!'):
+                    raise IOError("interrupted")
+
+            def raise_for_status(self):
+                """Noop"""
+                assert self
+
+            def close(self):
+                """Noop"""
+                assert self
+
+        class Session(object):
+            """Test session class"""
+            def __init__(self, responses):
+                self.responses = responses
+                self.headers = []
+
+            def get(self, url, **kwargs):
+                """Return the next response"""
+                assert url
+                self.headers.append(kwargs.get('headers'))
+                return self.responses.pop(0)
+
+        part_path = TEST_FILE + shconfig.PARTIAL_SUFFIX
+        validator_path = part_path + shconfig.VALIDATOR_SUFFIX
+        url = "http://example.com/%s" % TEST_FILE
+        # An interrupted download keeps its validator.
+        session = Session([Response(200, b'abc!', {'ETag': '"v1"'})])
+        self.assertRaises(ScriptHarnessException, shconfig.download_url,
+                          url, path=TEST_FILE, session=session)
+        with open(validator_path) as filehandle:
+            self.assertEqual(filehandle.read(), '"v1"')
+        # The file changed, so the server sends it all.
+        session = Session([
+            Response(200, b'uvwxyz', {'Last-Modified': 'Tue, 1 Jan 2030'})
+        ])
+        shconfig.download_url(url, path=TEST_FILE, session=session)
+        self.assertEqual(session.headers,
+                         [{'Range': 'bytes=3-', 'If-Range': '"v1"'}])
+        with open(TEST_FILE, 'rb') as filehandle:
+            self.assertEqual(filehandle.read(), b'uvwxyz')
+        # No validator or checksum: don't resume.
+        with open(part_path, 'wb') as filehandle:
+            filehandle.write(b'abc')
+        session = Session([Response(200, b'xyz', {'ETag': 'W/"weak"'})])
+        shconfig.download_url(url, path=TEST_FILE, session=session)
+        self.assertEqual(session.headers, [{}])
+        with open(TEST_FILE, 'rb') as filehandle:
+            self.assertEqual(filehandle.read(), b'xyz')
+        self.assertFalse(os.path.exists(validator_path))
+
+    def test_checksum_download_url(self):
+        """test_config | download_url() checksum mismatch
+        """
+        with start_webserver() as (_, host):
+            url = "%s/test_config.json" % host
+            self.assertRaises(
+                ScriptHarnessException, shconfig.download_url, url,
+                path=TEST_FILE, checksum="md5:%s" % ("0" * 32)
+            )
+            self.assertRaises(
+                ScriptHarnessException, shconfig.download_url, url,
+                path=TEST_FILE, checksum="nonexistent_algorithm:00"
+            )
+            self.assertRaises(
+                ScriptHarnessException, shconfig.download_url, url,
+                path=TEST_FILE, checksum="no_colon"
+            )
+        self.assertFalse(os.path.exists(TEST_FILE))
+        self.assertFalse(os.path.exists(TEST_FILE + shconfig.PARTIAL_SUFFIX))
+
+    def test_get_session(self):
+        """test_config | get_session() shares a session per host
+        """
+        session = shconfig.get_session("http://example.com/foo")
+        self.assertTrue(
+            session is shconfig.get_session("http://example.com/bar")
+        )
+        self.assertFalse(
+            session is shconfig.get_session("https://example.com/foo")
+        )
+        self.assertFalse(
+            session is shconfig.get_session("http://example.com:8080/foo")
+        )
+
     def test_parse_config_file(self):
         """test_config | parse json
         """
@@ -222,6 +406,86 @@ class TestUrlFunctionss(unittest.TestCase):
             "%s/nonexistent_file" % __file__
         )
 
+    def test_parse_config_files(self):
+        """test_config | parse_config_files() keeps the order and errors
+        """
+        path = os.path.join(os.path.dirname(__file__), 'http',
+                            'test_config.json')
+        bad_path = "%s/nonexistent_file" % __file__
+        with start_webserver() as (_, host):
+            results = shconfig.parse_config_files([
+                path, bad_path, "%s/test_config.json" % host,
+            ], max_workers=3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0]["key1"], "value1")
+        self.assertEqual(results[1][0], None)
+        self.assertTrue(
+            issubclass(results[1][1][0], ScriptHarnessException)
+        )
+        self.assertEqual(results[2], (results[0][0], None))
+        self.assertFalse(os.path.exists("test_config.json"))
+
+    def test_cached_download(self):
+        """test_config | download_cached_url() revalidates the cache
+        """
+        with start_webserver() as (_, host):
+            url = "%s/test_config.json" % host
+            path = shconfig.download_cached_url(url, TEST_CACHE_DIR)
+            self.assertEqual(path, shconfig.get_cache_path(url,
+                                                           TEST_CACHE_DIR))
+            with open("%s.headers.json" % path) as filehandle:
+                self.assertTrue(json.load(filehandle)['last-modified'])
+            # The server says it's unchanged, so the cached copy is used.
+            with open(path, 'w') as filehandle:
+                json.dump({"cached": True}, filehandle)
+            config = shconfig.parse_config_file(url, cache_dir=TEST_CACHE_DIR)
+            self.assertEqual(config, {"cached": True})
+            # Without the headers, it's downloaded again.
+            os.remove("%s.headers.json" % path)
+            config = shconfig.parse_config_file(url, cache_dir=TEST_CACHE_DIR)
+            self.assertEqual(config["key1"], "value1")
+            self.assertRaises(
+                ScriptHarnessException, shconfig.download_cached_url,
+                "%s/nonexistent_file" % host, TEST_CACHE_DIR
+            )
+
+
+    def test_cached_download_cleanup(self):
+        """test_config | download_cached_url() closes responses, removes temps
+        """
+        url = "http://example.com/test_config.json"
+        path = shconfig.get_cache_path(url, TEST_CACHE_DIR)
+
+        def broken_content(**kwargs):
+            """Fail partway through the download"""
+            assert kwargs
+            yield b'{"partial'
+            raise IOError("disk full")
+
+        session = mock.MagicMock()
+        response = session.get.return_value
+        response.status_code = 200
+        response.iter_content.side_effect = broken_content
+        self.assertRaises(
+            ScriptHarnessException, shconfig.download_cached_url, url,
+            TEST_CACHE_DIR, session=session
+        )
+        self.assertEqual(response.close.call_count, 1)
+        self.assertEqual(os.listdir(TEST_CACHE_DIR), [])
+        # a 304 for a cached file
+        with open(path, 'w') as filehandle:
+            json.dump({"cached": True}, filehandle)
+        with open("%s.headers.json" % path, 'w') as filehandle:
+            json.dump({'etag': '"abc"'}, filehandle)
+        response.reset_mock()
+        response.status_code = 304
+        self.assertEqual(
+            shconfig.download_cached_url(url, TEST_CACHE_DIR,
+                                         session=session),
+            path
+        )
+        self.assertEqual(response.close.call_count, 1)
+
 
 # TestTemplateFunctions {{{1
 class TestTemplateFunctions(unittest.TestCase):
@@ -359,6 +623,29 @@ class TestTemplateFunctions(unittest.TestCase):
         initial_config.update(contents)
         self.helper_build_config(cmdln_args, initial_config=initial_config)
 
+    def test_build_config_urls(self):
+        """test_config | build_config() with cached urls
+        """
+        template = shconfig.get_config_template(all_actions=TEST_ACTIONS)
+        with start_webserver() as (_, host):
+            cmdln_args = ["-c", "%s/test_config.json" % host,
+                          "--opt-cfg", "%s/nonexistent_file" % host,
+                          "--opt-cfg", "%s/test_config.json" % host,
+                          "--config-cache-dir", TEST_CACHE_DIR]
+            parsed_args = shconfig.parse_args(template, cmdln_args=cmdln_args)
+            try:
+                config = shconfig.build_config(template, parsed_args,
+                                               {"key1": "initial"})
+            finally:
+                cleanup()
+        self.assertEqual(config["key1"], "value1")
+        self.assertFalse("scriptharness_volatile_config_cache_dir" in config)
+        parsed_args = shconfig.parse_args(template, cmdln_args=[
+            "-c", "%s/nonexistent_file" % __file__
+        ])
+        self.assertRaises(ScriptHarnessException, shconfig.build_config,
+                          template, parsed_args)
+
     def test_misc(self):
         """test_config | get_config_template misc
         """
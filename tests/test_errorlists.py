@@ -11,6 +11,7 @@ Attributes:
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
 import re
+import scriptharness.errorlists as errorlists
 from scriptharness.errorlists import ErrorList
 from scriptharness.exceptions import ScriptHarnessException
 import unittest
@@ -84,4 +85,83 @@ class TestErrorList(unittest.TestCase):
                 ScriptHarnessException, ErrorList, error_list
             )
 
+    def test_match_order(self):
+        """test_log | ErrorList.match() first match wins
+        """
+        error_list = ErrorList([
+            {'level': 10, 'regex': re.compile(r'ba[rz]$')},
+            {'level': 20, 'substr': 'foo'},
+            {'level': 30, 'regex': re.compile(r'o+ b')},
+        ])
+        # 'foo' is the leftmost match, but the regex is first in the list
+        self.assertEqual(error_list.match("foo bar")['level'], 10)
+        self.assertEqual(error_list.match("foo baq")['level'], 20)
+        self.assertEqual(error_list.match("boo baq")['level'], 30)
+        self.assertEqual(error_list.match("baq"), None)
+
+    def test_match_uncombined(self):
+        """test_log | ErrorList.match() with regexes that can't be combined
+        """
+        error_list = ErrorList([
+            {'level': 10, 'regex': re.compile(r'(x)\1')},
+            {'level': 20, 'regex': re.compile(r'stop', re.I)},
+            {'level': 30, 'regex': re.compile(r'(?i)warn')},
+            {'level': 40, 'substr': 'STOP'},
+        ])
+        combined, uncombined = error_list.compile()
+        self.assertEqual(uncombined, [0, 1, 2])
+        self.assertTrue(combined is not None)
+        self.assertEqual(error_list.match("axxb")['level'], 10)
+        self.assertEqual(error_list.match("STOP")['level'], 20)
+        self.assertEqual(error_list.match("WaRn")['level'], 30)
+        self.assertEqual(error_list.match("xyz"), None)
 
+    def test_match_bad_combination(self):
+        """test_log | ErrorList.match() when the combined regex won't compile
+        """
+        error_list = ErrorList([
+            {'level': 10, 'regex': re.compile(r'(?P<name>foo)')},
+            {'level': 20, 'regex': re.compile(r'(?P<name>bar)')},
+        ])
+        combined, uncombined = error_list.compile()
+        self.assertEqual(combined, None)
+        self.assertEqual(uncombined, [0, 1])
+        self.assertEqual(error_list.match("bar")['level'], 20)
+        self.assertEqual(error_list.match("baz"), None)
+
+    def test_match_after_modification(self):
+        """test_log | ErrorList.match() sees checks added after matching
+        """
+        error_list = ErrorList([{'level': 10, 'substr': 'foo'}])
+        self.assertEqual(error_list.match("bar"), None)
+        error_list.append({'level': 20, 'substr': 'bar',
+                           'pre_context_lines': 2})
+        self.assertEqual(error_list.match("bar")['level'], 20)
+        self.assertEqual(error_list.pre_context_lines, 2)
+        error_list.extend([{'level': 30, 'regex': re.compile(r'ba[zq]')}])
+        self.assertEqual(error_list.match("baq")['level'], 30)
+        error_list[0] = {'level': 40, 'substr': 'qux'}
+        self.assertEqual(error_list.match("qux")['level'], 40)
+        self.assertEqual(error_list.match("foo"), None)
+        del error_list[1]
+        self.assertEqual(error_list.match("bar"), None)
+        self.assertEqual(error_list.match("baz")['level'], 30)
+        self.assertEqual(error_list.pre_context_lines, 0)
+        self.assertRaises(ScriptHarnessException, error_list.append,
+                          {'level': 50})
+
+    def test_predefined(self):
+        """test_log | predefined ErrorLists are built once, on first access
+        """
+        for name in errorlists.ERROR_LIST_FACTORIES:
+            error_list = getattr(errorlists, name)
+            self.assertTrue(isinstance(error_list, ErrorList))
+            self.assertTrue(getattr(errorlists, name) is error_list)
+            self.assertTrue(name in dir(errorlists))
+        self.assertEqual(
+            errorlists.VIRTUALENV_ERROR_LIST[-len(
+                errorlists.PYTHON_ERROR_LIST):],
+            errorlists.PYTHON_ERROR_LIST
+        )
+        self.assertRaises(AttributeError, getattr, errorlists,
+                          "NONEXISTENT_ERROR_LIST")
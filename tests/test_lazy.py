@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test scriptharness/lazy.py, and the import time of scriptharness.
+
+Attributes:
+  HEAVY_MODULES (Tuple[str]): modules that importing scriptharness and
+    scriptharness.commands shouldn't import.
+  IMPORT_BUDGET (float): the maximum time, in seconds, that importing
+    scriptharness and scriptharness.commands may take.  This can be
+    overridden with the SCRIPTHARNESS_IMPORT_BUDGET environment variable
+    on slow machines.
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import json
+import mock
+import os
+import re
+from scriptharness.lazy import LazyModule
+import subprocess
+import sys
+import unittest
+
+HEAVY_MODULES = ("requests", "psutil", "multiprocessing", "pprint")
+IMPORT_BUDGET = float(os.environ.get("SCRIPTHARNESS_IMPORT_BUDGET", .1))
+
+
+# Helper functions {{{1
+def run_python(*args):
+    """Run python from the repo root and return its stdout and stderr"""
+    proc = subprocess.Popen(
+        [sys.executable] + list(args),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = proc.communicate()
+    return stdout.decode('utf-8'), stderr.decode('utf-8')
+
+
+# TestLazyModule {{{1
+class TestLazyModule(unittest.TestCase):
+    """Test LazyModule
+    """
+    def test_lazy_load(self):
+        """test_lazy | LazyModule imports on first attribute access
+        """
+        lazy = LazyModule("json")
+        self.assertEqual(lazy.lazy_module, None)
+        self.assertTrue("json" in repr(lazy))
+        self.assertFalse("loaded" in repr(lazy))
+        self.assertEqual(lazy.dumps([1]), "[1]")
+        self.assertTrue(lazy.lazy_module is json)
+        self.assertTrue("loaded" in repr(lazy))
+
+    def test_missing(self):
+        """test_lazy | LazyModule with a nonexistent module or attribute
+        """
+        self.assertRaises(AttributeError, getattr, LazyModule("json"),
+                          "nonexistent_attribute")
+        self.assertRaises(ImportError, getattr,
+                          LazyModule("nonexistent_module_name"), "foo")
+
+    def test_mock(self):
+        """test_lazy | LazyModules can be mock.patch()ed
+        """
+        import scriptharness.process as shprocess
+        with mock.patch('scriptharness.process.psutil') as mock_psutil:
+            shprocess.kill_proc_tree(12345)
+            mock_psutil.Process.assert_called_once_with(12345)
+        self.assertTrue(isinstance(shprocess.psutil, LazyModule))
+
+
+# TestImportTime {{{1
+class TestImportTime(unittest.TestCase):
+    """Keep `import scriptharness` fast.
+    """
+    def test_heavy_modules(self):
+        """test_lazy | importing scriptharness doesn't import heavy modules
+        """
+        stdout, _ = run_python("-c", "; ".join([
+            "import json, sys",
+            "import scriptharness, scriptharness.commands",
+            "import scriptharness.errorlists as errorlists",
+            "print(json.dumps([[m for m in %r if m in sys.modules], "
+            "[n for n in errorlists.ERROR_LIST_FACTORIES "
+            "if n in vars(errorlists)]]))" % (HEAVY_MODULES, ),
+        ]))
+        self.assertEqual(json.loads(stdout), [[], []])
+
+    @unittest.skipIf(sys.version_info < (3, 7), "-X importtime is py3.7+")
+    def test_import_time(self):
+        """test_lazy | import time of scriptharness is within budget
+        """
+        timings = []
+        for _ in range(3):
+            _, stderr = run_python("-X", "importtime", "-c",
+                                   "import scriptharness.commands")
+            match = re.search(r"\|\s+(\d+) \| scriptharness.commands$",
+                              stderr, re.M)
+            timings.append(int(match.group(1)) / 1000000.)
+        self.assertTrue(
+            min(timings) < IMPORT_BUDGET,
+            "import scriptharness.commands took %.3fs; the budget is %.3fs"
+            % (min(timings), IMPORT_BUDGET)
+        )
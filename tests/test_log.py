@@ -22,6 +22,10 @@ from scriptharness.exceptions import ScriptHarnessException, \
     ScriptHarnessError
 import scriptharness.log as log
 import six
+import subprocess
+import sys
+import threading
+import time
 import unittest
 from . import UNICODE_STRINGS, LOGGER_NAME, LoggerReplacement, \
               stdstar_redirected
@@ -602,6 +606,26 @@ class TestOutputBuffer(unittest.TestCase):
         self.assertEqual(logger.all_messages[4], (10, "y", ()))
         self.assertEqual(logger.all_messages[5], (0, "z", ()))
 
+    def test_overlapping_context_lines(self):
+        """test_log | OutputBuffer overlapping pre and post context lines
+        """
+        logger = LoggerReplacement()
+        buf = log.OutputBuffer(logger, 3, 2)
+        for line in ("a", "b", "c", "d"):
+            buf.add_line(0, line)
+        buf.add_line(20, "e", pre_context_lines=1, post_context_lines=2)
+        buf.add_line(10, "f", pre_context_lines=3)
+        buf.add_line(0, "g")
+        buf.add_line(0, "h")
+        self.assertEqual(len(buf.buffer), 3)
+        buf.dump_buffer()
+        self.assertEqual(
+            [(msg[0], msg[1]) for msg in logger.all_messages],
+            [(0, "a"), (0, "b"), (10, "c"), (20, "d"), (20, "e"), (20, "f"),
+             (20, "g"), (0, "h")]
+        )
+        self.assertEqual(len(buf.pre_levels), 0)
+
 
 # TestOutputParser {{{1
 class TestOutputParser(unittest.TestCase):
@@ -735,3 +759,358 @@ class TestOutputParser(unittest.TestCase):
             (logging.WARNING, " WARNING asdf", ())
         )
         self.assertEqual(len(output_parser.logger.all_messages), 2)
+
+    def test_add_lines(self):
+        """test_log | OutputParser add_lines()
+        """
+        error_list = ErrorList(
+            [{'substr': 'asdf', 'level': logging.WARNING}]
+        )
+        output_parser = self.get_output_parser(error_list)
+        output_parser.add_lines(["foo\n", "barasdfbaz\n"])
+        self.assertEqual(
+            output_parser.logger.all_messages,
+            [(logging.INFO, ' foo', ()), (logging.WARNING, ' barasdfbaz', ())]
+        )
+        self.assertEqual(output_parser.history['num_warnings'], 1)
+
+
+# TestOutputBatcher {{{1
+def get_batch_logger(name, level=logging.INFO, propagate=False):
+    """Create a logger that logs to a StringIO stream for testing.
+
+    Returns:
+      (logging.Logger, six.StringIO)
+    """
+    stream = six.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(levelname)s:%(message)s'))
+    logger = logging.getLogger(name)
+    for old_handler in logger.handlers[:]:
+        logger.removeHandler(old_handler)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    handler.setLevel(level)
+    logger.propagate = propagate
+    return logger, stream
+
+
+class TestOutputBatcher(unittest.TestCase):
+    """Test OutputBatcher.
+    """
+    def test_max_lines(self):
+        """test_log | OutputBatcher flushes every max_lines records
+        """
+        logger, stream = get_batch_logger("%s.batch1" % LOGGER_NAME)
+        batcher = log.OutputBatcher(max_lines=3, max_delay=60)
+        batch_logger = batcher.wrap(logger)
+        batch_logger.info(" %s", "one")
+        batch_logger.info(" two")
+        self.assertEqual(stream.getvalue(), "")
+        batch_logger.warning(" three")
+        batch_logger.info(" four")
+        self.assertEqual(stream.getvalue(),
+                         "INFO: one\nINFO: two\nWARNING: three\n")
+        batcher.flush()
+        self.assertEqual(stream.getvalue().splitlines()[-1], "INFO: four")
+        self.assertEqual(batcher.records, [])
+
+    def test_max_delay(self):
+        """test_log | OutputBatcher flushes after max_delay
+        """
+        logger, stream = get_batch_logger("%s.batch2" % LOGGER_NAME)
+        batcher = log.OutputBatcher(max_lines=100, max_delay=.05)
+        batcher.wrap(logger).info("foo")
+        self.assertEqual(stream.getvalue(), "")
+        for _ in range(100):
+            if stream.getvalue():
+                break
+            time.sleep(.01)
+        self.assertEqual(stream.getvalue(), "INFO:foo\n")
+        self.assertTrue(batcher.deadline is None)
+        batcher.close()
+
+    def test_one_thread(self):
+        """test_log | OutputBatcher uses one flusher thread, stopped by close
+        """
+        logger, stream = get_batch_logger("%s.batch5" % LOGGER_NAME)
+        batcher = log.OutputBatcher(max_lines=100, max_delay=.01)
+        batch_logger = batcher.wrap(logger)
+        self.assertTrue(batcher.thread is None)
+        threads = set()
+        for num in range(3):
+            batch_logger.info("%d", num)
+            threads.add(batcher.thread)
+            for _ in range(100):
+                if batcher.deadline is None:
+                    break
+                time.sleep(.01)
+        self.assertEqual(stream.getvalue(), "INFO:0\nINFO:1\nINFO:2\n")
+        self.assertEqual(len(threads), 1)
+        thread = threads.pop()
+        self.assertTrue(thread.is_alive())
+        batch_logger.info("3")
+        batcher.close()
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(batcher.thread is None)
+        self.assertEqual(stream.getvalue().splitlines()[-1], "INFO:3")
+        batch_logger.info("4")
+        self.assertEqual(stream.getvalue().splitlines()[-1], "INFO:4")
+
+    def test_record_kwargs(self):
+        """test_log | BatchLogger passes exc_info/extra and the caller on
+        """
+        logger = logging.getLogger("%s.batch6" % LOGGER_NAME)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        handler = mock.MagicMock()
+        handler.level = logging.INFO
+        logger.addHandler(handler)
+        try:
+            batcher = log.OutputBatcher()
+            batch_logger = batcher.wrap(logger)
+            batch_logger.info("foo", extra={'bar': 'baz'})
+            try:
+                raise ValueError("oops")
+            except ValueError:
+                batch_logger.exception("failed")
+            batcher.close()
+        finally:
+            logger.removeHandler(handler)
+        records = [call[0][0] for call in handler.handle.call_args_list]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0].bar, 'baz')
+        self.assertEqual(records[1].levelno, logging.ERROR)
+        self.assertEqual(records[1].exc_info[0], ValueError)
+        for record in records:
+            self.assertEqual(os.path.normcase(record.pathname),
+                             os.path.normcase(__file__.rstrip('co')))
+            self.assertEqual(record.funcName, 'test_record_kwargs')
+            self.assertNotEqual(record.lineno, 0)
+
+    def test_ordering_and_levels(self):
+        """test_log | OutputBatcher keeps order across loggers, and levels
+        """
+        parent, stream = get_batch_logger("%s.batch3" % LOGGER_NAME,
+                                          level=logging.WARNING)
+        child = logging.getLogger("%s.batch3.child" % LOGGER_NAME)
+        child.propagate = True
+        batcher = log.OutputBatcher()
+        batch_parent = batcher.wrap(parent)
+        batch_child = batcher.wrap(child)
+        batch_child.error("one")
+        batch_parent.warning("two")
+        batch_child.info("ignored")
+        batch_child.critical("three")
+        batch_parent.debug("ignored")
+        batcher.flush()
+        self.assertEqual(stream.getvalue(),
+                         "ERROR:one\nWARNING:two\nCRITICAL:three\n")
+
+    def test_non_logger(self):
+        """test_log | OutputBatcher doesn't wrap non-Loggers
+        """
+        logger = LoggerReplacement()
+        batcher = log.OutputBatcher()
+        self.assertTrue(batcher.wrap(logger) is logger)
+
+    def test_other_handlers(self):
+        """test_log | OutputBatcher sends records to non-stream handlers
+        """
+        logger = logging.getLogger("%s.batch4" % LOGGER_NAME)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        handler = mock.MagicMock()
+        handler.level = logging.INFO
+        logger.addHandler(handler)
+        try:
+            batcher = log.OutputBatcher()
+            batcher.wrap(logger).info("foo")
+            batcher.flush()
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(handler.handle.call_count, 1)
+        self.assertEqual(handler.handle.call_args[0][0].getMessage(), "foo")
+
+
+# TestAsyncHandler {{{1
+class BlockingHandler(logging.Handler):
+    """Handler that waits for an event before each record, for testing.
+    """
+    def __init__(self):
+        super(BlockingHandler, self).__init__()
+        self.event = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.event.wait()
+        self.messages.append(record.getMessage())
+
+
+class TestAsyncHandler(unittest.TestCase):
+    """Test AsyncHandler.
+    """
+    def test_emit(self):
+        """test_log | AsyncHandler writes records in order on flush
+        """
+        stream = six.StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(logging.Formatter('%(message)s'))
+        handler = log.AsyncHandler([stream_handler])
+        logger = logging.getLogger("%s.async1" % LOGGER_NAME)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            args = {'a': 1}
+            for num in range(1000):
+                logger.info("%d %s", num, args)
+            args['a'] = 2
+            handler.flush()
+            self.assertEqual(
+                stream.getvalue().splitlines(),
+                ["%d {'a': 1}" % num for num in range(1000)]
+            )
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertFalse(handler.thread.is_alive())
+
+    def test_drop(self):
+        """test_log | AsyncHandler drops records when the queue is full
+        """
+        blocking_handler = BlockingHandler()
+        handler = log.AsyncHandler([blocking_handler], max_queue=2,
+                                   block=False, batch_size=1)
+        logger = logging.getLogger("%s.async2" % LOGGER_NAME)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            logger.info("first")
+            # wait for the writer to be stuck on the first record
+            for _ in range(100):
+                if handler.queue.empty():
+                    break
+                time.sleep(.01)
+            for num in range(10):
+                logger.info("%d", num)
+            blocking_handler.event.set()
+            handler.flush()
+            self.assertEqual(
+                blocking_handler.messages,
+                ["first", "0", "AsyncHandler queue full; dropped 8 log "
+                 "records.", "1"]
+            )
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+    def test_drop_threads(self):
+        """test_log | AsyncHandler counts drops from many threads
+        """
+        blocking_handler = BlockingHandler()
+        handler = log.AsyncHandler([blocking_handler], max_queue=1,
+                                   block=False, batch_size=1)
+        logger = logging.getLogger("%s.async4" % LOGGER_NAME)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+
+        def log_lines():
+            """Log from a producer thread"""
+            for num in range(200):
+                logger.info("%d", num)
+
+        try:
+            threads = [threading.Thread(target=log_lines) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            blocking_handler.event.set()
+            handler.flush()
+            logger.info("last")
+            handler.flush()
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        written = 0
+        dropped = 0
+        for message in blocking_handler.messages:
+            match = re.match(r"AsyncHandler queue full; dropped (\d+) ",
+                             message)
+            if match:
+                dropped += int(match.group(1))
+            elif message != "last":
+                written += 1
+        self.assertEqual(written + dropped, 8 * 200)
+        self.assertTrue(dropped > 0)
+
+    def test_flush_async_handlers(self):
+        """test_log | flush_async_handlers() flushes the open AsyncHandlers
+        """
+        blocking_handler = BlockingHandler()
+        handler = log.AsyncHandler([blocking_handler])
+        logger = logging.getLogger("%s.async5" % LOGGER_NAME)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            self.assertTrue(handler in log.ASYNC_HANDLERS)
+            logger.info("queued")
+            blocking_handler.event.set()
+            log.flush_async_handlers()
+            self.assertEqual(blocking_handler.messages, ["queued"])
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertFalse(handler in log.ASYNC_HANDLERS)
+
+    def test_fatal_exit(self):
+        """test_log | AsyncHandler writes queued records on ScriptHarnessFatal
+        """
+        path = _absent_test_file()
+        script = (
+            "import logging, scriptharness.log as log\n"
+            "from scriptharness.exceptions import ScriptHarnessFatal\n"
+            "logger = log.prepare_simple_logging(%r, logger_name='x',\n"
+            "                                    async_handlers=True)\n"
+            "for num in range(5000):\n"
+            "    logger.info('line %%d', num)\n"
+            "raise ScriptHarnessFatal('fatal')\n" % path
+        )
+        try:
+            with open(os.devnull, 'w') as devnull:
+                status = subprocess.call([sys.executable, "-c", script],
+                                         stdout=devnull, stderr=devnull)
+            self.assertNotEqual(status, 0)
+            with open(path) as filehandle:
+                lines = filehandle.read().splitlines()
+            self.assertEqual(len(lines), 5000)
+            self.assertTrue(lines[-1].endswith("line 4999"))
+        finally:
+            _absent_test_file()
+
+    def test_prepare_simple_logging(self):
+        """test_log | prepare_simple_logging with async_handlers
+        """
+        path = _absent_test_file()
+        logger = log.prepare_simple_logging(
+            path, logger_name="%s.async3" % LOGGER_NAME, async_handlers=True
+        )
+        try:
+            self.assertEqual(len(logger.handlers), 1)
+            handler = logger.handlers[0]
+            self.assertTrue(isinstance(handler, log.AsyncHandler))
+            self.assertEqual(len(handler.handlers), 2)
+            logger.info(TEST_STRING)
+            handler.flush()
+            with open(path) as filehandle:
+                self.assertTrue(
+                    filehandle.read().rstrip().endswith(TEST_STRING)
+                )
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+            _absent_test_file()
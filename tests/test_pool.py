@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test scriptharness/pool.py
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import os
+from scriptharness.exceptions import ScriptHarnessError, \
+    ScriptHarnessException
+import scriptharness.pool as pool
+import signal
+from scriptharness.unicode import to_unicode
+import sys
+import threading
+import time
+import unittest
+from . import LoggerReplacement
+
+
+# Helper functions {{{1
+def run_in_worker(worker, command, **kwargs):
+    """Run a command in a PoolWorker, and return its exit code and output.
+    """
+    lines = []
+    kwargs.setdefault('shell', False)
+    worker.start_command(command, kwargs)
+    exit_code = worker.watch(
+        LoggerReplacement(), lambda line: lines.append(to_unicode(line))
+    )
+    return exit_code, "".join(lines)
+
+
+# TestMessages {{{1
+class TestMessages(unittest.TestCase):
+    """Test the pool message framing
+    """
+    def test_roundtrip(self):
+        """test_pool | write_message() and read_message()
+        """
+        read_fd, write_fd = os.pipe()
+        try:
+            messages = [('lines', [b'a\n', b'b\n']), None, "x" * 100000]
+            thread = threading.Thread(
+                target=lambda: [pool.write_message(write_fd, message)
+                                for message in messages]
+            )
+            thread.start()
+            for message in messages:
+                self.assertEqual(pool.read_message(read_fd), message)
+            thread.join()
+        finally:
+            os.close(write_fd)
+        self.assertRaises(EOFError, pool.read_message, read_fd)
+        os.close(read_fd)
+
+
+# TestPoolWorker {{{1
+class TestPoolWorker(unittest.TestCase):
+    """Test PoolWorker
+    """
+    def setUp(self):
+        self.worker = pool.PoolWorker()
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_run(self):
+        """test_pool | PoolWorker runs commands one after another
+        """
+        for num in range(3):
+            exit_code, output = run_in_worker(
+                self.worker,
+                [sys.executable, "-c",
+                 "import sys; print('hello %d'); sys.exit(%d)" % (num, num)]
+            )
+            self.assertEqual(exit_code, num)
+            self.assertEqual(output.strip(), "hello %d" % num)
+        self.assertEqual(self.worker.num_commands, 3)
+        self.assertTrue(self.worker.is_alive())
+
+    def test_stdin(self):
+        """test_pool | PoolWorker commands get /dev/null as stdin
+        """
+        exit_code, output = run_in_worker(
+            self.worker, [sys.executable, "-c",
+                          "import sys; print(repr(sys.stdin.read()))"]
+        )
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(output.strip(), repr(""))
+
+    def test_env_cwd(self):
+        """test_pool | PoolWorker passes Popen kwargs through
+        """
+        env = dict(os.environ)
+        env['SCRIPTHARNESS_POOL_TEST'] = "yes"
+        _, output = run_in_worker(
+            self.worker,
+            [sys.executable, "-c",
+             "import os; print(os.environ['SCRIPTHARNESS_POOL_TEST']); "
+             "print(os.getcwd())"],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        self.assertEqual(
+            output.split(),
+            ["yes", os.path.dirname(os.path.abspath(__file__))]
+        )
+
+    def test_errors(self):
+        """test_pool | PoolWorker bad commands and unpicklable kwargs
+        """
+        self.assertRaises(ScriptHarnessError, self.worker.start_command,
+                          ["this_command_should_not_exist"], {})
+        self.assertRaises(ScriptHarnessException, self.worker.start_command,
+                          ["true"], {'preexec_fn': lambda: None})
+        # The worker is still usable.
+        exit_code, _ = run_in_worker(self.worker,
+                                     [sys.executable, "-c", "pass"])
+        self.assertEqual(exit_code, 0)
+
+    def test_died(self):
+        """test_pool | PoolWorker dying mid-command
+        """
+        pid = self.worker.start_command(
+            [sys.executable, "-c", "import time; time.sleep(300)"],
+            {'shell': False}
+        )
+        try:
+            self.worker.process.kill()
+            self.assertRaises(ScriptHarnessError, self.worker.watch,
+                              LoggerReplacement(), lambda line: None)
+            self.assertRaises(ScriptHarnessError, self.worker.recv)
+        finally:
+            os.kill(pid, signal.SIGKILL)
+
+
+# TestWorkerPool {{{1
+class TestWorkerPool(unittest.TestCase):
+    """Test WorkerPool
+    """
+    def test_reuse(self):
+        """test_pool | WorkerPool reuses workers
+        """
+        worker_pool = pool.WorkerPool(size=2)
+        try:
+            for _ in range(3):
+                with worker_pool.worker() as worker:
+                    self.assertEqual(
+                        run_in_worker(worker, [sys.executable, "-c", "pass"]),
+                        (0, "")
+                    )
+            self.assertEqual(worker_pool.num_started, 1)
+            self.assertEqual(worker.num_commands, 3)
+        finally:
+            worker_pool.close()
+        self.assertFalse(worker.is_alive())
+        self.assertRaises(ScriptHarnessException, worker_pool.acquire)
+
+    def test_size(self):
+        """test_pool | WorkerPool waits for a worker at its size
+        """
+        worker_pool = pool.WorkerPool(size=1)
+        acquired = []
+        try:
+            worker = worker_pool.acquire()
+            thread = threading.Thread(
+                target=lambda: acquired.append(worker_pool.acquire())
+            )
+            thread.daemon = True
+            thread.start()
+            time.sleep(.1)
+            self.assertEqual(acquired, [])
+            worker_pool.release(worker)
+            thread.join(10)
+            self.assertEqual(acquired, [worker])
+            worker_pool.release(worker)
+        finally:
+            worker_pool.close()
+        self.assertRaises(ScriptHarnessException, pool.WorkerPool, size=0)
+
+    def test_exception(self):
+        """test_pool | WorkerPool kills a worker that raised
+        """
+        worker_pool = pool.WorkerPool(size=1)
+        try:
+            try:
+                with worker_pool.worker() as worker:
+                    raise ValueError("oops")
+            except ValueError:
+                pass
+            self.assertFalse(worker.is_alive())
+            self.assertEqual(worker_pool.num_workers, 0)
+            with worker_pool.worker() as new_worker:
+                self.assertFalse(new_worker is worker)
+            self.assertEqual(worker_pool.num_started, 2)
+        finally:
+            worker_pool.close()
+
+    def test_shared_pool(self):
+        """test_pool | get_pool() and close_pool()
+        """
+        shared = pool.get_pool()
+        try:
+            self.assertTrue(pool.get_pool() is shared)
+        finally:
+            pool.close_pool()
+        self.assertTrue(shared.closed)
+        self.assertTrue(pool.POOL is None)
+        pool.close_pool()
@@ -5,13 +5,19 @@
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
 import mock
+import multiprocessing
 import os
 import psutil
-from scriptharness.exceptions import ScriptHarnessError, ScriptHarnessFatal
+from scriptharness.exceptions import ScriptHarnessError, \
+    ScriptHarnessFatal, ScriptHarnessTimeout
 import scriptharness.process as shprocess
 from scriptharness.unicode import to_unicode
+import shutil
 from six.moves.queue import Queue
+import subprocess
 import sys
+import tempfile
+import time
 import unittest
 
 
@@ -76,6 +82,55 @@ class TestProcess(unittest.TestCase):
         line = queue.get(block=True, timeout=.1)
         self.assertEqual(to_unicode("foo"), to_unicode(line).rstrip())
 
+    def test_command_subprocess_batched(self):
+        """test_process | command_subprocess_batched
+        """
+        queue = Queue()
+        self.assertRaises(
+            SystemExit, shprocess.command_subprocess_batched,
+            queue,
+            [sys.executable, "-c",
+             "from __future__ import print_function;import sys;"
+             "print('foo');print('bar');sys.stdout.write('baz')"],
+        )
+        lines = []
+        while not queue.empty():
+            lines.extend(queue.get(block=False))
+        self.assertEqual([to_unicode(x) for x in lines],
+                         ["foo\n", "bar\n", "baz"])
+
+    def test_nonexistent_batched_command(self):
+        """test_process | command_subprocess_batched nonexistent command
+        """
+        queue = Queue()
+        self.assertRaises(
+            ScriptHarnessError, shprocess.command_subprocess_batched,
+            queue, ["this_command_should_not_exist"],
+        )
+
+    def test_split_lines(self):
+        """test_process | split_lines
+        """
+        self.assertEqual(shprocess.split_lines(b"a\nb\r\nc"),
+                         ([b"a\n", b"b\r\n"], b"c"))
+        self.assertEqual(shprocess.split_lines(b"d\n", partial=b"c"),
+                         ([b"cd\n"], b""))
+        self.assertEqual(shprocess.split_lines(b"e", partial=b"d"),
+                         ([], b"de"))
+
+    def test_send_output(self):
+        """test_process | send_output
+        """
+        add_line = mock.MagicMock()
+        add_lines = mock.MagicMock()
+        shprocess.send_output("a", add_line, add_lines)
+        add_line.assert_called_once_with("a")
+        shprocess.send_output(["b", "c"], add_line, add_lines)
+        add_lines.assert_called_once_with(["b", "c"])
+        shprocess.send_output(["d"], add_line)
+        add_line.assert_called_with("d")
+        self.assertEqual(add_line.call_count, 2)
+
     def test_nonexistent_command(self):
         """test_process | command_subprocess nonexistent command
         """
@@ -107,3 +162,350 @@ class TestProcess(unittest.TestCase):
             logger, queue, runner, add_line_cb
         )
         mock_psutil.Process.assert_called_once_with(os.getpid())
+
+    def test_watch_command_events_fallback(self):
+        """test_process | watch_command_events falls back to watch_command
+        """
+        queue = Queue()
+        runner = mock.MagicMock()
+        runner.is_alive.return_value = False
+        runner.exitcode = 3
+        with mock.patch('scriptharness.process.watch_command') as watch:
+            watch.return_value = runner.exitcode
+            value = shprocess.watch_command_events(
+                mock.MagicMock(), queue, runner, mock.MagicMock()
+            )
+            self.assertEqual(value, 3)
+            self.assertTrue(watch.called)
+
+
+# TestWatchCommandEvents {{{1
+def start_runner(command):
+    """Start a command_subprocess multiprocessing.Process for testing.
+    """
+    queue = multiprocessing.Queue()
+    runner = multiprocessing.Process(
+        target=shprocess.command_subprocess, args=(queue, command),
+    )
+    runner.start()
+    return queue, runner
+
+
+@unittest.skipIf(shprocess.wait_for_objects is None,
+                 "multiprocessing.connection.wait() not available")
+class TestWatchCommandEvents(unittest.TestCase):
+    """Test watch_command_events()
+    """
+    def test_output(self):
+        """test_process | watch_command_events output and exit code
+        """
+        lines = []
+        queue, runner = start_runner(
+            [sys.executable, "-c",
+             "from __future__ import print_function;import sys;"
+             "print('one');print('two');sys.exit(4)"]
+        )
+        value = shprocess.watch_command_events(
+            mock.MagicMock(), queue, runner, lines.append, output_timeout=10
+        )
+        self.assertEqual(value, 4)
+        self.assertEqual(
+            [to_unicode(x).rstrip() for x in lines], ["one", "two"]
+        )
+
+    def test_timeouts(self):
+        """test_process | watch_command_events output_timeout and max_timeout
+        """
+        for kwargs in ({'output_timeout': .5}, {'max_timeout': .5}):
+            queue, runner = start_runner(
+                [sys.executable, "-c", "import time;time.sleep(300);"]
+            )
+            now = time.time()
+            self.assertRaises(
+                ScriptHarnessTimeout, shprocess.watch_command_events,
+                mock.MagicMock(), queue, runner, mock.MagicMock(), **kwargs
+            )
+            self.assertTrue(now + 1 > time.time())
+
+    def test_idle_cpu(self):
+        """test_process | watch_command_events doesn't spin while idle
+        """
+        queue, runner = start_runner(
+            [sys.executable, "-c", "import time;time.sleep(1);"]
+        )
+        cpu_before = psutil.Process().cpu_times()
+        shprocess.watch_command_events(
+            mock.MagicMock(), queue, runner, mock.MagicMock(),
+            output_timeout=10
+        )
+        cpu_after = psutil.Process().cpu_times()
+        used = (cpu_after.user - cpu_before.user) + \
+            (cpu_after.system - cpu_before.system)
+        self.assertTrue(used < .5)
+
+
+# TestWatchOutputEvents {{{1
+def start_output_runner(command, stdout, stderr):
+    """Start a subprocess.Popen writing to stdout and stderr for testing.
+    """
+    return subprocess.Popen(command, stdout=stdout, stderr=stderr)
+
+
+class TestWatchOutputEvents(unittest.TestCase):
+    """Test watch_output_events()
+    """
+    def setUp(self):
+        """Create the output files"""
+        self.stdout = tempfile.TemporaryFile()
+        self.stderr = tempfile.TemporaryFile()
+
+    def tearDown(self):
+        """Close the output files"""
+        self.stdout.close()
+        self.stderr.close()
+
+    def test_exit(self):
+        """test_process | watch_output_events returns on exit
+        """
+        runner = start_output_runner(
+            [sys.executable, "-c", "import sys;sys.exit(3)"],
+            self.stdout, self.stderr
+        )
+        value = shprocess.watch_output_events(
+            mock.MagicMock(), runner, self.stdout, self.stderr,
+            output_timeout=10, max_timeout=10
+        )
+        self.assertEqual(value, 3)
+
+    def test_output_resets_timeout(self):
+        """test_process | watch_output_events output resets output_timeout
+        """
+        runner = start_output_runner(
+            [sys.executable, "-c",
+             "from __future__ import print_function;import sys, time\n"
+             "for i in range(6):\n"
+             "    print(i);sys.stdout.flush();time.sleep(.2)"],
+            self.stdout, self.stderr
+        )
+        value = shprocess.watch_output_events(
+            mock.MagicMock(), runner, self.stdout, self.stderr,
+            output_timeout=.6
+        )
+        self.assertEqual(value, 0)
+
+    def test_timeouts(self):
+        """test_process | watch_output_events output_timeout and max_timeout
+        """
+        for kwargs in ({'output_timeout': .5}, {'max_timeout': .5}):
+            runner = start_output_runner(
+                [sys.executable, "-c", "import time;time.sleep(300);"],
+                self.stdout, self.stderr
+            )
+            now = time.time()
+            self.assertRaises(
+                ScriptHarnessTimeout, shprocess.watch_output_events,
+                mock.MagicMock(), runner, self.stdout, self.stderr, **kwargs
+            )
+            self.assertTrue(now + 1 > time.time())
+            runner.wait()
+
+    @unittest.skipUnless(hasattr(os, 'pidfd_open'), "needs os.pidfd_open")
+    def test_high_pidfd(self):
+        """test_process | watch_output_events handles fds >= FD_SETSIZE
+        """
+        def high_pidfd(pid):
+            """Open the pidfd, then move it above FD_SETSIZE"""
+            pidfd = os.pidfd_open(pid)
+            try:
+                os.dup2(pidfd, 1100)
+            finally:
+                os.close(pidfd)
+            return 1100
+
+        runner = start_output_runner(
+            [sys.executable, "-c", "import sys;sys.exit(4)"],
+            self.stdout, self.stderr
+        )
+        try:
+            with mock.patch('scriptharness.process.open_pidfd',
+                            side_effect=high_pidfd):
+                value = shprocess.watch_output_events(
+                    mock.MagicMock(), runner, self.stdout, self.stderr,
+                    output_timeout=10, max_timeout=10
+                )
+        except OSError:
+            runner.wait()
+            raise unittest.SkipTest("can't dup2 a pidfd to fd 1100")
+        self.assertEqual(value, 4)
+
+    @mock.patch('scriptharness.process.watch_output')
+    def test_fallback(self, mock_watch):
+        """test_process | watch_output_events falls back to watch_output
+        """
+        mock_watch.return_value = 5
+        with mock.patch('os.pidfd_open', create=True,
+                        side_effect=OSError(38, "Function not implemented")):
+            runner = mock.MagicMock()
+            value = shprocess.watch_output_events(
+                mock.MagicMock(), runner, self.stdout, self.stderr
+            )
+        self.assertEqual(value, 5)
+        mock_watch.assert_called_once_with(
+            mock.ANY, runner, self.stdout, self.stderr, max_timeout=None,
+            output_timeout=None
+        )
+
+
+# TestSpawn {{{1
+@unittest.skipUnless(hasattr(os, 'posix_spawn'), "needs os.posix_spawn")
+class TestSpawn(unittest.TestCase):
+    """Test the posix_spawn backend.
+    """
+    def test_can_posix_spawn(self):
+        """test_process | can_posix_spawn
+        """
+        with tempfile.TemporaryFile() as filehandle:
+            for kwargs in (
+                    {},
+                    {'stdout': subprocess.PIPE, 'stderr': subprocess.STDOUT,
+                     'shell': True, 'bufsize': 0, 'env': {}},
+                    {'stdout': filehandle, 'stderr': filehandle.fileno()},
+                    {'close_fds': True},
+                    {'cwd': "/", 'env': {}}):
+                self.assertTrue(shprocess.can_posix_spawn(kwargs), kwargs)
+        for kwargs in (
+                {'preexec_fn': lambda: None},
+                {'stdin': subprocess.PIPE},
+                {'start_new_session': True},
+                {'universal_newlines': True},
+                {'close_fds': False},
+                {'stdout': subprocess.DEVNULL},
+                {'stderr': subprocess.PIPE}):
+            self.assertFalse(shprocess.can_posix_spawn(kwargs), kwargs)
+
+    def test_posix_spawn_pipe(self):
+        """test_process | posix_spawn_subprocess with a pipe
+        """
+        handle = shprocess.posix_spawn_subprocess(
+            [sys.executable, "-c",
+             "import os, sys; print(os.environ['FOO']); "
+             "sys.stderr.write('bar'); sys.exit(3)"],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            env={'FOO': 'foo'}
+        )
+        self.assertEqual(
+            to_unicode(handle.stdout.read()).split(), ["foo", "bar"]
+        )
+        handle.stdout.close()
+        self.assertEqual(handle.wait(), 3)
+        self.assertEqual(handle.poll(), 3)
+
+    def test_posix_spawn_files(self):
+        """test_process | posix_spawn_subprocess shell command to files
+        """
+        stdout = tempfile.TemporaryFile()
+        stderr = tempfile.TemporaryFile()
+        try:
+            handle = shprocess.posix_spawn_subprocess(
+                "echo out; echo err >&2", stdout=stdout, stderr=stderr,
+                shell=True
+            )
+            self.assertEqual(handle.wait(), 0)
+            self.assertTrue(handle.stdout is None)
+            for filehandle, expected in ((stdout, "out"), (stderr, "err")):
+                filehandle.seek(0)
+                self.assertEqual(to_unicode(filehandle.read()).strip(),
+                                 expected)
+        finally:
+            stdout.close()
+            stderr.close()
+
+    def test_posix_spawn_kill(self):
+        """test_process | SpawnedProcess kill and signal returncode
+        """
+        handle = shprocess.posix_spawn_subprocess(
+            [sys.executable, "-c", "import time; time.sleep(300)"]
+        )
+        self.assertEqual(handle.poll(), None)
+        handle.kill()
+        self.assertEqual(handle.wait(), -9)
+        # Killing an exited process is a noop.
+        handle.kill()
+
+    def test_posix_spawn_nonexistent(self):
+        """test_process | posix_spawn_subprocess nonexistent command
+        """
+        self.assertRaises(OSError, shprocess.posix_spawn_subprocess,
+                          ["this_command_should_not_exist"],
+                          stdout=subprocess.PIPE)
+        queue = Queue()
+        self.assertRaises(
+            ScriptHarnessError, shprocess.command_subprocess_batched,
+            queue, ["this_command_should_not_exist"],
+            spawn_backend=shprocess.SPAWN_POSIX
+        )
+
+    def test_spawn_subprocess(self):
+        """test_process | spawn_subprocess picks a backend
+        """
+        command = [sys.executable, "-c", "pass"]
+        handle = shprocess.spawn_subprocess(
+            command, spawn_backend=shprocess.SPAWN_POSIX
+        )
+        self.assertTrue(isinstance(handle, shprocess.SpawnedProcess))
+        self.assertEqual(handle.wait(), 0)
+        for kwargs in ({'spawn_backend': shprocess.SPAWN_POSIX,
+                        'stdin': subprocess.PIPE},
+                       {'cwd': "/"}):
+            handle = shprocess.spawn_subprocess(command, **kwargs)
+            self.assertTrue(isinstance(handle, subprocess.Popen))
+            self.assertEqual(handle.wait(), 0)
+
+    def test_posix_spawn_cwd(self):
+        """test_process | posix_spawn_subprocess with a cwd
+        """
+        tmpdir = os.path.realpath(tempfile.mkdtemp())
+        try:
+            with open(os.path.join(tmpdir, "script.sh"), "w") as filehandle:
+                filehandle.write("pwd\n")
+            for command, shell in (
+                    ([sys.executable, "-c", "import os; print(os.getcwd())"],
+                     False),
+                    ("pwd", True),
+                    (["/bin/sh", "./script.sh"], False)):
+                handle = shprocess.spawn_subprocess(
+                    command, spawn_backend=shprocess.SPAWN_POSIX, cwd=tmpdir,
+                    stdout=subprocess.PIPE, shell=shell
+                )
+                self.assertTrue(isinstance(handle, shprocess.SpawnedProcess))
+                self.assertEqual(to_unicode(handle.stdout.read()).strip(),
+                                 tmpdir)
+                handle.stdout.close()
+                self.assertEqual(handle.wait(), 0)
+            for command, cwd in (
+                    (["./this_command_should_not_exist"], tmpdir),
+                    ([sys.executable, "-c", "pass"],
+                     os.path.join(tmpdir, "nonexistent"))):
+                self.assertRaises(OSError, shprocess.posix_spawn_subprocess,
+                                  command, cwd=cwd)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_posix_spawn_signals(self):
+        """test_process | SPAWN_POSIX restores SIGPIPE and SIGXFSZ like Popen
+        """
+        if not os.path.exists("/proc/self/status"):
+            raise unittest.SkipTest("needs /proc")
+        # Not python, which ignores SIGPIPE and SIGXFSZ itself.
+        command = ["grep", "SigIgn", "/proc/self/status"]
+        mask = sum(1 << (num - 1) for num in shprocess.RESTORE_SIGNALS)
+        ignored = []
+        for backend in shprocess.SPAWN_BACKENDS:
+            handle = shprocess.spawn_subprocess(
+                command, spawn_backend=backend, stdout=subprocess.PIPE
+            )
+            output = to_unicode(handle.stdout.read()).split()[-1]
+            handle.stdout.close()
+            self.assertEqual(handle.wait(), 0)
+            ignored.append(int(output, 16) & mask)
+        self.assertEqual(ignored, [0, 0])
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test scriptharness/profiler.py
+
+Attributes:
+  TEST_DIR (str): the directory to write test reports to
+  TEST_REPORT (str): the report path
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import json
+import os
+import scriptharness.actions as actions
+import scriptharness.commands as commands
+from scriptharness.config import get_config_template
+from scriptharness.exceptions import ScriptHarnessFatal
+import scriptharness.profiler as profiler
+import scriptharness.script as script
+import shutil
+import sys
+import unittest
+from . import LoggerReplacement
+
+TEST_DIR = "this_dir_should_not_exist"
+TEST_REPORT = os.path.join(TEST_DIR, "profile.json")
+
+
+# Helper functions {{{1
+def cleanup():
+    """Cleanliness"""
+    for path in (TEST_DIR, "artifacts"):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+
+# TestProfile {{{1
+class TestProfile(unittest.TestCase):
+    """Test Profile and the sampling helpers
+    """
+    def test_update(self):
+        """test_profiler | Profile.update() keeps the last sample per pid
+        """
+        profile = profiler.Profile("test", start_time=10.)
+        profile.update({1: (1., .5, 100, 10, 20), 2: (2., 0., 300, 0, 5)})
+        profile.update({1: (1.5, .5, 200, 10, 30)})
+        self.assertEqual(profile.rss, 200)
+        self.assertEqual(profile.peak_rss, 400)
+        self.assertEqual(profile.cpu_user, 3.5)
+        self.assertEqual(profile.cpu_system, .5)
+        self.assertEqual(profile.read_bytes, 10)
+        self.assertEqual(profile.write_bytes, 35)
+        profile.end_time = 12.5
+        result = profile.as_dict()
+        self.assertEqual(result['wall_time'], 2.5)
+        self.assertEqual(sorted(result.keys()), sorted(
+            ['name', 'start_time', 'end_time'] + list(profiler.METRICS)
+        ))
+
+    def test_sample_tree(self):
+        """test_profiler | sample_tree() of this process and a missing pid
+        """
+        samples = profiler.sample_tree(os.getpid())
+        self.assertTrue(samples[os.getpid()][2] > 0)
+        self.assertEqual(profiler.sample_tree(2 ** 22 + 1), {})
+
+
+# TestProfiler {{{1
+class TestProfiler(unittest.TestCase):
+    """Test profiling a Script
+    """
+    def setUp(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def tearDown(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def test_script(self):
+        """test_profiler | profile a Script's actions and commands
+        """
+        command = [sys.executable, "-c", "import time; time.sleep(.5)"]
+
+        def one(_):
+            """Run commands in this thread and from run_many()"""
+            commands.run(command, logger=LoggerReplacement())
+            commands.run_many([command], logger=LoggerReplacement())
+
+        def two(_):
+            """Noop"""
+            pass
+
+        action_list = [
+            actions.Action("one", function=one),
+            actions.Action("two", function=two),
+        ]
+        scr = script.Script(
+            action_list, get_config_template(all_actions=action_list),
+            cmdln_args=[]
+        )
+        prof = profiler.enable_profiling(scr, path=TEST_REPORT,
+                                         interval=.02)
+        scr.run()
+        self.assertEqual(commands.LISTENERS[commands.PRE_COMMAND], [])
+        with open(TEST_REPORT) as filehandle:
+            report = json.load(filehandle)
+        self.assertEqual([x['name'] for x in report['actions']],
+                         ["one", "two"])
+        self.assertEqual([x['action'] for x in report['commands']],
+                         ["one", "one"])
+        for entry in report['commands']:
+            self.assertTrue(entry['wall_time'] >= .5)
+            self.assertTrue(entry['peak_rss'] > 0)
+        one_profile = action_list[0].history['profile']
+        self.assertEqual(one_profile, report['actions'][0])
+        self.assertTrue(one_profile['wall_time'] >= 1.)
+        self.assertTrue(one_profile['peak_rss'] >= max(
+            [x['peak_rss'] for x in report['commands']]
+        ))
+        self.assertTrue(
+            report['run']['cpu_user'] >= sum(
+                [x['cpu_user'] for x in report['actions']]
+            ) - .05
+        )
+        lines = prof.summary()
+        self.assertTrue(lines[1].startswith("one "))
+        self.assertTrue(lines[3].startswith("Total "))
+        self.assertEqual(lines[4], "Slowest of 2 commands:")
+        self.assertTrue(lines[5].endswith(" ".join(command)))
+
+    def test_artifact_dir(self):
+        """test_profiler | the report defaults to the artifact dir
+        """
+        action_list = [actions.Action("one", function=lambda _: None)]
+        scr = script.Script(
+            action_list, get_config_template(all_actions=action_list),
+            cmdln_args=[],
+            initial_config={'scriptharness_artifact_dir': TEST_DIR}
+        )
+        profiler.enable_profiling(scr)
+        scr.run()
+        with open(TEST_REPORT) as filehandle:
+            report = json.load(filehandle)
+        self.assertEqual(report['commands'], [])
+        self.assertEqual(report['actions'][0]['name'], "one")
+
+    def test_fatal(self):
+        """test_profiler | a fatal action still stops profiling and reports
+        """
+        def fatal(_):
+            """Raise ScriptHarnessFatal"""
+            raise ScriptHarnessFatal("fatal")
+
+        action_list = [actions.Action("one", function=fatal)]
+        scr = script.Script(
+            action_list, get_config_template(all_actions=action_list),
+            cmdln_args=[]
+        )
+        prof = profiler.enable_profiling(scr, path=TEST_REPORT)
+        self.assertRaises(ScriptHarnessFatal, scr.run)
+        self.assertTrue(prof.finished)
+        self.assertTrue(prof.sampler is None)
+        self.assertEqual(commands.LISTENERS[commands.PRE_COMMAND], [])
+        self.assertEqual(commands.LISTENERS[commands.POST_COMMAND], [])
+        with open(TEST_REPORT) as filehandle:
+            report = json.load(filehandle)
+        self.assertEqual(report['actions'][0]['name'], "one")
+        self.assertTrue(report['run']['end_time'] is not None)
+        # finish() only runs once
+        os.remove(TEST_REPORT)
+        prof.finish()
+        self.assertFalse(os.path.exists(TEST_REPORT))
+
+    def test_runner_not_sampled(self):
+        """test_profiler | the multiprocessing runner isn't charged
+        """
+        command = commands.Command(
+            [sys.executable, "-c", "import time; time.sleep(.5)"],
+            logger=LoggerReplacement(),
+            runner=commands.RUNNER_MULTIPROCESSING
+        )
+        prof = profiler.Profiler(interval=.02)
+        prof.add_command_listeners()
+        prof.start()
+        try:
+            command.run()
+        finally:
+            prof.stop()
+            prof.remove_command_listeners()
+        profile, _ = prof.commands[0]
+        self.assertTrue(profile.processes)
+        self.assertFalse(command.history['runner_pid'] in profile.processes)
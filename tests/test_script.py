@@ -6,14 +6,17 @@ from __future__ import absolute_import, division, print_function, \
                        unicode_literals
 import argparse
 import json
+import mock
 import os
 import scriptharness.actions as actions
 from scriptharness.config import get_config_template, update_dirs, \
     DEFAULT_CONFIG_DEFINITION
 from scriptharness.exceptions import ScriptHarnessException, ScriptHarnessFatal
 import scriptharness.script as script
+from scriptharness.structures import FrozenDict
 import shutil
 import six
+import time
 import unittest
 
 if six.PY3:
@@ -265,9 +268,12 @@ class TestScript(unittest.TestCase):
                          action_names=["one", "three", "five"])
         scr.add_listener(self.get_timing_func("post_fatal3"), "post_fatal",
                          action_names=["two", "four"])
-        self.assertRaises(ScriptHarnessFatal, scr.run)
+        with mock.patch('scriptharness.script.flush_async_handlers') as \
+                mock_flush:
+            self.assertRaises(ScriptHarnessFatal, scr.run)
         self.assertEqual(self.timings, ["one", "fatal", "post_fatal1",
                                         "post_fatal3"])
+        mock_flush.assert_called_once_with()
 
     def test_bad_phase_context(self):
         """test_script | bad phase build_context
@@ -292,6 +298,99 @@ class TestScript(unittest.TestCase):
         self.assertRaises(ScriptHarnessException, script.Script,
                           action_list, template, cmdln_args=cmdln_args)
 
+    def get_sleep_action(self, name, **kwargs):
+        """Helper function to generate Actions that take a little while"""
+        def func(context):
+            """Test function"""
+            assert context  # silence pylint
+            self.timings.append("start %s" % name)
+            time.sleep(.2)
+            self.timings.append("end %s" % name)
+        return actions.Action(name, function=func, **kwargs)
+
+    def test_bad_requires(self):
+        """test_script | Action requires an action that isn't defined before it
+        """
+        for action_list in (
+                [self.get_action("one"),
+                 actions.Action("two", function=noop, requires=["three"]),
+                 self.get_action("three")],
+                [actions.Action("one", function=noop, requires=["one"])]):
+            template = get_config_template(all_actions=action_list)
+            self.assertRaises(ScriptHarnessException, script.Script,
+                              action_list, template, cmdln_args=[])
+
+    def test_parallel_run(self):
+        """test_script | run() with --action-workers
+        """
+        action_list = [
+            self.get_sleep_action("one", requires=[]),
+            self.get_sleep_action("two", requires=[]),
+            self.get_action("three", enabled=False),
+            self.get_sleep_action("four", requires=["one", "two"]),
+            self.get_sleep_action("five", requires=["three"]),
+        ]
+        template = get_config_template(all_actions=action_list)
+        scr = script.Script(action_list, template,
+                            cmdln_args=["--action-workers", "3"])
+        scr.add_listener(self.get_timing_func("pre_action"), "pre_action",
+                         action_names=["four"])
+        scr.add_listener(self.get_timing_func("post_run"), "post_run")
+        start = time.time()
+        scr.run()
+        self.assertTrue(time.time() - start < .6)
+        print(self.timings)
+        self.assertEqual(len(self.timings), 10)
+        self.assertEqual(self.timings[-1], "post_run")
+        self.assertEqual(
+            set(self.timings[:3]), set(["start one", "start two",
+                                        "start five"])
+        )
+        four = self.timings.index("pre_action")
+        self.assertTrue(self.timings.index("end one") < four)
+        self.assertTrue(self.timings.index("end two") < four)
+        self.assertEqual(self.timings[four + 1], "start four")
+        for action in scr.actions:
+            if action.enabled:
+                self.assertEqual(action.history['status'], 0)
+
+    def test_parallel_undeclared(self):
+        """test_script | --action-workers runs undeclared actions in order
+        """
+        action_list = [
+            self.get_sleep_action("one"),
+            self.get_sleep_action("two", requires=[]),
+            self.get_action("three", enabled=False),
+            self.get_sleep_action("four"),
+        ]
+        template = get_config_template(all_actions=action_list)
+        scr = script.Script(action_list, template,
+                            cmdln_args=["--action-workers", "3"])
+        scr.run()
+        # two is independent; four waits for two, the last enabled action
+        self.assertEqual(set(self.timings[:2]),
+                         set(["start one", "start two"]))
+        self.assertEqual(self.timings[-2:], ["start four", "end four"])
+
+    def test_parallel_fatal(self):
+        """test_script | run() with --action-workers and a fatal action
+        """
+        action_list = [
+            actions.Action("one", function=self.raise_fatal),
+            self.get_sleep_action("two", requires=[]),
+            self.get_sleep_action("three", requires=["one"]),
+            self.get_sleep_action("four", requires=[]),
+        ]
+        template = get_config_template(all_actions=action_list)
+        scr = script.Script(action_list, template,
+                            cmdln_args=["--action-workers", "2"])
+        scr.add_listener(self.get_timing_func("post_fatal"), "post_fatal")
+        self.assertRaises(ScriptHarnessFatal, scr.run)
+        self.assertEqual(
+            sorted(self.timings),
+            ["end two", "fatal", "post_fatal", "start two"]
+        )
+
     def test_dump_config(self):
         """test_script | --dump-config
         """
@@ -380,3 +479,33 @@ class TestStrictScript(unittest.TestCase):
         """
         scr = self.get_script(cmdln_args="--actions three".split())
         self.assertRaises(ScriptHarnessException, scr.run)
+
+
+class TestFrozenScript(TestStrictScript):
+    """Test FrozenScript()
+    """
+    @staticmethod
+    def get_script(template=None, cmdln_args=None, initial_config=None):
+        """Create a FrozenScript for testing
+        """
+        action_list = [
+            get_action("one", change_config1),
+            get_action("two", change_config2),
+            get_action("three", change_attribute, enabled=False),
+        ]
+        template = template or get_config_template(all_actions=action_list)
+        return script.FrozenScript(action_list, template,
+                                   cmdln_args=cmdln_args or [],
+                                   initial_config=initial_config)
+
+    def test_frozen_config(self):
+        """test_script | FrozenScript config is hashable and shared
+        """
+        scr1 = self.get_script(initial_config={'a': {'b': [1]}})
+        scr2 = self.get_script(initial_config={'a': {'b': [1]}})
+        self.assertTrue(isinstance(scr1.config, FrozenDict))
+        self.assertTrue(scr1.config is scr2.config)
+        self.assertEqual({scr1.config: 1}[scr2.config], 1)
+        derived = scr1.config.derive(a={'b': [2]})
+        self.assertEqual(derived['a']['b'], (2, ))
+        self.assertEqual(scr1.config['a']['b'], (1, ))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test scriptharness/structured.py
+
+Attributes:
+  TEST_DIR (str): the directory to write test logs to
+  TEST_LOG (str): the structured log path
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import logging
+import os
+import scriptharness.actions as actions
+import scriptharness.commands as commands
+from scriptharness.config import get_config_template
+from scriptharness.errorlists import ErrorList
+from scriptharness.exceptions import ScriptHarnessError, \
+    ScriptHarnessException
+import scriptharness.script as script
+import scriptharness.status as status
+import scriptharness.structured as structured
+import shutil
+import sys
+import unittest
+from . import LoggerReplacement
+
+TEST_DIR = "this_dir_should_not_exist"
+TEST_LOG = os.path.join(TEST_DIR, "log.jsonl")
+
+
+# Helper functions {{{1
+def cleanup():
+    """Cleanliness"""
+    for path in (TEST_DIR, "artifacts"):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+def print_command(string, exit_code=0):
+    """Command line that prints a string and exits with exit_code"""
+    return [
+        sys.executable, "-c",
+        'from __future__ import print_function; import sys; print("%s"); '
+        'sys.exit(%d)' % (string, exit_code)
+    ]
+
+def run_parsed(string, exit_code=0, logger=None):
+    """Run a ParsedCommand, ignoring errors"""
+    command = commands.ParsedCommand(
+        print_command(string, exit_code), logger=logger or LoggerReplacement(),
+        error_list=ErrorList([{'substr': 'oops', 'level': logging.ERROR}]),
+    )
+    try:
+        command.run()
+    except ScriptHarnessError:
+        pass
+
+
+# TestStructuredLog {{{1
+class TestStructuredLog(unittest.TestCase):
+    """Test StructuredLog and StructuredLogReader
+    """
+    def setUp(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def tearDown(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def test_write(self):
+        """test_structured | StructuredLog.write() and index offsets
+        """
+        structured_log = structured.StructuredLog(TEST_LOG)
+        structured_log.write("log", msg="before")
+        structured_log.write("action_start", action="one")
+        structured_log.write("log", msg="é")
+        structured_log.write("action_end", action="one", status=0)
+        structured_log.close()
+        # writing after close is a noop
+        structured_log.write("log", msg="after")
+        reader = structured.StructuredLogReader(TEST_LOG)
+        self.assertEqual(
+            [entry['event'] for entry in reader.index],
+            ["action_start", "action_end"]
+        )
+        self.assertEqual(reader.actions()[0]['status'], 0)
+        self.assertEqual(
+            [event.get('msg') for event in reader.iter_action("one")],
+            [None, "é", None]
+        )
+        self.assertEqual(len(list(reader.iter_events())), 4)
+        self.assertRaises(ScriptHarnessException, list,
+                          reader.iter_action("two"))
+
+    def test_missing_index(self):
+        """test_structured | StructuredLogReader without an index
+        """
+        self.assertRaises(ScriptHarnessException,
+                          structured.StructuredLogReader, TEST_LOG)
+
+    def test_commands(self):
+        """test_structured | command events and log attribution
+        """
+        structured_log = structured.enable_structured_logging(TEST_LOG)
+        logger = logging.getLogger("test_structured")
+        logger.setLevel(logging.DEBUG)
+        try:
+            logger.info("outside")
+            run_parsed("good")
+            run_parsed("oops", exit_code=1, logger=logger)
+        finally:
+            structured_log.close()
+        self.assertEqual(commands.LISTENERS[commands.PRE_COMMAND], [])
+        self.assertFalse(structured_log.handler in logger.handlers)
+        reader = structured.StructuredLogReader(TEST_LOG)
+        self.assertEqual(len(reader.commands()), 2)
+        failed = reader.failed_commands()
+        self.assertEqual([entry['command_id'] for entry in failed], [2])
+        events = list(reader.iter_command(2))
+        self.assertEqual(events[0]['event'], "command_start")
+        self.assertEqual(events[-1]['event'], "command_end")
+        self.assertEqual(events[-1]['status'], status.ERROR)
+        self.assertEqual(events[-1]['parser']['num_errors'], 1)
+        self.assertTrue("oops" in [event.get('msg', '').strip()
+                                   for event in events])
+        self.assertTrue(
+            events[-1]['history']['end_time'] >=
+            events[0]['time']
+        )
+        for event in reader.iter_events():
+            if event.get('msg') == "outside":
+                self.assertEqual(event['command_id'], None)
+                self.assertEqual(event['level'], logging.INFO)
+                break
+        else:
+            self.fail("outside log event not found")
+
+
+# TestScriptActions {{{1
+class TestScriptActions(unittest.TestCase):
+    """Test StructuredLog action events
+    """
+    def setUp(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def tearDown(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def test_actions(self):
+        """test_structured | action events from a Script
+        """
+        def one(_):
+            """Run a command"""
+            run_parsed("one")
+
+        def two(_):
+            """Noop"""
+            pass
+
+        action_list = [
+            actions.Action("one", function=one),
+            actions.Action("two", function=two),
+        ]
+        scr = script.Script(
+            action_list, get_config_template(all_actions=action_list),
+            cmdln_args=[]
+        )
+        structured_log = structured.enable_structured_logging(
+            TEST_LOG, script=scr, logger_name="test_structured"
+        )
+        try:
+            scr.run()
+        finally:
+            structured_log.close()
+        reader = structured.StructuredLogReader(TEST_LOG)
+        self.assertEqual(
+            [(entry['action'], entry['status'])
+             for entry in reader.actions()],
+            [("one", status.SUCCESS), ("two", status.SUCCESS)]
+        )
+        events = list(reader.iter_action("one"))
+        self.assertEqual(
+            [event['event'] for event in events],
+            ["action_start", "command_start", "command_end", "action_end"]
+        )
+        self.assertEqual(events[1]['action'], "one")
@@ -10,17 +10,20 @@ Attributes:
   LOGGING_CONTROL_LIST (list): used to prepopulate LoggingList
   SECONDARY_DICT (dict): used to add to the LoggingDict
   SECONDARY_LIST (dict): used to add to the LoggingDict
-
-  TODO fix add_logging_to_obj recursion
 """
 from __future__ import absolute_import, division, print_function, \
                        unicode_literals
 from collections import OrderedDict
 from copy import deepcopy
+import json
 import mock
+import pickle
 import pprint
 from scriptharness.exceptions import ScriptHarnessException
 import scriptharness.structures as structures
+from scriptharness.structures import is_logging_class
+import threading
+import time
 import unittest
 from . import UNICODE_STRINGS, LOGGER_NAME, LoggerReplacement
 
@@ -250,6 +253,39 @@ class TestFullNames(unittest.TestCase):
         self.assertEqual(logdict['e'][2]['yurts'].full_name(),
                          "%s['e'][2]['yurts']" % NAME)
 
+    def test_cached_names(self):
+        """test_structures | full_name() is cached until re-parenting
+        """
+        logdict = get_logging_dict()
+        turtles = logdict['d']['turtles']
+        self.assertEqual(turtles.full_name(), "%s['d']['turtles']" % NAME)
+        logdict.recursively_set_parent(name="NEW")
+        self.assertEqual(turtles.full_name(), "NEW['d']['turtles']")
+        loglist = get_logging_list()
+        child = loglist[7]
+        self.assertEqual(child.full_name(), "%s[7]" % NAME)
+        with mock.patch('scriptharness.structures.logging'):
+            loglist.insert(0, 'zero')
+        self.assertEqual(child.full_name(), "%s[8]" % NAME)
+
+    def test_disabled_logger(self):
+        """test_structures | don't build messages if the logger is disabled
+        """
+        loglist = get_logging_list()
+        loglist.logger_name = LOGGER_NAME
+        with mock.patch('scriptharness.structures.logging') as mock_logging:
+            logger = mock.MagicMock()
+            logger.isEnabledFor.return_value = False
+            mock_logging.getLogger.return_value = logger
+            with mock.patch('scriptharness.structures.pprint') as mock_pprint:
+                with mock.patch.object(loglist, 'full_name') as full_name:
+                    loglist.append({'a': 1})
+                    loglist.extend([1, 2])
+            self.assertFalse(full_name.called)
+            self.assertFalse(mock_pprint.pformat.called)
+            self.assertFalse(logger.log.called)
+        self.assertEqual(loglist[-3], {'a': 1})
+
     @mock.patch('scriptharness.structures.logging')
     def test_unicode_names(self, mock_logging):
         """test_structures | Try unicode names!
@@ -478,6 +514,42 @@ class TestLoggingDict(TestLoggingClass):
             self.assertTrue(isinstance(logdict['a'], structures.LoggingClass))
             self.assertEqual(logdict.muted, logdict['a'].muted)
 
+    @mock.patch('scriptharness.structures.logging')
+    def test_bulk_update(self, mock_logging):
+        """test_structures | logging dict bulk_update
+        """
+        unmuted_logdict = get_logging_dict()
+        muted_logdict = get_logging_dict(muted=True)
+        for logdict, strings in ((unmuted_logdict, self.strings),
+                                 (muted_logdict, self.muted_strings)):
+            self.get_logger_replacement(mock_logging)
+            logdict.bulk_update(['a', 1, 'b', [2], 'z', {'y': []}])
+            self.verify_log([
+                "%s: %s" % (NAME, strings['bulk_update'] % {
+                    'num_changed': 2, 'num_keys': 3, 'keys': "['b', 'z']",
+                }),
+            ])
+            self.assertEqual(logdict['z']['y'].full_name(),
+                             "%s['z']['y']" % NAME)
+            self.assertEqual(logdict.muted, logdict['b'].muted)
+
+    def test_update_disabled(self):
+        """test_structures | logging dict update with the logger disabled
+        """
+        for method in ('update', 'bulk_update'):
+            logdict = get_logging_dict()
+            with mock.patch('scriptharness.structures.logging') \
+                    as mock_logging:
+                logger = mock.MagicMock()
+                logger.isEnabledFor.return_value = False
+                mock_logging.getLogger.return_value = logger
+                getattr(logdict, method)({'a': 2, 'c': {'e': (5, {})}})
+            self.assertFalse(logger.log.called)
+            self.assertEqual(logdict['a'], 2)
+            self.assertTrue(dict.__getitem__(logdict, 'c').parent is logdict)
+            self.assertEqual(logdict['c']['e'][1].full_name(),
+                             "%s['c']['e'][1]" % NAME)
+
 
 # TestLoggingList {{{2
 class TestLoggingList(TestLoggingClass):
@@ -594,6 +666,7 @@ class TestLoggingList(TestLoggingClass):
         )
         self.assertTrue(isinstance(loglist[-1], structures.LoggingClass))
         self.assertEqual(loglist.muted, loglist[-1].muted)
+        self.assertEqual(loglist[-1].full_name(), "[%d]" % (len(loglist) - 1))
 
     @mock.patch('scriptharness.structures.logging')
     def test_unmuted_extend(self, mock_logging):
@@ -716,8 +789,7 @@ class TestAddLogging(unittest.TestCase):
     in other ways
     """
     def test_recursion(self):
-        """test_structures | add_logging_to_obj recursion raises RuntimeError
-        Known issue: Rewrite test when this is fixed.
+        """test_structures | add_logging_to_obj with recursive structures
         """
         one = {}
         two = {}
@@ -727,10 +799,89 @@ class TestAddLogging(unittest.TestCase):
         four = []
         three.append(four)
         four.append(three)
-        self.assertRaises(RuntimeError, structures.add_logging_to_obj, one)
-        self.assertRaises(RuntimeError, structures.add_logging_to_obj, two)
-        self.assertRaises(RuntimeError, structures.add_logging_to_obj, three)
-        self.assertRaises(RuntimeError, structures.add_logging_to_obj, four)
+        logdict = structures.add_logging_to_obj(one)
+        self.assertEqual(logdict['two']['one']['two'].full_name(),
+                         "['two']['one']['two']")
+        loglist = structures.add_logging_to_obj(three)
+        self.assertTrue(isinstance(loglist[0][0][0], structures.LoggingList))
+
+    def test_lazy(self):
+        """test_structures | LoggingDict adds logging to children on access
+        """
+        control = deepcopy(LOGGING_CONTROL_DICT)
+        logdict = structures.LoggingDict(control)
+        logdict.recursively_set_parent(name=NAME)
+        # the input isn't modified, and the children aren't wrapped yet
+        self.assertEqual(control, LOGGING_CONTROL_DICT)
+        self.assertFalse(is_logging_class(control['e']))
+        self.assertFalse(is_logging_class(dict.__getitem__(logdict, 'e')))
+        self.assertTrue(is_logging_class(logdict.get('e')))
+        self.assertTrue(logdict['e'] is logdict['e'])
+        self.assertEqual(logdict['e'][-1]['yurts'][0], 'yurt4')
+        self.assertEqual(logdict['e'][-1]['yurts'].full_name(),
+                         "%s['e'][2]['yurts']" % NAME)
+        for value in logdict.values():
+            if isinstance(value, (dict, list, tuple)):
+                self.assertTrue(is_logging_class(value))
+        # changes through the LoggingDict don't affect the input
+        logdict['c']['d'] = '5'
+        self.assertEqual(control['c']['d'], '4')
+
+    def test_lazy_threads(self):
+        """test_structures | threads sharing a LoggingDict get one wrapper
+        """
+        add_logging_to_obj = structures.add_logging_to_obj
+
+        def slow_add_logging(*args, **kwargs):
+            """Give the other thread time to wrap the child too"""
+            time.sleep(.1)
+            return add_logging_to_obj(*args, **kwargs)
+
+        for container, key in (
+                (structures.LoggingDict({'d': {'turtles': []}}), 'd'),
+                (structures.LoggingList([{'turtles': []}]), 0)):
+
+            def change(value, container=container, key=key):
+                """Change the same nested child from two threads"""
+                container[key]['turtles'].append(value)
+
+            with mock.patch('scriptharness.structures.add_logging_to_obj',
+                            side_effect=slow_add_logging):
+                threads = [threading.Thread(target=change, args=(value, ))
+                           for value in ('one', 'two')]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual(sorted(container[key]['turtles']),
+                             ['one', 'two'])
+
+    def test_lazy_accessors(self):
+        """test_structures | LoggingDict copies and popitem add logging
+        """
+        accessors = {
+            'dict': dict,
+            'copy': lambda logdict: logdict.copy(),
+            'update': lambda logdict: dict({}, **logdict),
+            'popitem': lambda logdict: dict([logdict.popitem()]),
+        }
+        for name, accessor in accessors.items():
+            control = deepcopy(LOGGING_CONTROL_DICT)
+            logdict = structures.LoggingDict({'c': control['c']})
+            logdict.recursively_set_parent(name=NAME)
+            with mock.patch('logging.getLogger') as mock_logger:
+                child = accessor(logdict)['c']
+                self.assertTrue(is_logging_class(child), msg=name)
+                self.assertTrue(child.parent is logdict, msg=name)
+                child['d'] = '5'
+                self.assertTrue(mock_logger.return_value.log.called,
+                                msg=name)
+            # the input, which was shared until now, isn't changed
+            self.assertEqual(control['c']['d'], '4', msg=name)
+        loglist = structures.LoggingList(deepcopy(LOGGING_CONTROL_LIST))
+        for value in loglist.copy():
+            if isinstance(value, (dict, list, tuple)):
+                self.assertTrue(is_logging_class(value))
 
 
 # Test ReadOnlyDict {{{1
@@ -928,3 +1079,132 @@ class TestDeepcopyROD(unittest.TestCase):
         rod2.lock()
         with self.assertRaises(ScriptHarnessException):
             rod2['e'] = 'hey'
+
+
+# Test FrozenDict {{{1
+class TestFrozenDict(unittest.TestCase):
+    """Test FrozenDict and freeze()
+    """
+    def test_freeze(self):
+        """test_structures | freeze() interns equal configs
+        """
+        frozen = structures.freeze(LOGGING_CONTROL_DICT)
+        self.assertEqual(frozen, LOGGING_CONTROL_DICT)
+        self.assertTrue(frozen is structures.freeze(LOGGING_CONTROL_DICT))
+        self.assertTrue(isinstance(frozen['e'], structures.FrozenList))
+        self.assertTrue(isinstance(frozen['e'][2], structures.FrozenDict))
+        self.assertTrue(
+            frozen['e'][2] is structures.freeze(LOGGING_CONTROL_DICT['e'][2])
+        )
+        self.assertEqual(hash(frozen), hash(structures.freeze(frozen)))
+        self.assertEqual(structures.freeze({'a': {1, 2}})['a'],
+                         frozenset([1, 2]))
+        self.assertRaises(ScriptHarnessException, structures.freeze,
+                          {'a': bytearray()})
+
+    def test_types(self):
+        """test_structures | freeze() doesn't share across types
+        """
+        one = structures.freeze({'a': {'b': 1}})
+        two = structures.freeze({'a': {'b': True}})
+        self.assertFalse(one is two)
+        self.assertTrue(two['a']['b'] is True)
+
+    def test_frozen(self):
+        """test_structures | FrozenDict changes should raise
+        """
+        frozen = structures.freeze(RO_CONTROL_DICT)
+        frozen.lock()
+        for method, args in (('__setitem__', ('a', 2)), ('__delitem__', 'a'),
+                             ('clear', ()), ('pop', ('a', )),
+                             ('popitem', ()), ('setdefault', ('z', 1)),
+                             ('update', ({}, ))):
+            self.assertRaises(ScriptHarnessException,
+                              getattr(frozen, method), *args)
+        self.assertRaises(AttributeError, getattr, frozen['e'], 'append')
+
+    def test_lock_empty(self):
+        """test_structures | FrozenDict.lock() on an empty FrozenDict
+        """
+        frozen = structures.freeze({})
+        self.assertEqual(frozen.lock(), None)
+        self.assertEqual(frozen, {})
+
+    def test_derive(self):
+        """test_structures | FrozenDict.derive() and without()
+        """
+        frozen = structures.freeze(RO_CONTROL_DICT)
+        derived = frozen.derive({'a': 2}, f=[3])
+        self.assertEqual(frozen['a'], 1)
+        self.assertEqual(derived['a'], 2)
+        self.assertEqual(derived['f'], (3, ))
+        self.assertTrue(derived['e'] is frozen['e'])
+        self.assertFalse('c' in frozen.without('c', 'nonexistent'))
+        self.assertTrue(frozen.derive() is frozen)
+
+    def test_copies(self):
+        """test_structures | FrozenDict deepcopy, copy and pickle
+        """
+        frozen = structures.freeze(RO_CONTROL_DICT)
+        dup = deepcopy(frozen)
+        self.assertEqual(dup, RO_CONTROL_DICT)
+        self.assertTrue(type(dup) is dict)
+        self.assertTrue(type(dup['e']) is list)
+        dup['e'].append(1)
+        self.assertEqual(pickle.loads(pickle.dumps(frozen)), frozen)
+        self.assertEqual(json.loads(json.dumps(frozen)), RO_CONTROL_DICT)
+
+
+# Test snapshot() {{{1
+class TestSnapshot(unittest.TestCase):
+    """Test snapshot()
+    """
+    def test_logging_dict(self):
+        """test_structures | LoggingDict.snapshot()
+        """
+        logdict = get_logging_dict()
+        logdict['e'][2]['turtles'].append('turtle7')
+        snap = logdict.snapshot()
+        expected = deepcopy(LOGGING_CONTROL_DICT)
+        expected['e'][2]['turtles'].append('turtle7')
+        self.assertEqual(snap, expected)
+        self.assertTrue(type(snap) is dict)
+        self.assertTrue(type(snap['e']) is list)
+        self.assertTrue(type(snap['d']['yurts']) is tuple)
+        # unaccessed children don't get logging
+        self.assertFalse(is_logging_class(dict.__getitem__(logdict, 'c')))
+        snap['e'].append(1)
+        self.assertEqual(len(logdict['e']), 3)
+
+    def test_read_only_dict(self):
+        """test_structures | ReadOnlyDict.snapshot()
+        """
+        rod = get_locked_rod()
+        snap = rod.snapshot()
+        self.assertEqual(snap, RO_CONTROL_DICT)
+        self.assertTrue(type(snap) is dict)
+        self.assertTrue(type(snap['e']) is list)
+        self.assertTrue(type(snap['e'][2]['turtles']) is list)
+
+    def test_frozen(self):
+        """test_structures | snapshot(frozen=True)
+        """
+        logdict = get_logging_dict()
+        frozen = logdict.snapshot(frozen=True)
+        self.assertTrue(isinstance(frozen, structures.FrozenDict))
+        self.assertTrue(frozen is structures.freeze(LOGGING_CONTROL_DICT))
+        self.assertTrue(frozen.snapshot(frozen=True) is frozen)
+        self.assertEqual(frozen, LOGGING_CONTROL_DICT)
+        # tuples are frozen as FrozenLists, so they thaw to lists
+        self.assertEqual(frozen.snapshot()['d']['yurts'],
+                         list(LOGGING_CONTROL_DICT['d']['yurts']))
+
+    def test_shared(self):
+        """test_structures | snapshot() keeps shared and other objects
+        """
+        shared = [1]
+        obj = OrderedDict(a=1)
+        snap = structures.snapshot({'a': shared, 'b': shared, 'c': obj})
+        self.assertTrue(snap['a'] is snap['b'])
+        self.assertFalse(snap['a'] is shared)
+        self.assertEqual(snap['c'], obj)
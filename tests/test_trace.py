@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test scriptharness/trace.py
+
+Attributes:
+  TEST_DIR (str): the directory to write test traces to
+  TEST_TRACE (str): the trace path
+"""
+from __future__ import absolute_import, division, print_function, \
+                       unicode_literals
+import json
+import os
+import scriptharness.actions as actions
+import scriptharness.commands as commands
+from scriptharness.config import get_config_template
+from scriptharness.exceptions import ScriptHarnessFatal
+import scriptharness.script as script
+import scriptharness.trace as trace
+import shutil
+import sys
+import unittest
+from . import LoggerReplacement
+
+TEST_DIR = "this_dir_should_not_exist"
+TEST_TRACE = os.path.join(TEST_DIR, "trace.json")
+
+
+# Helper functions {{{1
+def cleanup():
+    """Cleanliness"""
+    trace.stop_tracing()
+    for path in (TEST_DIR, "artifacts"):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+def find_span(events, name):
+    """Find the complete event named `name`"""
+    for event in events:
+        if event['ph'] == 'X' and event['name'] == name:
+            return event
+    raise AssertionError("No %s span!" % name)
+
+def contains(outer, inner):
+    """Does the span `outer` contain the span `inner`, in the same thread?
+    """
+    return outer['tid'] == inner['tid'] and outer['ts'] <= inner['ts'] and \
+        inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+
+# TestTrace {{{1
+class TestTrace(unittest.TestCase):
+    """Test tracing
+    """
+    def setUp(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def tearDown(self):
+        """Cleanliness"""
+        assert self  # silence pylint
+        cleanup()
+
+    def test_disabled(self):
+        """test_trace | span() is a shared noop when tracing is off
+        """
+        self.assertFalse(trace.tracing_enabled())
+        self.assertTrue(trace.span("foo", bar=1) is trace.NULL_SPAN)
+        with trace.span("foo"):
+            pass
+        self.assertEqual(trace.stop_tracing(), None)
+
+    def test_spans(self):
+        """test_trace | nested spans, exceptions, and the trace file
+        """
+        tracer = trace.start_tracing()
+        self.assertTrue(trace.start_tracing() is tracer)
+        with trace.span("outer", category="test", key="value"):
+            with trace.span("inner"):
+                pass
+            try:
+                with trace.span("error"):
+                    raise ValueError("test")
+            except ValueError:
+                pass
+        self.assertTrue(trace.stop_tracing(TEST_TRACE) is tracer)
+        self.assertFalse(trace.tracing_enabled())
+        with open(TEST_TRACE) as filehandle:
+            events = json.load(filehandle)['traceEvents']
+        self.assertEqual(events[0]['name'], 'process_name')
+        self.assertEqual(events[1]['name'], 'thread_name')
+        outer = find_span(events, "outer")
+        self.assertEqual(outer['args'], {'key': 'value'})
+        self.assertEqual(outer['cat'], "test")
+        self.assertTrue(contains(outer, find_span(events, "inner")))
+        self.assertEqual(find_span(events, "error")['args'],
+                         {'exception': 'ValueError'})
+        # sorted by start time, so parents come first
+        self.assertEqual([event['name'] for event in events[2:]],
+                         ["outer", "inner", "error"])
+
+    def test_script(self):
+        """test_trace | --trace-file traces a Script run
+        """
+        command = [sys.executable, "-c", "pass"]
+
+        def one(_):
+            """Run a command"""
+            commands.run(command, logger=LoggerReplacement())
+
+        def two(_):
+            """Die"""
+            raise ScriptHarnessFatal("two")
+
+        def listener(_):
+            """Noop listener"""
+            pass
+
+        action_list = [
+            actions.Action("one", function=one),
+            actions.Action("two", function=two),
+        ]
+        scr = script.Script(
+            action_list, get_config_template(all_actions=action_list),
+            cmdln_args=["--trace-file", TEST_TRACE]
+        )
+        scr.add_listener(listener, script.PRE_ACTION)
+        self.assertRaises(ScriptHarnessFatal, scr.run)
+        self.assertFalse(trace.tracing_enabled())
+        with open(TEST_TRACE) as filehandle:
+            events = json.load(filehandle)['traceEvents']
+        run = find_span(events, "run")
+        self.assertEqual(run['args']['exception'], "ScriptHarnessFatal")
+        action_one = find_span(events, "one")
+        self.assertEqual(action_one['cat'], "action")
+        function = [event for event in events
+                    if event.get('cat') == "function"][0]
+        self.assertEqual(function['args'], {'action': 'one'})
+        command_span = find_span(events, os.path.basename(sys.executable))
+        self.assertEqual(command_span['cat'], "command")
+        self.assertEqual(command_span['args']['command'], command)
+        listener_span = [event for event in events
+                         if event.get('cat') == "listener"][0]
+        self.assertEqual(listener_span['args'],
+                         {'phase': script.PRE_ACTION})
+        self.assertTrue(contains(run, action_one))
+        self.assertTrue(contains(action_one, listener_span))
+        self.assertTrue(contains(action_one, function))
+        self.assertTrue(contains(function, command_span))
+        self.assertTrue(contains(run, find_span(events, "two")))